@@ -0,0 +1,77 @@
+"""Micro-benchmark du découpage en chunks : ancien algorithme (quadratique par chunk) vs rag_core.chunking.
+
+Usage (depuis la racine du dépôt):
+    python -m benchmarks.bench_chunker --sizes-mb 1 4 --max-length 500
+"""
+import argparse
+import random
+import time
+from typing import Callable, List
+
+from rag_core.chunking import iter_chunks
+
+VOCABULARY = (
+    "ventousage stationnement tournage plateau régie mairie autorisation PPMS logistique "
+    "production véhicules technique urgence devis références série publicité événement "
+    "coordination installation base vie équipe Paris Lyon Marseille réglementaire"
+).split()
+
+
+def legacy_chunk_text(text: str, max_length: int = 500) -> List[str]:
+    """Copie de l'ancien DataPreprocessor.chunk_text (référence)."""
+    words = text.split()
+    chunks = []
+    current_chunk = []
+    for word in words:
+        if len(" ".join(current_chunk + [word])) <= max_length:
+            current_chunk.append(word)
+        else:
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [word]
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+    return chunks
+
+
+def synthetic_text(size_bytes: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    parts, total = [], 0
+    while total < size_bytes:
+        sentence = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(6, 30)))
+        sentence = sentence.capitalize() + rng.choice([". ", ". ", "! ", " | "])
+        parts.append(sentence)
+        total += len(sentence.encode("utf-8"))
+    return "".join(parts)
+
+
+def bench(name: str, fn: Callable[[], List[str]], size_mb: float, repeat: int) -> None:
+    best = float("inf")
+    chunks = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = fn()
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:<36} {size_mb:>6.1f} Mo  {best * 1000:>9.1f} ms  {size_mb / best:>8.1f} Mo/s  {len(chunks):>7} chunks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4])
+    parser.add_argument("--max-length", type=int, default=500)
+    parser.add_argument("--overlap", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for size_mb in args.sizes_mb:
+        text = synthetic_text(int(size_mb * 1024 * 1024))
+        bench("legacy chunk_text", lambda: legacy_chunk_text(text, args.max_length), size_mb, args.repeat)
+        bench("iter_chunks (mots)", lambda: list(iter_chunks(text, args.max_length, sentences=False)),
+              size_mb, args.repeat)
+        bench("iter_chunks (phrases)", lambda: list(iter_chunks(text, args.max_length)), size_mb, args.repeat)
+        bench(f"iter_chunks (phrases, overlap {args.overlap})",
+              lambda: list(iter_chunks(text, args.max_length, overlap=args.overlap)), size_mb, args.repeat)
+        print()
+
+
+if __name__ == "__main__":
+    main()
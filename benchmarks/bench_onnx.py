@@ -0,0 +1,159 @@
+"""Benchmark des backends des modèles HF locaux : torch (float32) contre ONNX Runtime (int8).
+
+Usage (depuis la racine du dépôt, modèles HF_LLM_MODEL / HF_EMBED_MODEL téléchargeables):
+    python -m benchmarks.bench_onnx
+    python -m benchmarks.bench_onnx --backends torch onnx onnx-fp32 --max-new-tokens 64 --json onnx.json
+
+Chaque backend est mesuré dans un processus neuf (RSS sans les allocations de l'autre) :
+- chargement des modèles (le premier passage `onnx` inclut l'export, mis en cache ensuite :
+  relancer pour le temps de chargement seul) et RSS après chargement / pic (VmHWM) ;
+- embeddings : latence d'une question, débit de documents par lots de --embed-batch ;
+- génération (gloutonne, --max-new-tokens) sur les prompts réels de la pipeline du client :
+  latence d'un prompt, débit par lots de --gen-batch (micro-batching du serveur).
+Qualité : cosinus moyen entre les embeddings des deux backends et part de réponses identiques
+(décodage glouton) par rapport au premier backend de la liste.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+import numpy as np
+
+from benchmarks.bench_pipeline import git_commit, load_questions, summarize
+from benchmarks.bench_vector_store import rss_kb
+
+BACKENDS = {"torch": {"HF_BACKEND": "torch"}, "onnx": {"HF_BACKEND": "onnx", "ONNX_QUANTIZE": "1"},
+            "onnx-fp32": {"HF_BACKEND": "onnx", "ONNX_QUANTIZE": "0"}}
+
+
+def peak_rss_kb() -> int:
+    with open("/proc/self/status", "r", encoding="utf-8") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmHWM"))
+
+
+def run_backend(args) -> Dict[str, Any]:
+    """Exécuté dans un processus neuf, variables d'environnement du backend déjà positionnées."""
+    os.environ["LLM_PROVIDER"] = "HF"
+    os.environ.setdefault("EMBED_CACHE_PATH", "")  # pas de cache : chaque embedding est calculé
+    os.environ.setdefault("WARMUP_ON_STARTUP", "0")
+    os.environ.setdefault("VECTOR_BACKEND", "memmap")
+    os.environ["CHROMA_DIR_MAIN"] = os.path.join(args.dir, "main")
+    os.environ["CHROMA_DIR_ALT"] = os.path.join(args.dir, "alt")
+
+    import server.app as server_app
+    from indexer import load_and_prepare_documents
+
+    rss_start = rss_kb()
+    started = time.perf_counter()
+    emb, llm = server_app.build_embeddings_and_llm()
+    load_seconds = time.perf_counter() - started
+    rss_loaded = rss_kb()
+    # Décodage glouton : sorties comparables entre backends
+    llm.generation_kwargs = {"max_new_tokens": args.max_new_tokens, "do_sample": False}
+
+    questions = load_questions()
+    texts = [doc.page_content for doc in
+             load_and_prepare_documents(server_app.client_data_path("main", args.client_id))]
+    emb.embed_query(questions[0])  # préchauffage (sessions / noyaux)
+    stages: Dict[str, Dict[str, float]] = {}
+    samples = []
+    for question in questions:
+        t0 = time.perf_counter()
+        emb.embed_query(question)
+        samples.append(time.perf_counter() - t0)
+    stages["embed_query"] = summarize(samples)
+    started = time.perf_counter()
+    for i in range(0, len(texts), args.embed_batch):
+        emb.embed_documents(texts[i:i + args.embed_batch])
+    stages[f"embed_documents (lots de {args.embed_batch})"] = {
+        "n": len(texts), "docs_per_s": len(texts) / (time.perf_counter() - started)}
+
+    pipeline = server_app.get_pipeline("main", args.client_id)
+    prompts = [pipeline.format_prompt(q, pipeline.retrieve(q, emb.embed_query(q))) for q in questions]
+    prompts = [prompts[i % len(prompts)] for i in range(args.prompts)]
+    llm.generate_batch(prompts[:1])
+    answers, samples = [], []
+    for prompt in prompts:
+        t0 = time.perf_counter()
+        answers.extend(llm.generate_batch([prompt]))
+        samples.append(time.perf_counter() - t0)
+    stages["génération (1 prompt)"] = summarize(samples)
+    started = time.perf_counter()
+    for i in range(0, len(prompts), args.gen_batch):
+        llm.generate_batch(prompts[i:i + args.gen_batch])
+    stages[f"génération (lots de {args.gen_batch})"] = {
+        "n": len(prompts), "prompts_per_s": len(prompts) / (time.perf_counter() - started)}
+
+    return {
+        "load_s": load_seconds,
+        "rss_start_kb": rss_start["VmRSS"],
+        "rss_loaded_kb": rss_loaded["VmRSS"],
+        "rss_end_kb": rss_kb()["VmRSS"],
+        "rss_peak_kb": peak_rss_kb(),
+        "torch_imported": "torch" in sys.modules,
+        "stages": stages,
+        "query_vectors": emb.embed_documents(questions[:20]),
+        "answers": answers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=["torch", "onnx"])
+    parser.add_argument("--client-id", default="bms_ventouse")
+    parser.add_argument("--prompts", type=int, default=16, help="prompts générés par mesure")
+    parser.add_argument("--max-new-tokens", type=int, default=48)
+    parser.add_argument("--gen-batch", type=int, default=4, help="HF_BATCH_MAX_SIZE du serveur")
+    parser.add_argument("--embed-batch", type=int, default=32)
+    parser.add_argument("--json", help="écrit les résultats")
+    parser.add_argument("--child", choices=list(BACKENDS), help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(run_backend(args)))
+        return
+
+    results: Dict[str, Any] = {"commit": git_commit(), "config": vars(args), "backends": {}}
+    reference: Dict[str, Any] = {}
+    print(f"{'backend':<10} {'chargement s':>12} {'RSS Mo':>7} {'pic Mo':>7} {'emb p50 ms':>10} {'docs/s':>7} "
+          f"{'gén p50 ms':>10} {f'lot{args.gen_batch}/s':>8} {'cos':>6} {'identiques':>10}")
+    for backend in args.backends:
+        workdir = tempfile.mkdtemp(prefix="bench_onnx_")
+        try:
+            command = [sys.executable, "-m", "benchmarks.bench_onnx", "--child", backend, "--dir", workdir,
+                       "--client-id", args.client_id, "--prompts", str(args.prompts), "--max-new-tokens",
+                       str(args.max_new_tokens), "--gen-batch", str(args.gen_batch), "--embed-batch",
+                       str(args.embed_batch)]
+            output = subprocess.run(command, capture_output=True, text=True, check=True,
+                                    env={**os.environ, **BACKENDS[backend]}).stdout
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        child = json.loads(output.strip().splitlines()[-1])
+        vectors, answers = np.array(child.pop("query_vectors")), child.pop("answers")
+        if not reference:
+            reference = {"vectors": vectors, "answers": answers}
+        cosines = (vectors * reference["vectors"]).sum(axis=1) / (
+            np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference["vectors"], axis=1))
+        child["cosine_vs_reference"] = float(cosines.mean())
+        child["same_answers"] = sum(a == b for a, b in zip(answers, reference["answers"])) / len(answers)
+        results["backends"][backend] = child
+        stages = child["stages"]
+        print(f"{backend:<10} {child['load_s']:>12.1f} {child['rss_loaded_kb'] / 1024:>7.0f} "
+              f"{child['rss_peak_kb'] / 1024:>7.0f} {stages['embed_query']['p50_ms']:>10.2f} "
+              f"{stages[f'embed_documents (lots de {args.embed_batch})']['docs_per_s']:>7.0f} "
+              f"{stages['génération (1 prompt)']['p50_ms']:>10.0f} "
+              f"{stages[f'génération (lots de {args.gen_batch})']['prompts_per_s']:>8.2f} "
+              f"{child['cosine_vs_reference']:>6.3f} {child['same_answers']:>10.0%}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Benchmark du chemin d'une requête RAG, hors ligne : embeddings et LLM factices (benchmarks.stubs).
+
+Usage (depuis la racine du dépôt):
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --llm-latency-ms 200 --concurrency 16 --requests 1000
+    python -m benchmarks.bench_pipeline --json avant.json                # sur le commit de référence
+    python -m benchmarks.bench_pipeline --json apres.json --baseline avant.json
+
+Mesure p50/p95/p99 de chaque étape (préparation des documents, embedding de la question,
+recherche hybride, ContextEnhancer, formatage du prompt, AdvancedOutputParser, Pipeline.process)
+puis le débit de bout en bout de POST /api/chat sous `--concurrency` requêtes simultanées
+(application ASGI appelée en mémoire, sans réseau), avec le temps CPU par requête et la taille
+moyenne des lots d'embeddings / de recherches coalescés (QUERY_BATCH_MAX_SIZE=1 : sans coalescence). Le cache de réponses et le fast-path
+sont désactivés par défaut pour que chaque requête parcoure tout le chemin.
+
+Les variables d'environnement du serveur (SEARCH_K, HYBRID_SEARCH, MAX_CONCURRENT_GENERATIONS...)
+sont prises en compte ; Chroma et le cache d'embeddings sont placés dans un répertoire temporaire.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+QUESTIONS_FILE = "clients/_template_questions_base.md"
+EXTRA_QUESTIONS = [
+    "Urgence tournage demain à Paris, pouvez-vous aider ?",
+    "Besoin d'un devis pour du ventousage sur une série TV",
+    "Vous avez des références sur Netflix ?",
+    "Problème d'autorisation mairie pour notre plateau",
+]
+
+
+def load_questions(path: str = QUESTIONS_FILE) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        questions = [line.strip()[2:] for line in f if line.strip().startswith("- ") and line.strip().endswith("?")]
+    return questions + EXTRA_QUESTIONS
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentile par rang le plus proche (valeurs triées)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples: List[float], wall: Optional[float] = None) -> Dict[str, float]:
+    values = sorted(samples)
+    stats = {
+        "n": len(values),
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+    }
+    if wall:
+        stats["throughput_per_s"] = len(values) / wall
+    return stats
+
+
+def time_calls(fn: Callable, inputs: List[Any], iterations: int) -> List[float]:
+    samples = []
+    for i in range(iterations):
+        arg = inputs[i % len(inputs)]
+        started = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def load_test(app, questions: List[str], client_id: str, requests: int, concurrency: int):
+    import httpx
+
+    samples: List[float] = []
+    statuses: Dict[int, int] = {}
+    counter = iter(range(requests))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def worker():
+            for i in counter:
+                body = {"question": f"{questions[i % len(questions)]} ({i})", "client_id": client_id}
+                started = time.perf_counter()
+                response = await client.post("/api/chat", json=body)
+                samples.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return samples, wall, statuses
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return "inconnu"
+
+
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    header = f"{'étape':<34} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'débit/s':>9}"
+    if baseline:
+        header += f"  {'Δp50':>7} {'Δp95':>7} (vs {baseline.get('commit', '?')})"
+    print(header)
+    for name, stats in results["stages"].items():
+        throughput = f"{stats['throughput_per_s']:.1f}" if "throughput_per_s" in stats else "-"
+        line = (f"{name:<34} {stats['n']:>6} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} "
+                f"{stats['p99_ms']:>9.3f} {throughput:>9}")
+        base = (baseline or {}).get("stages", {}).get(name)
+        if base:
+            deltas = [(stats[k] - base[k]) / base[k] * 100 if base[k] else 0.0 for k in ("p50_ms", "p95_ms")]
+            line += f"  {deltas[0]:>+6.0f}% {deltas[1]:>+6.0f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--client-id", default="bms_ventouse")
+    parser.add_argument("--iterations", type=int, default=500, help="appels par étape unitaire")
+    parser.add_argument("--e2e-iterations", type=int, default=100, help="appels de Pipeline.process")
+    parser.add_argument("--requests", type=int, default=500, help="requêtes POST /api/chat")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embed-dim", type=int, default=384)
+    parser.add_argument("--answer-cache", action="store_true", help="garde le cache de réponses actif")
+    parser.add_argument("--fast-path", action="store_true", help="garde le fast-path actif")
+    parser.add_argument("--json", help="écrit les résultats (comparables entre commits)")
+    parser.add_argument("--baseline", help="résultats JSON d'un autre commit à comparer")
+    args = parser.parse_args()
+
+    # Configuration du serveur avant son import (lue au chargement du module)
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.environ.setdefault("CHROMA_DIR_MAIN", os.path.join(workdir, "chroma_main"))
+    os.environ.setdefault("CHROMA_DIR_ALT", os.path.join(workdir, "chroma_alt"))
+    os.environ.setdefault("EMBED_CACHE_PATH", "")
+    os.environ.setdefault("WARMUP_ON_STARTUP", "0")
+    os.environ.setdefault("MAX_QUEUE_DEPTH", str(max(16, args.concurrency)))
+    if not args.answer_cache:
+        os.environ["ANSWER_CACHE_SIZE"] = "0"
+    if not args.fast_path:
+        os.environ["FAST_PATH"] = "0"
+
+    import server.app as server_app
+    from benchmarks.stubs import HashEmbeddings, StubLLM
+    from indexer import load_and_prepare_documents
+
+    embeddings = HashEmbeddings(dim=args.embed_dim, latency_ms=args.embed_latency_ms)
+    llm = StubLLM(latency_ms=args.llm_latency_ms)
+    server_app._build_embeddings = lambda: embeddings
+    server_app._build_llm = lambda: llm
+    logging.getLogger().setLevel(logging.WARNING)
+
+    questions = load_questions()
+    data_path = server_app.client_data_path("main", args.client_id)
+    stages: Dict[str, Dict[str, float]] = {}
+
+    started = time.perf_counter()
+    pipeline = server_app.get_pipeline("main", args.client_id)
+    build_seconds = time.perf_counter() - started
+
+    vectors = {q: embeddings.embed_query(q) for q in questions}
+    docs = {q: pipeline.retrieve(q, vectors[q]) for q in questions}
+    prompts = [pipeline.format_prompt(q, docs[q]) for q in questions]
+    it = args.iterations
+
+    stages["load_and_prepare_documents"] = summarize(
+        time_calls(load_and_prepare_documents, [data_path], max(1, it // 10)))
+    stages["embed_query (stub)"] = summarize(time_calls(embeddings.embed_query, questions, it))
+    stages["retrieve (vecteurs + BM25)"] = summarize(time_calls(lambda q: pipeline.retrieve(q, vectors[q]), questions, it))
+    stages["ContextEnhancer.enhance"] = summarize(time_calls(lambda q: pipeline.enhancer.enhance(docs[q]), questions, it))
+    stages["format_prompt"] = summarize(time_calls(lambda q: pipeline.format_prompt(q, docs[q]), questions, it))
+    # Une sortie sur trois recopie le prompt (cas observé sur les petits modèles)
+    raw_outputs = [(p if i % 3 == 0 else "") + llm.answer for i, p in enumerate(prompts)]
+    stages["AdvancedOutputParser.parse"] = summarize(time_calls(pipeline.parser.parse, raw_outputs, it))
+    stages["prepare (sans LLM)"] = summarize(time_calls(pipeline.prepare, questions, it))
+    started = time.perf_counter()
+    samples = time_calls(pipeline.process, questions, args.e2e_iterations)
+    stages["Pipeline.process"] = summarize(samples, time.perf_counter() - started)
+
+    cpu_started = time.process_time()
+    samples, wall, statuses = asyncio.run(
+        load_test(server_app.app, questions, args.client_id, args.requests, args.concurrency))
+    stages[f"POST /api/chat (x{args.concurrency})"] = summarize(samples, wall)
+    # Temps CPU du processus (tous threads) par requête : coût de la coalescence / du micro-batching
+    stages[f"POST /api/chat (x{args.concurrency})"]["cpu_ms_per_request"] = (
+        (time.process_time() - cpu_started) / max(1, len(samples)) * 1000)
+
+    results = {
+        "commit": git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k not in {"json", "baseline"}},
+        "build_pipeline_s": build_seconds,
+        "http_statuses": statuses,
+        "query_batching": {name: batcher.stats()["avg_batch_size"] for name, batcher in
+                           [("embed", b) for b in server_app.QUERY_EMBEDDERS.values()]
+                           + [("search", server_app.SEARCH_BATCHER)] if batcher is not None},
+        "stages": stages,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"Commit {results['commit']} — pipeline construite en {build_seconds:.2f}s, "
+          f"LLM factice {args.llm_latency_ms:.0f} ms, statuts HTTP {statuses}\n")
+    print_report(results, baseline)
+    print(f"\nCPU par requête HTTP : {stages[f'POST /api/chat (x{args.concurrency})']['cpu_ms_per_request']:.2f} ms"
+          f" ; taille moyenne des lots {results['query_batching'] or '(coalescence désactivée)'}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Micro-benchmark du post-traitement des réponses : ancien AdvancedOutputParser.parse / StreamCleaner
+vs rag_core.postprocess (motifs précompilés, passage unique, mode incrémental).
+
+Usage (depuis la racine du dépôt):
+    python -m benchmarks.bench_postprocess --responses 2000
+    python -m benchmarks.bench_postprocess --corpus sorties_llm.jsonl   # une ligne {"raw": "..."} par sortie
+
+Sans --corpus, un corpus synthétique reproduit les artefacts observés sur tinyllama / flan-t5
+(prompt recopié, `[Votre nom]`, gras markdown, phrases répétées).
+"""
+import argparse
+import json
+import random
+import re
+import time
+from typing import Callable, List
+
+from rag_core.postprocess import IncrementalCleaner, ResponsePostProcessor
+
+SENTENCES = [
+    "Nous gérons le ventousage et le stationnement de vos véhicules techniques",
+    "Notre équipe est disponible 24/7 pour les urgences de tournage",
+    "Les démarches en mairie et les autorisations sont prises en charge",
+    "Nous avons accompagné des productions Netflix et Amazon Prime",
+    "Contactez-nous par WhatsApp pour un devis rapide",
+    "La base vie et la régie technique peuvent être installées dès la veille",
+]
+PROMPT_LEAK = (
+    "Tu es l'assistant de BMS Ventouse.\n\nCONTEXTE:\n{context}\n\nCLIENT DIT: \"{question}\"\n\n"
+    "SITUATION: Urgence\n\n# 🎬 MISSION: Réponds en 2-3 phrases. VOCABULAIRE métier.\n**Réponse :**"
+)
+
+
+def legacy_parse(text: str) -> str:
+    """Copie de l'ancien AdvancedOutputParser.parse de server/app.py (référence, sans le repli)."""
+    t = re.sub(r"\[.*?\]", "", text)
+    t = re.sub(r"\*+\s?", "", t)
+    t = re.sub(r"\n+", "\n", t)
+    for marker in ["MISSION", "VOCABULAIRE", "# "]:
+        if marker in t:
+            parts = re.split(r"Réponse\s*:|\*\*Réponse\s*:?\*\*", t)
+            if len(parts) > 1:
+                t = parts[-1].strip()
+    sentences = [s.strip() for s in t.split(". ") if s.strip()]
+    uniq = []
+    for s in sentences:
+        if s not in uniq:
+            uniq.append(s)
+    return ". ".join(uniq).strip()
+
+
+class LegacyStreamCleaner:
+    """Copie de l'ancien StreamCleaner de server/app.py : tout le texte reçu est re-nettoyé à chaque token."""
+
+    def __init__(self):
+        self.raw = ""
+        self.emitted = ""
+
+    def feed(self, chunk: str) -> str:
+        self.raw += chunk
+        text = self.raw
+        cut = text.rfind("[")
+        if cut != -1 and "]" not in text[cut:]:
+            text = text[:cut]
+        t = re.sub(r"\[.*?\]", "", text)
+        t = re.sub(r"\*+\s?", "", t)
+        t = re.sub(r"\n+", "\n", t)
+        if not t.startswith(self.emitted):
+            return ""
+        delta = t[len(self.emitted):]
+        self.emitted = t
+        return delta
+
+
+def synthetic_output(rng: random.Random) -> str:
+    parts = []
+    if rng.random() < 0.3:
+        parts.append(PROMPT_LEAK.format(context="\n".join(rng.sample(SENTENCES, 3)), question="Urgent pour demain ?"))
+    for _ in range(rng.randint(2, 60)):
+        sentence = rng.choice(SENTENCES)
+        if rng.random() < 0.15:
+            sentence = f"**{sentence}**"
+        parts.append(sentence + rng.choice([". ", ". ", ".\n", ".\n\n"]))
+        if rng.random() < 0.05:
+            parts.append("[Votre nom]\n")
+    return "".join(parts)
+
+
+def load_corpus(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["raw"] for line in f if line.strip()]
+
+
+def tokens_of(text: str, size: int = 4) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def bench(name: str, fn: Callable, corpus: list, repeat: int) -> None:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in corpus:
+            fn(text)
+        best = min(best, time.perf_counter() - started)
+    mb = sum(len("".join(t).encode("utf-8")) for t in corpus) / 1e6
+    print(f"{name:<36} {best * 1000:>9.1f} ms  {best / len(corpus) * 1e6:>9.1f} µs/réponse  {mb / best:>7.1f} Mo/s")
+
+
+def stream_with(cleaner_cls) -> Callable[[List[str]], str]:
+    def run(tokens: List[str]) -> str:
+        cleaner = cleaner_cls()
+        out = [cleaner.feed(tok) for tok in tokens]
+        if hasattr(cleaner, "flush"):
+            out.append(cleaner.flush())
+        return "".join(out)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="JSONL de sorties brutes enregistrées (clé `raw`)")
+    parser.add_argument("--responses", type=int, default=2000, help="taille du corpus synthétique")
+    parser.add_argument("--stream-responses", type=int, default=200,
+                        help="réponses rejouées en flux (l'ancien StreamCleaner est quadratique)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        rng = random.Random(0)
+        corpus = [synthetic_output(rng) for _ in range(args.responses)]
+    avg = sum(len(t) for t in corpus) / len(corpus)
+    print(f"Corpus: {len(corpus)} réponses, {avg:.0f} caractères en moyenne")
+
+    engine = ResponsePostProcessor()
+    same = sum(legacy_parse(t) == engine.clean(t) for t in corpus)
+    print(f"Sorties identiques à l'ancien parser: {same}/{len(corpus)}")
+    bench("legacy parse", legacy_parse, corpus, args.repeat)
+    bench("ResponsePostProcessor.clean", engine.clean, corpus, args.repeat)
+
+    streams = [tokens_of(t) for t in corpus[:args.stream_responses]]
+    print(f"\nFlux ({len(streams)} réponses, tokens de 4 caractères):")
+    bench("legacy StreamCleaner", stream_with(LegacyStreamCleaner), streams, args.repeat)
+    bench("IncrementalCleaner", stream_with(IncrementalCleaner), streams, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark de la réutilisation du préfixe statique du prompt (modèles réels, LLM_PROVIDER du serveur).
+
+Usage (depuis la racine du dépôt, Ollama lancé ou modèle HF décodeur seul configuré):
+    LLM_PROVIDER=OLLAMA python -m benchmarks.bench_prefix_cache
+    LLM_PROVIDER=HF HF_LLM_MODEL=HuggingFaceTB/SmolLM2-135M-Instruct \\
+        python -m benchmarks.bench_prefix_cache --requests 20 --max-new-tokens 8 --json prefixe.json
+
+Les prompts sont ceux de la pipeline du client (Pipeline.format_prompt sur les questions de
+benchmarks.bench_pipeline), envoyés au LLM l'un après l'autre en deux blocs :
+- « préfixe réutilisé » : prompts tels quels ; la première génération calcule le préfixe et
+  n'est pas comptée ;
+- « préfixe recalculé » : un nombre aléatoire placé en tête de chaque prompt empêche toute
+  réutilisation (cache KV d'Ollama comme past-key-values HF) : prefill complet à chaque fois.
+Le prefill est le span `prefill` de la trace (prompt_eval_duration d'Ollama, temps jusqu'au
+premier token côté HF) ; le rapport donne ses percentiles et le gain par requête.
+--max-new-tokens court raccourcit le décodage, hors sujet ici.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, List
+
+from benchmarks.bench_pipeline import git_commit, load_questions, summarize
+
+
+def run_block(llm: Any, prompts: List[str], nonce: bool) -> Dict[str, List[float]]:
+    from server.metrics import RequestTrace
+
+    prefill: List[float] = []
+    total: List[float] = []
+    for prompt in prompts:
+        if nonce:
+            prompt = f"[{random.randrange(10 ** 9)}] {prompt}"
+        trace = RequestTrace("bench")
+        started = time.perf_counter()
+        with trace.activate():
+            llm.invoke(prompt)
+        total.append(time.perf_counter() - started)
+        prefill.append(trace.spans.get("prefill", 0.0))
+    return {"prefill": prefill, "total": total}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--client-id", default="bms_ventouse")
+    parser.add_argument("--requests", type=int, default=30, help="générations par bloc")
+    parser.add_argument("--max-new-tokens", type=int, help="tokens générés par réponse (défaut : celui du serveur)")
+    parser.add_argument("--json", help="écrit les résultats")
+    args = parser.parse_args()
+
+    os.environ.setdefault("WARMUP_ON_STARTUP", "0")
+    os.environ.setdefault("EMBED_CACHE_PATH", "")
+
+    import server.app as server_app
+
+    logging.getLogger().setLevel(logging.WARNING)
+    pipeline = server_app.get_pipeline("main", args.client_id)
+    llm = pipeline.llm
+    if args.max_new_tokens:
+        if hasattr(llm, "generation_kwargs"):
+            llm.generation_kwargs = {**llm.generation_kwargs, "max_new_tokens": args.max_new_tokens}
+        elif hasattr(llm, "llm"):
+            llm.llm.num_predict = args.max_new_tokens
+
+    questions = load_questions()
+    prompts = [pipeline.format_prompt(q, pipeline.retrieve(q, pipeline.embeddings.embed_query(q))) for q in questions]
+    prompts = [prompts[i % len(prompts)] for i in range(args.requests + 1)]
+    prefix_tokens = pipeline.count_tokens(pipeline.prompt_prefix)
+    prompt_tokens = sum(pipeline.count_tokens(p) for p in prompts) / len(prompts)
+
+    warm = run_block(llm, prompts, nonce=False)
+    warm = {name: samples[1:] for name, samples in warm.items()}  # 1re génération : calcul du préfixe
+    cold = run_block(llm, prompts[1:], nonce=True)
+    blocks = {"préfixe réutilisé": warm, "préfixe recalculé": cold}
+    stats = {name: {kind: summarize(samples) for kind, samples in block.items()} for name, block in blocks.items()}
+
+    print(f"Commit {git_commit()} — {server_app.models_key()}, préfixe {prefix_tokens} tokens, "
+          f"prompt moyen {prompt_tokens:.0f} tokens, {args.requests} générations par bloc\n")
+    print(f"{'bloc':<20} {'prefill p50':>12} {'prefill p95':>12} {'total p50':>10} {'total p95':>10}  (ms)")
+    for name, block in stats.items():
+        print(f"{name:<20} {block['prefill']['p50_ms']:>12.1f} {block['prefill']['p95_ms']:>12.1f} "
+              f"{block['total']['p50_ms']:>10.1f} {block['total']['p95_ms']:>10.1f}")
+    saved = stats["préfixe recalculé"]["prefill"]["p50_ms"] - stats["préfixe réutilisé"]["prefill"]["p50_ms"]
+    print(f"\nGain de prefill par requête (p50) : {saved:.1f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "models": list(server_app.models_key()), "config": vars(args),
+                       "prefix_tokens": prefix_tokens, "prompt_tokens": prompt_tokens, "blocks": stats,
+                       "saved_prefill_p50_ms": saved}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
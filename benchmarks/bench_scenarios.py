@@ -0,0 +1,106 @@
+"""Micro-benchmark de la détection de scénario : anciens `detect_scenario` (listes codées en dur, `in` répétés)
+vs rag_core.scenarios.ScenarioClassifier (déclencheurs de data.json compilés en une regex).
+
+Usage (depuis la racine du dépôt):
+    python -m benchmarks.bench_scenarios --questions 200000 --client clients/bms_ventouse/data.json
+
+`--synthetic-triggers N` ajoute un scénario de N déclencheurs générés pour mesurer le passage à l'échelle
+(l'ancien detect_scenario, codé en dur, n'en tient pas compte).
+"""
+import argparse
+import json
+import random
+import time
+from typing import Callable, Dict, List
+
+from rag_core.scenarios import ScenarioClassifier, normalize_text
+
+FILLER = (
+    "bonjour nous préparons un tournage à Paris pour une série avec trois camions et une équipe "
+    "technique pouvez-vous nous aider sur le stationnement du plateau la semaine prochaine merci"
+).split()
+EXTRA_TRIGGERS = ["Urgent", "DEMAIN", "crise", "last minute", "devis", "prix", "budget", "tarif",
+                  "référence", "Mairie", "autorisations", "PPMS", "portfolio", "combien", "imprévu"]
+
+
+def legacy_detect_scenario(q: str) -> str:
+    """Copie de l'ancien detect_scenario de server/app.py (référence)."""
+    ql = q.lower()
+    if any(k in ql for k in ["urgent", "demain", "crise", "last minute"]):
+        return "Urgence"
+    if any(k in ql for k in ["prix", "devis", "budget", "tarif"]):
+        return "Devis"
+    if any(k in ql for k in ["référence", "reference", "portfolio"]):
+        return "Références"
+    return "Question générale"
+
+
+def naive_detector(scenarios: Dict[str, Dict]) -> Callable[[str], List[str]]:
+    """Même données que le classifieur, mais un `in` par déclencheur et par scénario."""
+    triggers = {name: [normalize_text(t) for t in info.get("declencheur", [])] for name, info in scenarios.items()}
+
+    def detect(q: str) -> List[str]:
+        ql = normalize_text(q)
+        scores = {name: sum(1 for t in words if t in ql) for name, words in triggers.items()}
+        return sorted((n for n, s in scores.items() if s), key=lambda n: -scores[n])
+
+    return detect
+
+
+def synthetic_triggers(count: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choice("abcdefghijklmnopqrstuvwxyzéè") for _ in range(rng.randint(5, 11))) for _ in range(count)]
+
+
+def synthetic_questions(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(5, 40))]
+        for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(EXTRA_TRIGGERS))
+        questions.append(" ".join(words).capitalize() + " ?")
+    return questions
+
+
+def bench(name: str, fn: Callable[[str], object], questions: List[str], repeat: int) -> None:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for q in questions:
+            fn(q)
+        best = min(best, time.perf_counter() - started)
+    per_q = best / len(questions) * 1e6
+    print(f"{name:<40} {best * 1000:>9.1f} ms  {per_q:>7.2f} µs/question  {len(questions) / best:>11,.0f} questions/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200_000)
+    parser.add_argument("--client", default="clients/bms_ventouse/data.json")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--synthetic-triggers", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.client, "r", encoding="utf-8") as f:
+        client_data = json.load(f)
+    scenarios = client_data.get("scenarios_critiques") or {}
+    if args.synthetic_triggers:
+        scenarios["synthetique"] = {"declencheur": synthetic_triggers(args.synthetic_triggers)}
+        client_data["scenarios_critiques"] = scenarios
+
+    started = time.perf_counter()
+    classifier = ScenarioClassifier.from_client_data(client_data)
+    triggers = sum(len(info.get("declencheur", [])) for info in scenarios.values())
+    print(f"Compilation du classifieur ({len(scenarios)} scénarios, {triggers} déclencheurs): "
+          f"{(time.perf_counter() - started) * 1000:.2f} ms")
+
+    questions = synthetic_questions(args.questions)
+    bench("legacy detect_scenario (codé en dur)", legacy_detect_scenario, questions, args.repeat)
+    bench("naïf data.json (`in` par déclencheur)", naive_detector(scenarios), questions, args.repeat)
+    bench("ScenarioClassifier.rank", classifier.rank, questions, args.repeat)
+    bench("ScenarioClassifier.label", classifier.label, questions, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Benchmark des backends vectoriels : Chroma (persistant, HNSW) contre MemmapVectorStore (NumPy).
+
+Usage (depuis la racine du dépôt):
+    python -m benchmarks.bench_vector_store
+    python -m benchmarks.bench_vector_store --sizes 300 5000 100000 --ann-min-docs 10000 --json vecteurs.json
+
+Pour chaque taille de collection, des vecteurs synthétiques (groupés autour de centres, comme
+des embeddings de phrases) sont écrits une fois dans chaque backend, puis chaque backend est
+interrogé dans un processus neuf (RSS mesurée sans les allocations des autres) :
+- latence d'une requête (k = --k), d'une requête filtrée sur les métadonnées, d'un lot de
+  --batch requêtes (retrieve_many) ;
+- RSS après ouverture et après les requêtes (anonyme / fichiers projetés, /proc/self/status) ;
+- rappel@k par rapport à la recherche exacte (HNSW de Chroma, IVF du backend memmap au-delà
+  de --ann-min-docs vecteurs).
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.bench_pipeline import git_commit, summarize
+
+BACKENDS = ("chroma", "memmap")
+CATEGORIES = ("service", "scenario", "reference", "temoignage")
+_RECALL_QUERIES = 100
+
+
+def rss_kb() -> Dict[str, int]:
+    """RSS totale, anonyme et fichiers projetés (kB) ; maxrss si /proc n'est pas disponible."""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            fields = dict(line.split(":", 1) for line in f if line.startswith(("VmRSS", "RssAnon", "RssFile")))
+        return {k: int(v.split()[0]) for k, v in fields.items()}
+    except OSError:
+        import resource
+
+        return {"VmRSS": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def synthetic_corpus(size: int, dim: int, queries: int, seed: int = 0):
+    """Vecteurs groupés (un centre pour ~20 documents) et requêtes bruitées proches de documents existants."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, size // 20), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), size)] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    picks = vectors[rng.integers(0, size, queries)]
+    query_vectors = picks + (0.5 / np.sqrt(dim)) * rng.standard_normal(picks.shape).astype(np.float32)
+    ids = [f"doc-{i}" for i in range(size)]
+    texts = [f"Document {i} : ventousage, stationnement et logistique de tournage ({CATEGORIES[i % 4]})"
+             for i in range(size)]
+    metadatas = [{"type": CATEGORIES[i % len(CATEGORIES)], "source": "bench"} for i in range(size)]
+    return vectors, query_vectors.astype(np.float32), ids, texts, metadatas
+
+
+def open_store(backend: str, directory: str, ann_min_docs: int):
+    if backend == "memmap":
+        from rag_core.vector_index import MemmapVectorStore
+
+        return MemmapVectorStore(os.path.join(directory, "memmap"), ann_min_docs=ann_min_docs)
+    from langchain_community.vectorstores import Chroma
+
+    # Mêmes paramètres que server.app.open_collection
+    return Chroma(collection_name="bench", persist_directory=os.path.join(directory, "chroma"),
+                  collection_metadata={"hnsw:space": "cosine"})
+
+
+def write_store(backend: str, directory: str, ann_min_docs: int, vectors, ids, texts, metadatas) -> float:
+    started = time.perf_counter()
+    store = open_store(backend, directory, ann_min_docs)
+    if backend == "memmap":
+        store.add_embeddings(ids, vectors, texts, metadatas)
+    else:
+        for i in range(0, len(ids), 1000):
+            store._collection.add(ids=ids[i:i + 1000], embeddings=vectors[i:i + 1000].tolist(),
+                                  documents=texts[i:i + 1000], metadatas=metadatas[i:i + 1000])
+    return time.perf_counter() - started
+
+
+def run_queries(backend: str, directory: str, args) -> Dict[str, Any]:
+    """Exécuté dans un processus neuf : ouverture, requêtes chronométrées, RSS, identifiants renvoyés."""
+    _, query_vectors, _, _, _ = synthetic_corpus(args.size, args.dim, args.queries)
+    rss_start = rss_kb()
+    started = time.perf_counter()
+    store = open_store(backend, directory, args.ann_min_docs)
+    open_seconds = time.perf_counter() - started
+    rss_open = rss_kb()
+    queries = [q.tolist() for q in query_vectors]
+    k = args.k
+
+    def single(q):
+        return store.similarity_search_by_vector_with_relevance_scores(q, k=k)
+
+    def filtered(q):
+        return store.similarity_search_by_vector_with_relevance_scores(q, k=k, filter={"type": "reference"})
+
+    def batch(qs):
+        if backend == "memmap":
+            return store.search_by_vectors(qs, k=k)
+        return store._collection.query(query_embeddings=qs, n_results=k,
+                                       include=["documents", "metadatas", "distances"])
+
+    for q in queries[:10]:  # préchauffage (pages de la matrice, caches de Chroma)
+        single(q)
+    stages: Dict[str, List[float]] = {"requête": [], "requête filtrée": [], f"lot de {args.batch}": []}
+    top_ids: List[List[str]] = []
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        hits = single(q)
+        t1 = time.perf_counter()
+        filtered(q)
+        t2 = time.perf_counter()
+        stages["requête"].append(t1 - t0)
+        stages["requête filtrée"].append(t2 - t1)
+        if i < _RECALL_QUERIES:
+            top_ids.append([doc.page_content for doc, _ in hits])
+    for i in range(0, len(queries) - args.batch + 1, args.batch):
+        t0 = time.perf_counter()
+        batch(queries[i:i + args.batch])
+        stages[f"lot de {args.batch}"].append(time.perf_counter() - t0)
+    return {
+        "open_s": open_seconds,
+        "rss_start_kb": rss_start,
+        "rss_open_kb": rss_open,
+        "rss_end_kb": rss_kb(),
+        "stages": {name: summarize(samples) for name, samples in stages.items()},
+        "top": top_ids,
+    }
+
+
+def exact_top(vectors, query_vectors, texts, k: int) -> List[List[str]]:
+    scores = query_vectors[:_RECALL_QUERIES] @ vectors.T
+    return [[texts[i] for i in np.argsort(-row)[:k]] for row in scores]
+
+
+def recall(found: List[List[str]], expected: List[List[str]]) -> float:
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return hits / max(1, sum(len(e) for e in expected))
+
+
+def child_main(args) -> None:
+    print(json.dumps(run_queries(args.child, args.dir, args)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[300, 3000, 30000], help="documents par collection")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=6, help="SEARCH_FETCH_K du serveur")
+    parser.add_argument("--batch", type=int, default=32, help="questions par recherche groupée")
+    parser.add_argument("--ann-min-docs", type=int, default=10_000, help="VECTOR_ANN_MIN_DOCS (IVF au-delà)")
+    parser.add_argument("--json", help="écrit les résultats")
+    parser.add_argument("--child", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child_main(args)
+        return
+
+    results: Dict[str, Any] = {"commit": git_commit(), "config": vars(args), "sizes": {}}
+    print(f"{'documents':>9} {'backend':<8} {'écriture s':>10} {'ouverture s':>11} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'filtre p50':>10} {f'lot{args.batch} p50':>10} {'RSS Mo':>7} {'anon Mo':>7} {'rappel@k':>8}")
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix="bench_vectors_")
+        try:
+            vectors, query_vectors, ids, texts, metadatas = synthetic_corpus(size, args.dim, args.queries)
+            expected = exact_top(vectors, query_vectors, texts, args.k)
+            per_backend = {}
+            for backend in BACKENDS:
+                write_seconds = write_store(backend, workdir, args.ann_min_docs, vectors, ids, texts, metadatas)
+                command = [sys.executable, "-m", "benchmarks.bench_vector_store", "--child", backend,
+                           "--dir", workdir, "--size", str(size), "--dim", str(args.dim), "--queries",
+                           str(args.queries), "--k", str(args.k), "--batch", str(args.batch),
+                           "--ann-min-docs", str(args.ann_min_docs)]
+                output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+                child = json.loads(output.strip().splitlines()[-1])
+                child["write_s"] = write_seconds
+                child["recall"] = recall(child.pop("top"), expected)
+                per_backend[backend] = child
+                stages = child["stages"]
+                rss = child["rss_end_kb"]
+                print(f"{size:>9} {backend:<8} {write_seconds:>10.2f} {child['open_s']:>11.3f} "
+                      f"{stages['requête']['p50_ms']:>8.3f} {stages['requête']['p95_ms']:>8.3f} "
+                      f"{stages['requête filtrée']['p50_ms']:>10.3f} {stages[f'lot de {args.batch}']['p50_ms']:>10.3f} "
+                      f"{rss['VmRSS'] / 1024:>7.1f} {rss.get('RssAnon', 0) / 1024:>7.1f} {child['recall']:>8.3f}")
+            results["sizes"][str(size)] = per_backend
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
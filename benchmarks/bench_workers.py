@@ -0,0 +1,175 @@
+"""Mémoire par worker de `python -m server.serve` : préchargement + fork contre chargement par worker.
+
+Usage (depuis la racine du dépôt, Linux : /proc/<pid>/smaps_rollup):
+    python -m benchmarks.bench_workers                        # modèles factices + 300 Mo de « poids »
+    python -m benchmarks.bench_workers --workers 4 --model-mb 500 --json workers.json
+    python -m benchmarks.bench_workers --real                 # modèles configurés (LLM_PROVIDER, HF_*)
+
+Pour chaque mode (`preload` : tout chargé dans le parent puis fork ; `no-preload` : chaque
+worker charge ses modèles et ses index, comme `uvicorn --workers N`), le serveur est lancé
+dans un processus à part, attend d'être prêt, reçoit `--requests` requêtes POST /api/chat,
+puis la mémoire du parent et de chaque worker est relevée :
+- RSS : pages résidentes, partagées comprises (la somme sur-compte le partage) ;
+- PSS : pages partagées divisées entre les processus qui les utilisent (somme = mémoire réelle) ;
+- privée : pages propres au processus (copies après écriture comprises).
+Sans --real, le LLM factice (benchmarks.stubs) porte un tableau de --model-mb Mo écrit à la
+construction, comme des poids chargés en mémoire ; les index sont en VECTOR_BACKEND=memmap.
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from benchmarks.bench_pipeline import git_commit, load_questions
+
+MODES = ("preload", "no-preload")
+_FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty")
+
+
+def smaps_rollup(pid: int) -> Dict[str, int]:
+    """RSS / PSS / privée (kB) d'un processus."""
+    values: Dict[str, int] = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in _FIELDS:
+                values[name] = int(rest.split()[0])
+    return {"rss_kb": values["Rss"], "pss_kb": values["Pss"],
+            "private_kb": values["Private_Clean"] + values["Private_Dirty"]}
+
+
+def children_of(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children", "r", encoding="utf-8") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def child_main(args) -> None:
+    """Serveur à mesurer (processus lancé par main)."""
+    os.environ.setdefault("VECTOR_BACKEND", "memmap")
+    os.environ.setdefault("EMBED_CACHE_PATH", "")
+    if not args.real:
+        os.environ.setdefault("CHROMA_DIR_MAIN", os.path.join(args.dir, "chroma_main"))
+        os.environ.setdefault("CHROMA_DIR_ALT", os.path.join(args.dir, "chroma_alt"))
+
+    import server.app as server_app
+    from server import serve
+
+    if not args.real:
+        import numpy as np
+
+        from benchmarks.stubs import HashEmbeddings, StubLLM
+
+        def build_llm():
+            llm = StubLLM(latency_ms=args.llm_latency_ms)
+            llm.weights = np.ones(args.model_mb * 1024 * 1024 // 4, dtype=np.float32)
+            return llm
+
+        server_app._build_embeddings = lambda: HashEmbeddings(dim=384)
+        server_app._build_llm = build_llm
+    serve.main(["--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers),
+                "--log-level", "warning"] + (["--no-preload"] if args.child == "no-preload" else []))
+
+
+def wait_ready(client, workers: int, timeout: float) -> None:
+    """Prêt quand 3 × workers sondes consécutives (connexions neuves, réparties par le noyau) répondent 200."""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while streak < 3 * workers:
+        if time.monotonic() > deadline:
+            raise TimeoutError("serveur non prêt")
+        try:
+            ok = client.get("/api/ready", headers={"Connection": "close"}).status_code == 200
+        except Exception:
+            ok = False
+        streak = streak + 1 if ok else 0
+        if not ok:
+            time.sleep(0.2)
+
+
+def measure(mode: str, args) -> Dict[str, Any]:
+    import httpx
+
+    workdir = tempfile.mkdtemp(prefix="bench_workers_")
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.bench_workers", "--child", mode, "--dir", workdir,
+               "--port", str(port), "--workers", str(args.workers), "--model-mb", str(args.model_mb),
+               "--llm-latency-ms", str(args.llm_latency_ms)] + (["--real"] if args.real else [])
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+            wait_ready(client, args.workers, args.timeout)
+            ready_seconds = time.perf_counter() - started
+            questions = load_questions()
+            statuses: Dict[int, int] = {}
+            for i in range(args.requests):
+                body = {"question": f"{questions[i % len(questions)]} ({i})", "client_id": args.client_id}
+                status = client.post("/api/chat", json=body, headers={"Connection": "close"}).status_code
+                statuses[status] = statuses.get(status, 0) + 1
+        parent = smaps_rollup(process.pid)
+        workers = [smaps_rollup(pid) for pid in children_of(process.pid)]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "ready_s": ready_seconds,
+        "http_statuses": statuses,
+        "parent": parent,
+        "workers": workers,
+        "total_pss_kb": parent["pss_kb"] + sum(w["pss_kb"] for w in workers),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=40, help="requêtes POST /api/chat avant la mesure")
+    parser.add_argument("--client-id", default="bms_ventouse")
+    parser.add_argument("--model-mb", type=int, default=300, help="taille des « poids » du LLM factice")
+    parser.add_argument("--llm-latency-ms", type=float, default=20.0)
+    parser.add_argument("--real", action="store_true", help="modèles configurés au lieu des modèles factices")
+    parser.add_argument("--timeout", type=float, default=600.0, help="attente maximale du démarrage (s)")
+    parser.add_argument("--json", help="écrit les résultats")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child_main(args)
+        return
+
+    results: Dict[str, Any] = {"commit": git_commit(), "config": vars(args), "modes": {}}
+    print(f"{'mode':<11} {'processus':<10} {'RSS Mo':>8} {'PSS Mo':>8} {'privée Mo':>10}")
+    for mode in MODES:
+        result = measure(mode, args)
+        results["modes"][mode] = result
+        rows = [("parent", result["parent"])] + [(f"worker {i}", w) for i, w in enumerate(result["workers"])]
+        for name, mem in rows:
+            print(f"{mode:<11} {name:<10} {mem['rss_kb'] / 1024:>8.1f} {mem['pss_kb'] / 1024:>8.1f} "
+                  f"{mem['private_kb'] / 1024:>10.1f}")
+        print(f"{mode:<11} {'total PSS':<10} {'':>8} {result['total_pss_kb'] / 1024:>8.1f}   "
+              f"(prêt en {result['ready_s']:.1f}s, statuts {result['http_statuses']})")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
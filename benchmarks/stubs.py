@@ -0,0 +1,86 @@
+"""Modèles factices déterministes pour les benchmarks hors ligne (aucun téléchargement).
+
+`HashEmbeddings` : sac de mots haché (avec bigrammes de caractères) normalisé — les
+textes qui partagent des mots restent proches, la recherche vectorielle a donc un sens.
+`StubLLM` : réponse type du modèle (avec les artefacts habituels) après une latence
+simulée ; expose invoke / ainvoke / astream comme les LLM LangChain utilisés par le serveur.
+"""
+import asyncio
+import hashlib
+import math
+import re
+import time
+from typing import AsyncIterator, List
+
+from langchain.schema.embeddings import Embeddings
+
+_WORDS = re.compile(r"\w+")
+
+STUB_ANSWER = (
+    "**Bonjour**, nous pouvons vous aider. Notre équipe gère le ventousage et le stationnement de vos "
+    "véhicules techniques. [Votre nom] Nous intervenons 24/7 pour les urgences de tournage. "
+    "Nous intervenons 24/7 pour les urgences de tournage. Contactez-nous par WhatsApp pour un devis rapide."
+)
+
+
+class HashEmbeddings(Embeddings):
+    """Embeddings déterministes (hachage des mots), dimension et latence par appel configurables."""
+
+    batch_queries = True  # embed_query(t) == embed_documents([t])[0] : questions groupées par le serveur
+
+    def __init__(self, dim: int = 384, latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.model = f"hash-{dim}"
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text: str) -> List[float]:
+        vec = [0.0] * self.dim
+        words = _WORDS.findall(text.lower())
+        for token in words + [w[i:i + 3] for w in words for i in range(0, max(1, len(w) - 2), 2)]:
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+        return [x / norm for x in vec]
+
+    def _wait(self) -> None:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        self._wait()
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class StubLLM:
+    """LLM factice : `latency_ms` avant la réponse (répartie sur les tokens en streaming)."""
+
+    def __init__(self, latency_ms: float = 50.0, answer: str = STUB_ANSWER, token_chars: int = 4):
+        self.latency_ms = latency_ms
+        self.answer = answer
+        self.token_chars = token_chars
+        self.calls = 0
+
+    def invoke(self, prompt: str) -> str:
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        return self.answer
+
+    async def ainvoke(self, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self.answer
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        self.calls += 1
+        tokens = [self.answer[i:i + self.token_chars] for i in range(0, len(self.answer), self.token_chars)]
+        delay = self.latency_ms / 1000 / max(1, len(tokens))
+        for token in tokens:
+            await asyncio.sleep(delay)
+            yield token
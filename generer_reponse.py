@@ -1,7 +1,6 @@
 import json
-import re
+import time
 from typing import Dict, List, Any, Optional
-from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.llms import Ollama
 from langchain.prompts import PromptTemplate
@@ -10,48 +9,43 @@ from langchain.schema.output_parser import StrOutputParser
 from langchain.schema import BaseOutputParser
 import logging
 
+from indexer import load_and_prepare_documents, open_vector_store
+from rag_core.chunking import approximate_token_length
+from rag_core.context import ContextBuilder
+from rag_core.lexical import BM25Index, HybridRetriever
+from rag_core.postprocess import DEFAULT_ANSWER_MARKERS, ResponsePostProcessor
+from rag_core.scenarios import ScenarioClassifier, ScenarioFastPath
+
 # --- Configuration ---
 CLIENT_ID = "bms_ventouse"
 CLIENT_DATA_FILE = f"./clients/{CLIENT_ID}/data.json"
 CHROMA_COLLECTION_NAME = CLIENT_ID
 CHROMA_DB_DIRECTORY = "./chroma_db"
+# Budget du prompt en tokens (≈ 4 caractères/token) : le prefill de tinyllama sur CPU croît avec le prompt
+PROMPT_MAX_TOKENS = 1024
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Sections du gabarit de initialize_rag_system (« Tu es l'assistant de BMS Ventouse... ») : les retrouver
+# dans la sortie signale un prompt recopié, la réponse suit alors « Réponse professionnelle: »
+PROMPT_LEAK_MARKERS = ("INFORMATIONS ENTREPRISE:", "CLIENT DIT:", "Ta mission:", "MISSION", "VOCABULAIRE")
+# Motifs de nettoyage compilés une seule fois
+POSTPROCESSOR = ResponsePostProcessor(
+    leak_markers=PROMPT_LEAK_MARKERS,
+    answer_markers=(r"Réponse professionnelle\s*:",) + DEFAULT_ANSWER_MARKERS,
+)
+
 class AdvancedOutputParser(BaseOutputParser):
     """Parser avancé pour nettoyer et formater les réponses"""
     
     def parse(self, text: str) -> str:
-        # Nettoyage des artefacts de génération
-        cleaned_text = re.sub(r'\[.*?\]', '', text)
-        cleaned_text = re.sub(r'\*+\s?', '', cleaned_text)
-        cleaned_text = re.sub(r'\n+', '\n', cleaned_text)
-        
-        # Suppression du prompt si présent dans la réponse (CORRECTION CRITIQUE)
-        if "# 🎬 MISSION" in cleaned_text or "VOCABULAIRE" in cleaned_text:
-            # Le modèle a renvoyé le prompt - extraire seulement la réponse
-            parts = cleaned_text.split("**Réponse :**")
-            if len(parts) > 1:
-                cleaned_text = parts[-1].strip()
-            else:
-                # Chercher après "Réponse:"
-                parts = cleaned_text.split("Réponse:")
-                if len(parts) > 1:
-                    cleaned_text = parts[-1].strip()
-        
-        # Suppression des phrases répétées
-        sentences = cleaned_text.split('. ')
-        unique_sentences = []
-        for sentence in sentences:
-            if sentence and sentence not in unique_sentences:
-                unique_sentences.append(sentence)
-        
-        result = '. '.join(unique_sentences).strip()
+        # Nettoyage des artefacts, suppression du prompt recopié (CORRECTION CRITIQUE), phrases répétées
+        result = POSTPROCESSOR.clean(text)
         
         # Si la réponse est trop courte ou contient encore du prompt, fallback
-        if len(result) < 30 or "MISSION" in result or "VOCABULAIRE" in result:
+        if len(result) < 30 or any(marker in result for marker in PROMPT_LEAK_MARKERS):
             return "Merci pour votre message ! Notre équipe BMS Ventouse est à votre disposition. Contactez-nous au 06 XX XX XX XX pour une réponse personnalisée. 🎬"
         
         return result
@@ -61,9 +55,19 @@ class ContextEnhancer:
     
     def __init__(self, client_data: Dict):
         self.client_data = client_data
+        # Phrases dédupliquées, réduites aux plus pertinentes au-delà du budget ; 3 docs max pour tinyllama
+        self.builder = ContextBuilder(approximate_token_length, max_docs=3, label=self.label)
     
-    def enhance_context(self, docs: List[Any]) -> str:
-        """Enrichit le contexte avec des informations structurées"""
+    @staticmethod
+    def label(doc: Any) -> str:
+        return {
+            'reference_client': "Référence: ",
+            'offre_service': "Service: ",
+            'gestion_crise': "Urgent: ",
+        }.get(doc.metadata.get('type', 'general'), "")
+    
+    def enhance_context(self, docs: List[Any], question: str = "", max_tokens: Optional[int] = None) -> str:
+        """Enrichit le contexte avec des informations structurées, dans la limite de `max_tokens`"""
         if not docs:
             # FALLBACK CRITIQUE : Fournir un contexte de base quand aucun document n'est trouvé
             return f"""
@@ -73,21 +77,7 @@ Contact: Disponible 24/7 pour urgences tournage
 Références: Netflix, Amazon Prime, grandes productions françaises
 """
         
-        enhanced_parts = []
-        for doc in docs[:3]:  # Limiter à 3 docs pour tinyllama
-            source_type = doc.metadata.get('type', 'general')
-            source_content = doc.page_content
-            
-            if source_type == 'reference_client':
-                enhanced_parts.append(f"Référence: {source_content}")
-            elif source_type == 'offre_service':
-                enhanced_parts.append(f"Service: {source_content}")
-            elif source_type == 'gestion_crise':
-                enhanced_parts.append(f"Urgent: {source_content}")
-            else:
-                enhanced_parts.append(source_content)
-        
-        return "\n".join(enhanced_parts)
+        return self.builder.build(docs, question, max_tokens).text
 
 class ResponseQualityChecker:
     """Vérifie la qualité des réponses générées"""
@@ -99,8 +89,7 @@ class ResponseQualityChecker:
             "sufficient_length": len(response) >= min_length,
             "has_contact_cta": any(keyword in response.lower() for keyword in 
                                  ['contact', 'appel', 'whatsapp', 'email', 'devis', 'disponible']),
-            "no_prompt_leak": not any(leak in response for leak in 
-                                     ["MISSION", "VOCABULAIRE", "DIRECTIVES", "# 🎬"])
+            "no_prompt_leak": not any(leak in response for leak in PROMPT_LEAK_MARKERS + ("DIRECTIVES",))
         }
         
         checks["all_passed"] = all(checks.values())
@@ -128,28 +117,30 @@ def initialize_rag_system(client_data: Dict[str, Any]):
         temperature=0.7,  # Plus créatif pour compenser la petite taille
         num_predict=300,  # Réponses plus courtes = plus rapide
         top_k=20,
-        top_p=0.9
+        top_p=0.9,
+        keep_alive="30m"  # Modèle (et cache du préfixe) gardé en mémoire entre deux questions
     )
     
     # 2. Connexion à la base vectorielle
-    vectorstore = Chroma(
-        collection_name=CHROMA_COLLECTION_NAME,
-        embedding_function=embeddings,
-        persist_directory=CHROMA_DB_DIRECTORY
-    )
+    vectorstore = open_vector_store(CHROMA_COLLECTION_NAME, CHROMA_DB_DIRECTORY, embeddings)
     
-    # 3. Retrieveur avec seuil abaissé (CORRECTION CRITIQUE)
-    retriever = vectorstore.as_retriever(
-        search_type="similarity_score_threshold",
-        search_kwargs={
-            "k": 3,  # Seulement 3 docs pour tinyllama (moins de contexte)
-            "score_threshold": 0.3  # ABAISSÉ de 0.6 à 0.3 pour plus de résultats
-        }
+    # 3. Retrieveur hybride : similarité avec seuil abaissé (CORRECTION CRITIQUE) + BM25 sur les termes métier
+    lexical_index = BM25Index(load_and_prepare_documents(CLIENT_DATA_FILE))
+    retriever = HybridRetriever(
+        vectorstore=vectorstore,
+        lexical_index=lexical_index,
+        k=3,  # Seulement 3 docs pour tinyllama (moins de contexte)
+        fetch_k=6,  # Candidats par source avant fusion (RRF)
+        score_threshold=0.3  # ABAISSÉ de 0.6 à 0.3 pour plus de résultats
     )
     
     # 4. Template de prompt SIMPLIFIÉ pour tinyllama (CORRECTION CRITIQUE)
+    # Partie fixe en tête : le runner Ollama réutilise le cache KV du plus long préfixe commun
+    # avec le prompt précédent, seule la partie variable (contexte, question) est recalculée
     template = """Tu es l'assistant de BMS Ventouse, expert en logistique audiovisuelle.
 
+Ta mission: Réponds en 2-3 phrases courtes et professionnelles. Propose une solution concrète. Termine par un appel à l'action (contact, devis, etc.).
+
 INFORMATIONS ENTREPRISE:
 {context}
 
@@ -157,26 +148,14 @@ CLIENT DIT: "{question}"
 
 SITUATION: {scenario_type}
 
-Ta mission: Réponds en 2-3 phrases courtes et professionnelles. Propose une solution concrète. Termine par un appel à l'action (contact, devis, etc.).
-
 Réponse professionnelle:"""
     
     # 5. Initialisation des composants avancés
     context_enhancer = ContextEnhancer(client_data)
     output_parser = AdvancedOutputParser()
-    
-    # 6. Détection de scénario simplifiée
-    def detect_scenario(question: str) -> str:
-        question_lower = question.lower()
-        
-        if any(kw in question_lower for kw in ['urgent', 'demain', 'crise']):
-            return "URGENCE détectée"
-        elif any(kw in question_lower for kw in ['prix', 'devis', 'budget']):
-            return "Demande de DEVIS"
-        elif any(kw in question_lower for kw in ['référence', 'expérience']):
-            return "Demande de RÉFÉRENCES"
-        else:
-            return "Question générale"
+    # 6. Détection de scénario : déclencheurs de data.json compilés une seule fois
+    classifier = ScenarioClassifier.from_client_data(client_data)
+    fast_path = ScenarioFastPath.from_client_data(client_data, classifier)  # None si non activé dans data.json
     
     # 7. Construction du prompt
     prompt = PromptTemplate(
@@ -187,10 +166,21 @@ Réponse professionnelle:"""
     # 8. Chaîne RAG SIMPLIFIÉE (CORRECTION CRITIQUE)
     def process_query(question: str) -> str:
         try:
+            # Scénario critique détecté avec certitude : réponse préparée, sans LLM
+            if fast_path is not None:
+                quick = fast_path.answer(question)
+                if quick is not None:
+                    logger.info("⚡ Réponse fast-path (scénario critique)")
+                    return quick
+            
             # Récupération du contexte
+            t0 = time.perf_counter()
             docs = retriever.get_relevant_documents(question)
-            context = context_enhancer.enhance_context(docs)
-            scenario = detect_scenario(question)
+            t1 = time.perf_counter()
+            scenario = classifier.label(question)
+            # Le contexte dispose de ce qui reste du budget une fois le gabarit et la question comptés
+            overhead = approximate_token_length(prompt.format(context="", question=question, scenario_type=scenario))
+            context = context_enhancer.enhance_context(docs, question, max_tokens=max(0, PROMPT_MAX_TOKENS - overhead))
             
             # Log pour debugging
             logger.info(f"📄 Documents trouvés: {len(docs)}")
@@ -202,12 +192,26 @@ Réponse professionnelle:"""
                 question=question,
                 scenario_type=scenario
             )
+            t2 = time.perf_counter()
             
             # Appel au LLM
-            raw_response = llm.invoke(prompt_text)
+            result = llm.generate([prompt_text]).generations[0][0]
+            raw_response = result.text
+            t3 = time.perf_counter()
+            # Prefill mesuré par Ollama : faible quand le préfixe fixe a été réutilisé
+            info = result.generation_info or {}
             
             # Parsing
             parsed_response = output_parser.parse(raw_response)
+            t4 = time.perf_counter()
+            
+            # Temps par étape : recherche (embedding + vecteurs + BM25), contexte/prompt, génération, parsing
+            logger.info(
+                f"⏱️ Recherche {(t1 - t0) * 1000:.0f} ms | Prompt {(t2 - t1) * 1000:.1f} ms "
+                f"(~{approximate_token_length(prompt_text)} tokens) | "
+                f"Génération {(t3 - t2) * 1000:.0f} ms (prefill {info.get('prompt_eval_duration', 0) / 1e6:.0f} ms, "
+                f"{info.get('prompt_eval_count', '?')} tokens évalués) | Parsing {(t4 - t3) * 1000:.1f} ms"
+            )
             
             return parsed_response
             
@@ -228,7 +232,7 @@ def main():
         process_query, vectorstore = initialize_rag_system(client_data)
         
         # Vérification du nombre de documents
-        collection_count = vectorstore._collection.count()
+        collection_count = len(vectorstore.get(include=[])["ids"])
         logger.info(f"📊 Base vectorielle contenant {collection_count} documents")
         
         print(f"\n{'='*60}")
@@ -1,17 +1,26 @@
 import json
-import chromadb
+import hashlib
 import os
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain.docstore.document import Document
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable
 import logging
 
+from rag_core.chunking import iter_chunks
+from rag_core.embedding_cache import CachedEmbeddings, EmbeddingCache
+from rag_core.vector_index import MemmapVectorStore
+
 # --- Configuration ---
 CLIENT_ID = "bms_ventouse"
 CLIENT_DATA_FILE = f"./clients/{CLIENT_ID}/data.json"
 CHROMA_COLLECTION_NAME = CLIENT_ID
 CHROMA_DB_DIRECTORY = "./chroma_db"
+EMBED_CACHE_PATH = "./embeddings_cache.sqlite"
+# chroma (défaut) | memmap : matrice NumPy en mémoire projetée, recherche cosinus exacte (rag_core.vector_index)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+# Recouvrement entre chunks consécutifs (caractères ici, tokens via l'API ; 0 = aucun)
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "0"))
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -21,26 +30,17 @@ class DataPreprocessor:
     """Classe dédiée au prétraitement des données pour améliorer la qualité des embeddings"""
     
     @staticmethod
-    def chunk_text(text: str, max_length: int = 500) -> List[str]:
-        """Découpe les textes longs en chunks pour de meilleurs embeddings"""
-        words = text.split()
-        chunks = []
-        current_chunk = []
-        
-        for word in words:
-            if len(' '.join(current_chunk + [word])) <= max_length:
-                current_chunk.append(word)
-            else:
-                chunks.append(' '.join(current_chunk))
-                current_chunk = [word]
-        
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
-            
-        return chunks
+    def chunk_text(text: str, max_length: int = 500, overlap: int = 0,
+                   length_fn: Optional[Callable[[str], int]] = None) -> List[str]:
+        """Découpe les textes longs en chunks (fins de phrase privilégiées) pour de meilleurs embeddings"""
+        return list(iter_chunks(text, max_length=max_length, overlap=overlap, length_fn=length_fn))
+
+def load_and_prepare_documents(filepath: str, length_fn: Optional[Callable[[str], int]] = None,
+                               max_length: int = 500, overlap: int = 0) -> List[Document]:
+    """Charge le fichier JSON et le transforme en une liste de 'Documents' pour LangChain.
 
-def load_and_prepare_documents(filepath: str) -> List[Document]:
-    """Charge le fichier JSON et le transforme en une liste de 'Documents' pour LangChain."""
+    `length_fn` / `max_length` : taille maximale des chunks (caractères par défaut, tokens du
+    modèle d'embeddings avec un compteur de tokens) ; `overlap` : recouvrement, même unité."""
     
     logger.info(f"Chargement et parsing du fichier de données : {filepath}")
     
@@ -68,7 +68,8 @@ def load_and_prepare_documents(filepath: str) -> List[Document]:
     info_text = " | ".join(info_sections)
     
     # Découpage en chunks si nécessaire
-    info_chunks = preprocessor.chunk_text(info_text)
+    info_chunks = preprocessor.chunk_text(info_text, max_length=max_length, overlap=overlap,
+                                        length_fn=length_fn)
     for i, chunk in enumerate(info_chunks):
         documents.append(Document(
             page_content=chunk, 
@@ -83,7 +84,8 @@ def load_and_prepare_documents(filepath: str) -> List[Document]:
         f"Mots-clés importants: {', '.join(data['ai_personality']['vocabulaire_metier']['mots_puissants'])} | "
         f"Termes techniques: {', '.join(data['ai_personality']['vocabulaire_metier']['terms_techniques'])}"
     )
-    personality_chunks = preprocessor.chunk_text(personality_text)
+    personality_chunks = preprocessor.chunk_text(personality_text, max_length=max_length, overlap=overlap,
+                                               length_fn=length_fn)
     for i, chunk in enumerate(personality_chunks):
         documents.append(Document(
             page_content=chunk,
@@ -187,29 +189,72 @@ def load_and_prepare_documents(filepath: str) -> List[Document]:
     logger.info(f"✅ {len(documents)} documents préparés pour l'indexation avec métadonnées enrichies")
     return documents
 
-def initialize_vector_store(documents: List[Document], collection_name: str, persist_directory: str) -> Chroma:
-    """Initialise et retourne le vector store Chroma"""
+def compute_document_id(doc: Document) -> str:
+    """Identifiant stable d'un document : section source + empreinte (métadonnées + contenu)"""
     
-    logger.info("Création des embeddings avec Ollama...")
+    metadata = json.dumps(doc.metadata, sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha256(f"{metadata}\n{doc.page_content}".encode("utf-8")).hexdigest()
+    return f"{doc.metadata.get('source', 'document')}:{digest[:32]}"
+
+def assign_document_ids(documents: List[Document]) -> Dict[str, Document]:
+    """Associe chaque document à son identifiant stable (les doublons exacts sont fusionnés)"""
     
-    embeddings = OllamaEmbeddings(model="nomic-embed-text")
+    documents_by_id: Dict[str, Document] = {}
+    for doc in documents:
+        documents_by_id.setdefault(compute_document_id(doc), doc)
+    return documents_by_id
+
+def sync_vector_store(vectorstore: Chroma, documents: List[Document]) -> Dict[str, int]:
+    """Synchronise la collection avec les documents : seuls les documents modifiés sont (ré)embeddés"""
     
-    # Nettoyage de l'ancienne collection
-    client = chromadb.PersistentClient(path=persist_directory)
-    try:
-        client.delete_collection(name=collection_name)
-        logger.info(f"Ancienne collection '{collection_name}' supprimée")
-    except (ValueError, Exception) as e:
-        logger.info(f"Collection '{collection_name}' non trouvée, création nouvelle collection")
+    documents_by_id = assign_document_ids(documents)
+    existing_ids = set(vectorstore.get(include=[])["ids"])
+    
+    stale_ids = sorted(existing_ids - documents_by_id.keys())
+    new_ids = [doc_id for doc_id in documents_by_id if doc_id not in existing_ids]
     
-    # Création du vector store
-    vectorstore = Chroma.from_documents(
-        documents=documents,
-        embedding=embeddings,
+    if stale_ids:
+        vectorstore.delete(ids=stale_ids)
+    if new_ids:
+        vectorstore.add_documents([documents_by_id[doc_id] for doc_id in new_ids], ids=new_ids)
+    
+    stats = {
+        "added": len(new_ids),
+        "deleted": len(stale_ids),
+        "unchanged": len(documents_by_id) - len(new_ids),
+    }
+    logger.info(
+        f"Synchronisation: {stats['added']} ajoutés, {stats['deleted']} supprimés, "
+        f"{stats['unchanged']} inchangés"
+    )
+    return stats
+
+def open_vector_store(collection_name: str, persist_directory: str, embeddings: Any):
+    """Ouvre la collection persistée avec le backend choisi par VECTOR_BACKEND"""
+    
+    if VECTOR_BACKEND == "memmap":
+        return MemmapVectorStore(os.path.join(persist_directory, f"{collection_name}_memmap"), embeddings)
+    return Chroma(
         collection_name=collection_name,
+        embedding_function=embeddings,
         persist_directory=persist_directory,
         collection_metadata={"hnsw:space": "cosine"}  # Optimisation pour la similarité
     )
+
+def initialize_vector_store(documents: List[Document], collection_name: str, persist_directory: str,
+                            embeddings: Optional[Any] = None):
+    """Initialise (ou met à jour de façon incrémentale) et retourne le vector store (Chroma ou memmap)"""
+    
+    logger.info("Création des embeddings avec Ollama...")
+    
+    if embeddings is None:
+        embeddings = CachedEmbeddings(OllamaEmbeddings(model="nomic-embed-text"), EmbeddingCache(EMBED_CACHE_PATH))
+    
+    # Ouverture de la collection existante : seuls les documents modifiés seront ré-embeddés
+    vectorstore = open_vector_store(collection_name, persist_directory, embeddings)
+    sync_vector_store(vectorstore, documents)
+    if isinstance(embeddings, CachedEmbeddings):
+        logger.info(f"Cache embeddings: {embeddings.cache.stats()}")
     
     return vectorstore
 
@@ -237,7 +282,7 @@ def verify_embedding_quality(vectorstore: Chroma, test_queries: List[str] = None
 if __name__ == "__main__":
     try:
         # 1. Chargement et préparation des documents
-        documents_to_index = load_and_prepare_documents(CLIENT_DATA_FILE)
+        documents_to_index = load_and_prepare_documents(CLIENT_DATA_FILE, overlap=CHUNK_OVERLAP)
         
         # 2. Initialisation du vector store
         vectorstore = initialize_vector_store(
@@ -1,5 +1,6 @@
 import json
-import re
+import os
+import sys
 import logging
 from typing import Dict, List, Any
 from langchain_community.vectorstores import Chroma
@@ -8,6 +9,15 @@ from langchain_community.llms import Ollama
 from langchain.prompts import PromptTemplate
 from langchain.schema import BaseOutputParser
 
+# Modules partagés (rag_core) accessibles aussi via `python rag_alt/generer_reponse.py`
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT_DIR not in sys.path:
+    sys.path.append(_ROOT_DIR)
+from rag_alt.indexer import load_and_prepare_documents  # noqa: E402
+from rag_core.lexical import BM25Index, HybridRetriever  # noqa: E402
+from rag_core.postprocess import ResponsePostProcessor  # noqa: E402
+from rag_core.scenarios import ScenarioClassifier  # noqa: E402
+
 # Configuration (RAG séparé)
 CLIENT_ID = "template_client"  # Changez pour votre nouveau client
 CLIENT_DATA_FILE = f"./rag_alt/clients/{CLIENT_ID}/data.json"
@@ -18,29 +28,20 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 
+# Marqueurs de fuite du parser d'origine : « # » seul (titres markdown recopiés, même sans espace)
+POSTPROCESSOR = ResponsePostProcessor(leak_markers=("MISSION", "VOCABULAIRE", "#"))
+
+
 class AdvancedOutputParser(BaseOutputParser):
+    # BaseOutputParser est un modèle pydantic : les attributs doivent être déclarés
+    brand_name: str
+
     def __init__(self, brand_name: str):
-        self.brand_name = brand_name
+        super().__init__(brand_name=brand_name)
 
     def parse(self, text: str) -> str:
-        t = re.sub(r"\[.*?\]", "", text)
-        t = re.sub(r"\*+\s?", "", t)
-        t = re.sub(r"\n+", "\n", t)
-
-        # Supprime d'éventuelles sections de prompt leak
-        for marker in ["MISSION", "VOCABULAIRE", "#"]:
-            if marker in t:
-                parts = re.split(r"Réponse\s*:|\*\*Réponse\s*:?\*\*", t)
-                if len(parts) > 1:
-                    t = parts[-1].strip()
-
-        # Déduplique les phrases
-        sentences = [s.strip() for s in t.split(". ") if s.strip()]
-        uniq = []
-        for s in sentences:
-            if s not in uniq:
-                uniq.append(s)
-        res = ". ".join(uniq).strip()
+        # Artefacts, prompt leak (MISSION / VOCABULAIRE / #), phrases dédupliquées
+        res = POSTPROCESSOR.clean(text)
 
         if len(res) < 25:
             return f"Merci pour votre message. L'équipe {self.brand_name} vous répond rapidement. Contact direct recommandé pour un devis ou une précision."
@@ -97,9 +98,13 @@ def initialize_rag(client_data: Dict[str, Any]):
         persist_directory=CHROMA_DB_DIRECTORY,
     )
 
-    retriever = vectorstore.as_retriever(
-        search_type="similarity_score_threshold",
-        search_kwargs={"k": 3, "score_threshold": 0.3},
+    # Même retrieveur hybride que le RAG principal et l'API : similarité avec seuil + BM25, fusion RRF
+    retriever = HybridRetriever(
+        vectorstore=vectorstore,
+        lexical_index=BM25Index(load_and_prepare_documents(CLIENT_DATA_FILE)),
+        k=3,
+        fetch_k=6,
+        score_threshold=0.3,
     )
 
     template = """Tu es l'assistant de {brand_name}.
@@ -121,21 +126,12 @@ Réponse:"""
 
     enhancer = ContextEnhancer(client_data)
     parser = AdvancedOutputParser(brand_name)
-
-    def detect_scenario(q: str) -> str:
-        ql = q.lower()
-        if any(k in ql for k in ["urgent", "demain", "crise", "last minute"]):
-            return "Urgence"
-        if any(k in ql for k in ["prix", "devis", "budget", "tarif"]):
-            return "Devis"
-        if any(k in ql for k in ["référence", "reference", "portfolio"]):
-            return "Références"
-        return "Question générale"
+    classifier = ScenarioClassifier.from_client_data(client_data)
 
     def process(question: str) -> str:
         docs = retriever.get_relevant_documents(question)
         context = enhancer.enhance_context(docs)
-        scen = detect_scenario(question)
+        scen = classifier.label(question)
         prompt_text = prompt.format(brand_name=brand_name, context=context, question=question, scenario=scen)
         raw = llm.invoke(prompt_text)
         return parser.parse(raw)
@@ -1,16 +1,25 @@
 import json
-import chromadb
+import hashlib
 import logging
-from typing import List, Dict, Any
+import os
+import sys
+from typing import List, Dict, Any, Optional, Callable
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain.docstore.document import Document
 
+# Modules partagés (rag_core) accessibles aussi via `python rag_alt/indexer.py`
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT_DIR not in sys.path:
+    sys.path.append(_ROOT_DIR)
+from rag_core.chunking import iter_chunks  # noqa: E402
+
 # Configuration (RAG séparé)
 CLIENT_ID = "template_client"  # Changez pour votre nouveau client
 CLIENT_DATA_FILE = f"./rag_alt/clients/{CLIENT_ID}/data.json"
 CHROMA_COLLECTION_NAME = f"rag_alt_{CLIENT_ID}"
 CHROMA_DB_DIRECTORY = "./rag_alt/chroma_db_alt"
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "0"))  # recouvrement entre chunks (caractères ; 0 = aucun)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -18,22 +27,13 @@ logger = logging.getLogger(__name__)
 
 class DataPreprocessor:
     @staticmethod
-    def chunk_text(text: str, max_length: int = 500) -> List[str]:
-        words = text.split()
-        chunks, current = [], []
-        for w in words:
-            if len(" ".join(current + [w])) <= max_length:
-                current.append(w)
-            else:
-                if current:
-                    chunks.append(" ".join(current))
-                current = [w]
-        if current:
-            chunks.append(" ".join(current))
-        return chunks
-
-
-def load_and_prepare_documents(filepath: str) -> List[Document]:
+    def chunk_text(text: str, max_length: int = 500, overlap: int = 0,
+                   length_fn: Optional[Callable[[str], int]] = None) -> List[str]:
+        return list(iter_chunks(text, max_length=max_length, overlap=overlap, length_fn=length_fn))
+
+
+def load_and_prepare_documents(filepath: str, length_fn: Optional[Callable[[str], int]] = None,
+                               max_length: int = 500, overlap: int = 0) -> List[Document]:
     logger.info(f"Chargement du fichier client: {filepath}")
     with open(filepath, "r", encoding="utf-8") as f:
         data = json.load(f)
@@ -54,7 +54,8 @@ def load_and_prepare_documents(filepath: str) -> List[Document]:
         f"Zone: {cli.get('intervention_zone','')}",
         f"Horaires: {cli.get('business_hours','')}",
     ]
-    for i, chunk in enumerate(prep.chunk_text(" | ".join(info_sections))):
+    for i, chunk in enumerate(prep.chunk_text(" | ".join(info_sections), max_length=max_length, overlap=overlap,
+                                                length_fn=length_fn)):
         docs.append(Document(page_content=chunk, metadata={"source": "entreprise_info", "chunk": i, "type": "infos"}))
 
     # 2) Personnalité IA
@@ -67,7 +68,8 @@ def load_and_prepare_documents(filepath: str) -> List[Document]:
         f"Mots puissants: {', '.join(vm.get('mots_puissants', []))}",
         f"Termes techniques: {', '.join(vm.get('terms_techniques', []))}",
     ])
-    for i, chunk in enumerate(prep.chunk_text(personality_text)):
+    for i, chunk in enumerate(prep.chunk_text(personality_text, max_length=max_length, overlap=overlap,
+                                                length_fn=length_fn)):
         docs.append(Document(page_content=chunk, metadata={"source": "ai_personality", "chunk": i, "type": "comportement"}))
 
     # 3) Services
@@ -113,25 +115,45 @@ def load_and_prepare_documents(filepath: str) -> List[Document]:
     return docs
 
 
-def initialize_vector_store(documents: List[Document], collection_name: str, persist_directory: str) -> Chroma:
+def compute_document_id(doc: Document) -> str:
+    # Section source + empreinte (métadonnées + contenu) : stable d'une indexation à l'autre
+    metadata = json.dumps(doc.metadata, sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha256(f"{metadata}\n{doc.page_content}".encode("utf-8")).hexdigest()
+    return f"{doc.metadata.get('source', 'document')}:{digest[:32]}"
+
+
+def sync_vector_store(vectorstore: Chroma, documents: List[Document]) -> Dict[str, int]:
+    docs_by_id: Dict[str, Document] = {}
+    for doc in documents:
+        docs_by_id.setdefault(compute_document_id(doc), doc)
+    existing = set(vectorstore.get(include=[])["ids"])
+
+    stale = sorted(existing - docs_by_id.keys())
+    new_ids = [i for i in docs_by_id if i not in existing]
+    if stale:
+        vectorstore.delete(ids=stale)
+    if new_ids:
+        vectorstore.add_documents([docs_by_id[i] for i in new_ids], ids=new_ids)
+
+    stats = {"added": len(new_ids), "deleted": len(stale), "unchanged": len(docs_by_id) - len(new_ids)}
+    logger.info(f"Synchronisation: {stats['added']} ajoutés, {stats['deleted']} supprimés, {stats['unchanged']} inchangés")
+    return stats
+
+
+def initialize_vector_store(documents: List[Document], collection_name: str, persist_directory: str,
+                            embeddings: Optional[Any] = None) -> Chroma:
     logger.info("Création embeddings (nomic-embed-text via Ollama)...")
-    embeddings = OllamaEmbeddings(model="nomic-embed-text")
-
-    # Purge collection
-    client = chromadb.PersistentClient(path=persist_directory)
-    try:
-        client.delete_collection(name=collection_name)
-        logger.info(f"Ancienne collection '{collection_name}' supprimée")
-    except Exception:
-        logger.info(f"Création nouvelle collection '{collection_name}'")
-
-    vs = Chroma.from_documents(
-        documents=documents,
-        embedding=embeddings,
+    if embeddings is None:
+        embeddings = OllamaEmbeddings(model="nomic-embed-text")
+
+    # Mise à jour incrémentale : seuls les documents modifiés sont ré-embeddés
+    vs = Chroma(
         collection_name=collection_name,
+        embedding_function=embeddings,
         persist_directory=persist_directory,
         collection_metadata={"hnsw:space": "cosine"},
     )
+    sync_vector_store(vs, documents)
     return vs
 
 
@@ -144,7 +166,7 @@ def verify(vectorstore: Chroma, queries: List[str] = None):
 
 
 if __name__ == "__main__":
-    docs = load_and_prepare_documents(CLIENT_DATA_FILE)
+    docs = load_and_prepare_documents(CLIENT_DATA_FILE, overlap=CHUNK_OVERLAP)
     vs = initialize_vector_store(docs, CHROMA_COLLECTION_NAME, CHROMA_DB_DIRECTORY)
     verify(vs)
     logger.info(f"OK — Base vectorielle '{CHROMA_COLLECTION_NAME}' créée dans {CHROMA_DB_DIRECTORY}")
\ No newline at end of file
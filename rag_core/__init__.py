@@ -0,0 +1 @@
+# Package initializer for rag_core
\ No newline at end of file
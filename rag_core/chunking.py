@@ -0,0 +1,102 @@
+"""Découpage linéaire des textes longs en chunks pour l'indexation.
+
+Le texte est parcouru une seule fois : la longueur courante du chunk est
+tenue à jour de façon incrémentale (O(n) au lieu de reconstruire le chunk à
+chaque mot). Les chunks s'arrêtent de préférence en fin de phrase, les
+phrases trop longues sont découpées par mots, et un recouvrement optionnel
+reprend la fin du chunk précédent.
+"""
+import re
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Optional
+
+LengthFn = Callable[[str], int]
+
+# Fin de phrase (ou séparateur de sections « | ») suivie d'espaces
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…|;])\s+")
+_WHITESPACE = re.compile(r"\S+")
+
+
+def split_sentences(text: str) -> Iterator[str]:
+    start = 0
+    for match in _SENTENCE_BOUNDARY.finditer(text):
+        sentence = text[start:match.start()].strip()
+        if sentence:
+            yield sentence
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        yield tail
+
+
+def _units(text: str, max_length: int, length_fn: LengthFn, sentences: bool) -> Iterator[str]:
+    """Phrases entières quand elles tiennent dans un chunk, mots sinon."""
+    if not sentences:
+        for word in _WHITESPACE.finditer(text):
+            yield word.group()
+        return
+    for sentence in split_sentences(text):
+        if length_fn(sentence) <= max_length:
+            yield " ".join(sentence.split())
+        else:
+            for word in _WHITESPACE.finditer(sentence):
+                yield word.group()
+
+
+def iter_chunks(text: str, max_length: int = 500, overlap: int = 0, length_fn: Optional[LengthFn] = None,
+                sentences: bool = True) -> Iterator[str]:
+    """Génère les chunks de `text` d'au plus `max_length` (unités de `length_fn`, caractères par défaut).
+
+    `overlap` : longueur maximale reprise de la fin du chunk précédent (0 = aucun recouvrement).
+    Une unité plus longue que `max_length` (mot isolé) forme un chunk à elle seule.
+    """
+    length_fn = length_fn or len
+    # Avec len, l'espace de jointure compte 1 ; un compteur de tokens l'ignore
+    sep = 1 if length_fn is len else 0
+    current: deque = deque()  # (unité, longueur)
+    current_length = 0
+
+    for unit in _units(text, max_length, length_fn, sentences):
+        unit_length = length_fn(unit)
+        added = unit_length + (sep if current else 0)
+        if current and current_length + added > max_length:
+            yield " ".join(u for u, _ in current)
+            # Recouvrement : on ne garde que la fin du chunk émis
+            kept = 0
+            tail: deque = deque()
+            for u, n in reversed(current):
+                if kept + n + (sep if tail else 0) > overlap:
+                    break
+                kept += n + (sep if tail else 0)
+                tail.appendleft((u, n))
+            current, current_length = tail, kept
+            # Le recouvrement ne doit pas empêcher l'unité suivante d'entrer
+            while current and current_length + unit_length + sep > max_length:
+                u, n = current.popleft()
+                current_length -= n + (sep if current else 0)
+            added = unit_length + (sep if current else 0)
+        current.append((unit, unit_length))
+        current_length += added
+
+    if current:
+        yield " ".join(u for u, _ in current)
+
+
+def chunk_texts(texts: Iterable[str], **kwargs) -> List[str]:
+    return [chunk for text in texts for chunk in iter_chunks(text, **kwargs)]
+
+
+def approximate_token_length(text: str) -> int:
+    """≈ 4 caractères par token, quand le tokenizer du modèle n'est pas disponible."""
+    return max(1, len(text) // 4)
+
+
+def token_length_function(model_name: str) -> LengthFn:
+    """Compteur de tokens du tokenizer HF du modèle d'embeddings actif (≈ 4 caractères/token à défaut)."""
+    try:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+    except Exception:
+        return approximate_token_length
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
@@ -0,0 +1,126 @@
+"""Construction du contexte du prompt sous budget de tokens.
+
+Les documents retrouvés sont découpés en phrases ; les phrases déjà présentes (chunks
+qui se recouvrent, même passage indexé deux fois) sont écartées. Si le tout dépasse le
+budget, les phrases sont retenues par pertinence — mots de la question, rang du document,
+phrase d'en-tête (« Service: ... | ») — jusqu'à épuisement du budget, puis restituées
+dans leur ordre d'origine. Le budget est compté avec le tokenizer du modèle actif :
+flan-t5-small tronque silencieusement au-delà de 512 tokens, et chaque token de prompt
+coûte du temps de prefill sur CPU.
+"""
+from functools import lru_cache
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from rag_core.chunking import LengthFn, approximate_token_length, split_sentences
+from rag_core.lexical import tokenize
+
+# Bonus de pertinence : première phrase d'un document (souvent son intitulé)
+_HEADER_BONUS = 1.0
+# Séparateur entre phrases / documents, compté à part du texte des phrases
+_SEPARATOR_TOKENS = 1
+
+
+class BuiltContext(NamedTuple):
+    text: str
+    tokens: int  # tokens du contexte final
+    sentences: int  # phrases conservées
+    dropped: int  # phrases écartées (doublons + budget)
+
+
+class _Sentence(NamedTuple):
+    text: str
+    key: str  # forme normalisée (déduplication)
+    words: frozenset
+    tokens: int
+
+
+class ContextBuilder:
+    """Contexte des `max_docs` premiers documents, dédupliqué et réduit à `max_tokens` si nécessaire."""
+
+    def __init__(self, count_tokens: LengthFn = approximate_token_length, max_docs: int = 3,
+                 label: Optional[Callable[[Any], str]] = None, cache_size: int = 4096):
+        self.count_tokens = count_tokens
+        self.max_docs = max_docs
+        self.label = label  # préfixe par document (ex. "Référence: ")
+        # Les documents d'un client reviennent sans cesse : découpage et comptage faits une fois par texte
+        self._analyze = lru_cache(maxsize=cache_size)(self._analyze_text)
+
+    def _analyze_text(self, text: str) -> Tuple[_Sentence, ...]:
+        return tuple(
+            _Sentence(s, " ".join(words), frozenset(words), self.count_tokens(s))
+            for s, words in ((s, tokenize(s)) for s in split_sentences(text))
+        )
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Plus long préfixe (en mots) qui tient dans `max_tokens`."""
+        words = text.split()
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(" ".join(words[:middle])) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
+
+    def build(self, docs: Sequence, question: str = "", max_tokens: Optional[int] = None) -> BuiltContext:
+        docs = list(docs)[:self.max_docs]
+        labels = [self.label(doc) if self.label else "" for doc in docs]
+        label_tokens = [self.count_tokens(label) if label else 0 for label in labels]
+
+        # 1. Phrases uniques, dans l'ordre des documents
+        candidates: List[Tuple[int, int, _Sentence]] = []  # (document, position, phrase)
+        # Clés exactes : le chunker coupe en fin de phrase, le recouvrement répète des phrases entières
+        seen = set()
+        total = 0
+        for d, doc in enumerate(docs):
+            for position, sentence in enumerate(self._analyze(doc.page_content)):
+                if not sentence.key or sentence.key in seen:
+                    total += 1
+                    continue
+                seen.add(sentence.key)
+                candidates.append((d, position, sentence))
+        total += len(candidates)
+
+        # 2. Sélection sous budget (tout est gardé si ça tient)
+        cost = sum(s.tokens + _SEPARATOR_TOKENS for _, _, s in candidates)
+        cost += sum(label_tokens[d] for d in {d for d, _, _ in candidates})
+        if max_tokens is None or cost <= max_tokens:
+            chosen = candidates
+        else:
+            chosen = self._select(candidates, question, max_tokens, label_tokens)
+
+        # 3. Restitution dans l'ordre d'origine, un document par ligne
+        parts: List[List[str]] = [[] for _ in docs]
+        for d, _, sentence in sorted(chosen, key=lambda c: (c[0], c[1])):
+            parts[d].append(sentence.text)
+        text = "\n".join(labels[d] + " ".join(p) for d, p in enumerate(parts) if p)
+        return BuiltContext(text, self.count_tokens(text) if text else 0, len(chosen), total - len(chosen))
+
+    def _select(self, candidates: List[Tuple[int, int, _Sentence]], question: str, max_tokens: int,
+                label_tokens: List[int]) -> List[Tuple[int, int, _Sentence]]:
+        question_words = frozenset(tokenize(question))
+
+        def score(candidate: Tuple[int, int, _Sentence]) -> float:
+            d, position, sentence = candidate
+            return (len(question_words & sentence.words) + 1.0 / (1 + d)
+                    + (_HEADER_BONUS if position == 0 else 0.0))
+
+        chosen: List[Tuple[int, int, _Sentence]] = []
+        used_docs = set()
+        remaining = max_tokens
+        for candidate in sorted(candidates, key=lambda c: (-score(c), c[0], c[1])):
+            d, position, sentence = candidate
+            needed = sentence.tokens + _SEPARATOR_TOKENS + (label_tokens[d] if d not in used_docs else 0)
+            if needed <= remaining:
+                chosen.append(candidate)
+                used_docs.add(d)
+                remaining -= needed
+        if not chosen and candidates:
+            # Aucune phrase ne tient entière : début de la plus pertinente
+            d, position, sentence = max(candidates, key=score)
+            budget = max_tokens - label_tokens[d] - _SEPARATOR_TOKENS
+            text = self._truncate(sentence.text, budget) if budget > 0 else ""
+            if text:
+                chosen.append((d, position, sentence._replace(text=text)))
+        return chosen
@@ -0,0 +1,231 @@
+"""Cache disque des embeddings, partagé entre reconstructions, clients et modes (main/alt).
+
+Les vecteurs sont stockés en float32 dans un fichier SQLite, indexés par
+(nom du modèle, empreinte SHA-256 du texte). Le cache est borné en nombre
+d'entrées : les vecteurs les moins récemment utilisés sont évincés. Une lecture
+n'écrit rien : la date d'utilisation d'un vecteur n'est rafraîchie que si elle a
+plus de `touch_interval` secondes, et ces mises à jour sont regroupées avec
+l'écriture suivante (ou au plus tard `touch_interval` secondes après).
+"""
+import array
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List
+
+from langchain.schema.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Limite de variables SQLite par requête (999 sur les anciennes versions)
+_SQLITE_BATCH = 500
+# Dates d'utilisation en attente au-delà desquelles elles sont écrites sans attendre
+_TOUCH_FLUSH = 1000
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def embedding_model_name(embeddings: Any) -> str:
+    """Nom stable du modèle d'embeddings (classe + modèle), utilisé comme espace de clés du cache."""
+    underlying = getattr(embeddings, "underlying", None)
+    if underlying is not None:
+        return embedding_model_name(underlying)
+    model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None) or "default"
+    return f"{type(embeddings).__name__}:{model}"
+
+
+# Classes dont embed_query(t) == embed_documents([t])[0] : plusieurs requêtes en un seul appel.
+# Une autre classe peut le déclarer elle-même avec l'attribut `batch_queries = True`
+_BATCHABLE_QUERY_MODELS = {"HuggingFaceEmbeddings", "SentenceTransformerEmbeddings", "OpenAIEmbeddings",
+                           "OnnxEmbeddings"}
+
+
+def batches_queries(embeddings: Any) -> bool:
+    """Vrai si plusieurs questions peuvent être encodées en un seul appel au modèle."""
+    underlying = getattr(embeddings, "underlying", None)
+    if underlying is not None:
+        return batches_queries(underlying)
+    return type(embeddings).__name__ in _BATCHABLE_QUERY_MODELS or getattr(embeddings, "batch_queries", False) is True
+
+
+def _embed_queries_uncached(embeddings: Any, texts: List[str]) -> List[List[float]]:
+    if batches_queries(embeddings):
+        return embeddings.embed_documents(texts)
+    # Modèles à instruction de requête (Ollama, BGE...) : une requête à la fois
+    return [embeddings.embed_query(t) for t in texts]
+
+
+def embed_queries(embeddings: Any, texts: List[str]) -> List[List[float]]:
+    """Embeddings de plusieurs questions, groupés en un seul appel quand le modèle le permet."""
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.embed_queries(texts)
+    return _embed_queries_uncached(embeddings, texts)
+
+
+def _pack(vector: Iterable[float]) -> bytes:
+    return array.array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    vec = array.array("f")
+    vec.frombytes(blob)
+    return vec.tolist()
+
+
+class EmbeddingCache:
+    """Stockage SQLite (modèle, empreinte) -> vecteur float32, avec éviction LRU et compteurs."""
+
+    def __init__(self, path: str, max_entries: int = 200_000, touch_interval: float = 300.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._inherited: List[sqlite3.Connection] = []
+        self._conn = self._connect()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        # Nombre d'entrées tenu en mémoire (recompté avant d'évincer : d'autres processus écrivent aussi)
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._touches: Dict[tuple, float] = {}  # (modèle, empreinte) -> date d'utilisation à écrire
+        self._last_flush = time.time()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        if self.path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def reopen(self) -> None:
+        """Nouvelle connexion après un fork : une connexion SQLite ne doit pas franchir fork().
+
+        L'ancienne est conservée sans être utilisée ni fermée (la fermer depuis l'enfant
+        pourrait supprimer le WAL encore ouvert par le parent). Sans effet pour ":memory:".
+        """
+        if self.path == ":memory:":
+            return
+        self._lock = threading.Lock()
+        self._inherited.append(self._conn)
+        self._conn = self._connect()
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        hashes = list(dict.fromkeys(hashes))
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(hashes), _SQLITE_BATCH):
+                batch = hashes[start:start + _SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    "SELECT text_hash, vector, last_used FROM embeddings"
+                    f" WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for h, blob, last_used in rows:
+                    found[h] = _unpack(blob)
+                    if now - last_used > self.touch_interval:
+                        self._touches[(model, h)] = now
+            if self._touches and (len(self._touches) >= _TOUCH_FLUSH or now - self._last_flush > self.touch_interval):
+                self._flush_touches(now)
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]) -> None:
+        if not vectors:
+            return
+        now = time.time()
+        with self._lock:
+            # Même (modèle, texte) -> même vecteur : une entrée déjà écrite (autre processus) est gardée
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, h, _pack(v), now) for h, v in vectors.items()],
+            )
+            self._count += max(0, cursor.rowcount)
+            self._flush_touches(now)
+            self._evict()
+            self._conn.commit()
+
+    def _flush_touches(self, now: float) -> None:
+        if self._touches:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(used, model, h) for (model, h), used in self._touches.items()],
+            )
+            self._touches.clear()
+        self._last_flush = now
+
+    def _evict(self) -> None:
+        if self._count <= self.max_entries:
+            return
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE (model, text_hash) IN ("
+                " SELECT model, text_hash FROM embeddings ORDER BY last_used LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+            self._count -= overflow
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._count
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Enveloppe n'importe quel objet d'embeddings LangChain avec un EmbeddingCache."""
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache, namespace: str = None):
+        self.underlying = underlying
+        self.cache = cache
+        self.namespace = namespace or embedding_model_name(underlying)
+
+    def _embed(self, namespace: str, texts: List[str], compute) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        found = self.cache.get_many(namespace, hashes)
+        missing = {h: t for h, t in zip(hashes, texts) if h not in found}
+        if missing:
+            computed = dict(zip(missing.keys(), compute(list(missing.values()))))
+            self.cache.put_many(namespace, computed)
+            found.update(computed)
+        return [found[h] for h in hashes]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(self.namespace, texts, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        # Certains modèles (nomic, instructions) distinguent requêtes et documents
+        return self._embed(
+            f"{self.namespace}#query", [text], lambda texts: [self.underlying.embed_query(texts[0])]
+        )[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(
+            f"{self.namespace}#query", texts, lambda missing: _embed_queries_uncached(self.underlying, missing)
+        )
@@ -0,0 +1,108 @@
+"""Index lexical BM25 en mémoire et fusion avec la recherche vectorielle (Reciprocal Rank Fusion).
+
+Les termes métier rares (« ventousage », « PPMS », « mairie ») sont souvent mal
+représentés par un petit modèle d'embeddings ; l'index BM25, construit une fois
+par client sur les mêmes Documents que la collection vectorielle, les retrouve
+de façon exacte.
+"""
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, Hashable, List, Sequence, Tuple
+
+from langchain.schema import Document
+from langchain.schema.retriever import BaseRetriever
+
+_TOKEN = re.compile(r"\w+")
+
+STOPWORDS = frozenset(
+    "a au aux avec ce ces cet cette d dans de des du elle en est et il ils j je l la le les leur "
+    "lui m ma mais me mes mon n ne nos notre nous on ou par pas pour qu que qui s sa se ses son "
+    "sur t ta te tes ton tu un une vos votre vous y c est ete etre avoir".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Minuscules, sans accents, sans mots vides ; pluriel simple retiré (« ventouses » -> « ventouse »)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    tokens = []
+    for token in _TOKEN.findall(text):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token[-1] in "sx":
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """Index inversé BM25 (Okapi) sur une liste de Documents."""
+
+    def __init__(self, documents: Sequence[Document], k1: float = 1.5, b: float = 0.75):
+        self.documents = list(documents)
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths = []
+        for idx, doc in enumerate(self.documents):
+            counts = Counter(tokenize(doc.page_content))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((idx, tf))
+        n = len(self.documents)
+        avgdl = (sum(lengths) / n) if n else 0.0
+        # Normalisation par la longueur précalculée pour chaque document
+        self._norm = [k1 * (1 - b + b * (dl / avgdl if avgdl else 0.0)) for dl in lengths]
+        self._idf = {
+            term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for term, p in self.postings.items()
+        }
+        self.k1 = k1
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[Document, float]]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for idx, tf in self.postings[term]:
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + self._norm[idx])
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.documents[idx], score) for idx, score in best]
+
+
+def document_key(doc: Document) -> Hashable:
+    return doc.metadata.get("source"), doc.page_content
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Document]], k: int = 3, rrf_k: int = 60) -> List[Document]:
+    """Fusionne plusieurs classements : score(d) = somme 1 / (rrf_k + rang)."""
+    scores: Dict[Hashable, float] = defaultdict(float)
+    docs: Dict[Hashable, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = document_key(doc)
+            scores[key] += 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+    return [docs[key] for key, _ in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever LangChain : similarité vectorielle (avec seuil) + BM25, fusionnés par RRF."""
+
+    vectorstore: Any
+    lexical_index: Any
+    k: int = 3
+    fetch_k: int = 6
+    score_threshold: float = 0.3
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        vector_hits = [
+            doc
+            for doc, score in self.vectorstore.similarity_search_with_relevance_scores(query, k=self.fetch_k)
+            if score >= self.score_threshold
+        ]
+        lexical_hits = [doc for doc, _ in self.lexical_index.search(query, k=self.fetch_k)]
+        return reciprocal_rank_fusion([vector_hits, lexical_hits], k=self.k, rrf_k=self.rrf_k)
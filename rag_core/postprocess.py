@@ -0,0 +1,110 @@
+"""Post-traitement des réponses brutes du LLM (artefacts, fuite de prompt, phrases répétées).
+
+Les motifs sont compilés une seule fois et commencent par un caractère
+littéral (recherche rapide du moteur `re`) ; une passe n'est lancée que si son
+caractère est présent dans le texte. La déduplication des phrases est
+linéaire (ordre conservé). `IncrementalCleaner` applique le même nettoyage à un
+flux de tokens sans jamais re-parcourir le texte déjà émis.
+"""
+import re
+from typing import Iterable, List, Pattern
+
+DEFAULT_LEAK_MARKERS = ("MISSION", "VOCABULAIRE", "# ")
+DEFAULT_ANSWER_MARKERS = (r"Réponse\s*:", r"\*\*Réponse\s*:?\*\*")
+
+_BRACKETS = re.compile(r"\[[^\]\n]*\]")  # crochets sur une ligne (« [Votre nom] »)
+_STARS = re.compile(r"\*\**\s?")  # gras/italique markdown (préfixe littéral, contrairement à \*+)
+_NEWLINES = re.compile(r"\n\n+")  # les retours à la ligne isolés ne sont pas réécrits
+_SENTENCE_SEPARATOR = ". "
+
+
+def strip_markup(text: str) -> str:
+    """Supprime `[...]` et `*`, réduit les retours à la ligne multiples."""
+    if "[" in text:
+        text = _BRACKETS.sub("", text)
+    if "*" in text:
+        text = _STARS.sub("", text)
+    if "\n\n" in text:
+        text = _NEWLINES.sub("\n", text)
+    return text
+
+
+def dedupe_sentences(text: str) -> str:
+    """Supprime les phrases répétées (séparateur « . »), première occurrence conservée."""
+    sentences = (s.strip() for s in text.split(_SENTENCE_SEPARATOR))
+    return _SENTENCE_SEPARATOR.join(dict.fromkeys(s for s in sentences if s)).strip()
+
+
+class ResponsePostProcessor:
+    """Nettoyage complet d'une réponse ; sans état, partageable entre requêtes et threads."""
+
+    def __init__(self, leak_markers: Iterable[str] = DEFAULT_LEAK_MARKERS,
+                 answer_markers: Iterable[str] = DEFAULT_ANSWER_MARKERS):
+        self._leak: Pattern = re.compile("|".join(re.escape(m) for m in leak_markers))
+        # Préfixe gourmand : la correspondance s'arrête après le DERNIER marqueur de réponse
+        self._up_to_answer: Pattern = re.compile(r".*(?:" + "|".join(answer_markers) + ")", re.DOTALL)
+
+    def clean(self, text: str) -> str:
+        t = strip_markup(text)
+        # Le modèle a recopié le prompt : ne garder que ce qui suit le dernier « Réponse : »
+        if self._leak.search(t):
+            m = self._up_to_answer.match(t)
+            if m:
+                t = t[m.end():].strip()
+        return dedupe_sentences(t)
+
+    def incremental(self) -> "IncrementalCleaner":
+        return IncrementalCleaner()
+
+
+class IncrementalCleaner:
+    """Nettoyage incrémental d'un flux de tokens.
+
+    N'émet que la partie stable du texte nettoyé : un crochet ouvert non refermé,
+    une suite de `*` ou de retours à la ligne en fin de tampon sont retenus jusqu'à
+    ce que le token suivant les tranche. Chaque caractère n'est nettoyé qu'une
+    fois ; la réponse finale passe toujours par `ResponsePostProcessor.clean`.
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._pending = ""
+
+    @property
+    def raw(self) -> str:
+        return "".join(self._chunks)
+
+    @staticmethod
+    def _stable_end(text: str) -> int:
+        """Longueur du préfixe dont le nettoyage ne dépend plus des tokens à venir."""
+        # Premier crochet ouvert depuis la dernière fermeture / fin de ligne : pas encore refermé
+        end = text.find("[", max(text.rfind("]"), text.rfind("\n")) + 1)
+        if end == -1:
+            end = len(text)
+        # Artefacts et blancs en fin de tampon : `*` (absorbe le blanc suivant), `\n` (la suite
+        # peut s'allonger), `[...]` (sa suppression peut rapprocher un `*` ou un `\n` à venir)
+        while end:
+            last = text[end - 1]
+            if last == "*" or last.isspace():
+                end -= 1
+            elif last == "]" and "[" in text[:end]:
+                # Crochet fermé : il commence au premier `[` depuis le `]` / `\n` précédent
+                start = text.find("[", max(text.rfind("]", 0, end - 1), text.rfind("\n", 0, end - 1)) + 1, end)
+                if start == -1:
+                    break
+                end = start
+            else:
+                break
+        return end
+
+    def feed(self, chunk: str) -> str:
+        """-> texte nettoyé nouvellement stable (concaténation des retours == strip_markup(flux))."""
+        self._chunks.append(chunk)
+        text = self._pending + chunk
+        end = self._stable_end(text)
+        self._pending = text[end:]
+        return strip_markup(text[:end])
+
+    def flush(self) -> str:
+        text, self._pending = self._pending, ""
+        return strip_markup(text)
@@ -0,0 +1,220 @@
+"""Détection des scénarios critiques d'un client à partir de leurs déclencheurs (`scenarios_critiques`).
+
+Tous les déclencheurs d'un client sont compilés une seule fois en une expression
+régulière unique, organisée en arbre de préfixes et insensible aux accents
+(chaque lettre accepte ses variantes accentuées) : une question est analysée en
+un seul passage, sans normalisation préalable, quel que soit le nombre de
+scénarios ou de déclencheurs. `ScenarioClassifier` classe les scénarios
+détectés (score = nombre de déclencheurs distincts) et fournit l'étiquette
+« SITUATION » des prompts ; il remplace les listes de mots-clés codées en dur
+des différents points d'entrée.
+
+Le « fast-path » s'appuie sur ce matcher pour répondre directement, sans
+recherche ni génération, avec la réponse préparée du scénario (`reponse` +
+`cta_prioritaire`) quand la détection est sans ambiguïté. Il se configure par
+client dans `data.json` ; `triggers` restreint les déclencheurs qui suffisent à
+répondre sans LLM (« demain » signale une urgence possible, pas certaine) :
+
+    "fast_path": {"enabled": true, "scenarios": ["urgence_absolute"],
+                  "triggers": ["urgent", "last minute", "crise"], "min_triggers": 1}
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+GENERAL_LABEL = "Question générale"
+
+# Scénarios utilisés quand le client ne définit pas de `scenarios_critiques`
+DEFAULT_SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "urgence": {"label": "Urgence", "declencheur": ["urgent", "demain", "crise", "last minute", "imprévu"]},
+    "devis": {"label": "Devis", "declencheur": ["prix", "devis", "budget", "tarif"]},
+    "references": {"label": "Références", "declencheur": ["référence", "expérience", "portfolio"]},
+}
+
+
+def normalize_text(text: str) -> str:
+    """Minuscules, sans accents (« Réglementation » -> « reglementation »)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _accent_classes() -> Dict[str, str]:
+    """Lettre de base -> classe regex de ses variantes accentuées (minuscules)."""
+    variants: Dict[str, List[str]] = {}
+    for code in range(0xC0, 0x100):  # Latin-1 : couvre les accents du français
+        char = chr(code)
+        base = normalize_text(char)
+        if char == char.lower() and len(base) == 1 and base.isascii() and base != char:
+            variants.setdefault(base, []).append(char)
+    classes = {base: "[" + base + "".join(chars) + "]" for base, chars in variants.items()}
+    classes["'"] = "['’]"
+    classes[" "] = r"[\s\-]+"
+    return classes
+
+
+_ACCENT_CLASSES = _accent_classes()
+
+
+@lru_cache(maxsize=4096)
+def _trigger_key(surface: str) -> str:
+    """Forme trouvée dans la question (« Last-Minute ») -> déclencheur normalisé (« last minute »)."""
+    return " ".join(normalize_text(surface).replace("’", "'").replace("-", " ").split())
+
+
+def _trie_pattern(keys: Iterable[str]) -> str:
+    """Alternative regex factorisée par préfixes communs : ["devis", "demain"] -> d(?:e(?:vis|main))."""
+    root: Dict[str, Any] = {}
+    for key in keys:
+        node = root
+        for char in key:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [
+            _ACCENT_CLASSES.get(char, re.escape(char)) + build(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if "" in node else "")
+
+    return build(root)
+
+
+class TriggerMatcher:
+    """Matcher précompilé : {scénario: [déclencheurs]} -> une seule regex (arbre de préfixes)."""
+
+    def __init__(self, triggers: Dict[str, Iterable[str]]):
+        self.scenarios: Dict[str, List[str]] = {}
+        self._owners: Dict[str, List[str]] = {}
+        for name, trigger_list in triggers.items():
+            normalized = []
+            for trigger in trigger_list:
+                # Même normalisation que les formes trouvées dans les questions (match)
+                key = _trigger_key(trigger)
+                if key and key not in normalized:
+                    normalized.append(key)
+                    self._owners.setdefault(key, []).append(name)
+            self.scenarios[name] = normalized
+        self._pattern: Optional[re.Pattern] = None
+        if self._owners:
+            # Pluriel simple toléré (« autorisations », « budgets »)
+            self._pattern = re.compile(r"\b(" + _trie_pattern(self._owners) + r")(?:s|x)?\b")
+
+    @classmethod
+    def from_client_data(cls, client_data: Dict[str, Any]) -> "TriggerMatcher":
+        critiques = client_data.get("scenarios_critiques") or {}
+        return cls({name: info.get("declencheur", []) for name, info in critiques.items()})
+
+    def match(self, text: str) -> Dict[str, List[str]]:
+        """-> {scénario: déclencheurs distincts trouvés}, dans l'ordre d'apparition."""
+        found: Dict[str, List[str]] = {}
+        if self._pattern is None:
+            return found
+        text = text.lower()
+        if not unicodedata.is_normalized("NFC", text):
+            text = unicodedata.normalize("NFC", text)
+        for m in self._pattern.finditer(text):
+            key = _trigger_key(m.group(1))
+            for name in self._owners[key]:
+                hits = found.setdefault(name, [])
+                if key not in hits:
+                    hits.append(key)
+        return found
+
+
+class ScenarioMatch(NamedTuple):
+    name: str
+    label: str
+    score: float
+    triggers: List[str]
+
+
+class ScenarioClassifier:
+    """Classement des scénarios d'un client pour une question (compilé une fois par client)."""
+
+    def __init__(self, scenarios: Dict[str, Dict[str, Any]]):
+        self.matcher = TriggerMatcher({name: info.get("declencheur", []) for name, info in scenarios.items()})
+        self.labels = {
+            name: info.get("label") or name.replace("_", " ").capitalize() for name, info in scenarios.items()
+        }
+        self._order = {name: i for i, name in enumerate(scenarios)}
+
+    @classmethod
+    def from_client_data(cls, client_data: Dict[str, Any]) -> "ScenarioClassifier":
+        return cls(client_data.get("scenarios_critiques") or DEFAULT_SCENARIOS)
+
+    def rank(self, question: str) -> List[ScenarioMatch]:
+        """Scénarios détectés, du plus au moins probable (à score égal : ordre de data.json)."""
+        found = self.matcher.match(question)
+        ranked = sorted(found.items(), key=lambda item: (-len(item[1]), self._order[item[0]]))
+        return [ScenarioMatch(name, self.labels[name], float(len(hits)), hits) for name, hits in ranked]
+
+    def label(self, question: str) -> str:
+        ranked = self.rank(question)
+        return ranked[0].label if ranked else GENERAL_LABEL
+
+
+class _KeepMissing(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+class ScenarioFastPath:
+    """Réponse immédiate (sans LLM) pour les scénarios critiques détectés avec certitude."""
+
+    def __init__(self, client_data: Dict[str, Any], scenarios: Optional[Iterable[str]] = None,
+                 min_triggers: int = 1, classifier: Optional[ScenarioClassifier] = None,
+                 triggers: Optional[Iterable[str]] = None):
+        self.client_data = client_data
+        self.classifier = classifier or ScenarioClassifier(client_data.get("scenarios_critiques") or {})
+        critiques = client_data.get("scenarios_critiques") or {}
+        allowed = critiques.keys() if scenarios is None else scenarios
+        self.scenarios = [name for name in allowed if critiques.get(name, {}).get("reponse")]
+        self.min_triggers = max(1, min_triggers)
+        # Déclencheurs sans ambiguïté (tous si None) : seuls ceux-ci comptent pour min_triggers
+        self.triggers = None if triggers is None else {_trigger_key(t) for t in triggers}
+
+    @classmethod
+    def from_client_data(cls, client_data: Dict[str, Any],
+                         classifier: Optional[ScenarioClassifier] = None) -> Optional["ScenarioFastPath"]:
+        """None si le client n'a pas activé le fast-path (clé `fast_path` de data.json)."""
+        config = client_data.get("fast_path") or {}
+        if not config.get("enabled"):
+            return None
+        return cls(client_data, scenarios=config.get("scenarios"),
+                   min_triggers=int(config.get("min_triggers", 1)), classifier=classifier,
+                   triggers=config.get("triggers"))
+
+    def detect(self, question: str) -> Optional[Tuple[str, List[str]]]:
+        """-> (scénario, déclencheurs) si un scénario autorisé domine strictement les autres."""
+        return self.select(self.classifier.rank(question))
+
+    def select(self, ranked: List[ScenarioMatch]) -> Optional[Tuple[str, List[str]]]:
+        if not ranked:
+            return None
+        top = ranked[0]
+        if len(ranked) > 1 and ranked[1].score == top.score:
+            return None  # ambigu : la génération tranchera
+        hits = top.triggers if self.triggers is None else [t for t in top.triggers if t in self.triggers]
+        if top.name not in self.scenarios or len(hits) < self.min_triggers:
+            return None
+        return top.name, hits
+
+    def render(self, name: str) -> str:
+        info = self.client_data["scenarios_critiques"][name]
+        refs = self.client_data.get("references_prestigieuses") or []
+        values = _KeepMissing(
+            reference_pertinente=", ".join(f"{r.get('projet', '')} ({r.get('client', '')})" for r in refs[:2]),
+            entreprise=self.client_data.get("entreprise", {}).get("nom", ""),
+        )
+        parts = [info.get("reponse", "").format_map(values), info.get("cta_prioritaire", "")]
+        return "\n".join(p for p in parts if p)
+
+    def answer(self, question: str) -> Optional[str]:
+        detected = self.detect(question)
+        return self.render(detected[0]) if detected else None
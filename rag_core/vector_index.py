@@ -0,0 +1,315 @@
+"""Index vectoriel local en mémoire projetée (NumPy), alternative légère à Chroma.
+
+Les embeddings normalisés sont stockés en float32 dans `vectors.<version>.npy`,
+ouvert en `mmap_mode="r"` : le fichier est partagé via le cache de pages (plusieurs
+processus ne le chargent qu'une fois) et seules les pages lues comptent dans la RSS.
+Textes et métadonnées sont dans `records.json`, qui sert aussi de manifeste : il nomme
+les fichiers de vecteurs et d'IVF de sa version et n'est remplacé (renommage atomique)
+qu'une fois ceux-ci écrits. Un autre processus voit donc toujours une paire cohérente. La recherche est exacte (produit matrice ×
+vecteur vectorisé, similarité cosinus) ; au-delà de `ann_min_docs` vecteurs, un
+index IVF (k-means sphérique, `nprobe` listes visitées) limite le calcul aux
+vecteurs des listes les plus proches.
+
+L'interface reprend ce que le dépôt utilise de `langchain_community.vectorstores.Chroma`
+(get / add_documents / delete / delete_collection, recherches par texte ou par
+vecteur avec `filter` sur les métadonnées) : `sync_vector_store` des indexeurs et
+les pipelines fonctionnent avec l'un ou l'autre.
+"""
+import glob
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+RECORDS_FILE = "records.json"
+VECTORS_FILE = "vectors.npy"  # nom sans version (collections écrites avant les fichiers versionnés)
+IVF_FILE = "ivf.npz"
+
+_KMEANS_ITERATIONS = 10
+_KMEANS_SAMPLE = 50_000
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _matches(metadata: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    """Filtre façon Chroma : {"type": "x"}, {"type": {"$in": [...]}} / {"$ne": x}, {"$and": [...]}."""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, sub) for sub in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$ne" in condition and value == condition["$ne"]:
+                return False
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class _Ivf(NamedTuple):
+    centroids: np.ndarray  # (nlist, dim), normalisés
+    order: np.ndarray  # indices des vecteurs triés par liste
+    offsets: np.ndarray  # liste i = order[offsets[i]:offsets[i + 1]]
+
+
+class _State(NamedTuple):
+    matrix: np.ndarray  # (n, dim) float32 normalisée (memmap)
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Dict[str, Any]]
+    ivf: Optional[_Ivf]
+    masks: Dict[str, np.ndarray]  # filtres -> indices autorisés, propres à cet instantané
+
+
+def build_ivf(matrix: np.ndarray, nlist: Optional[int] = None, seed: int = 0) -> _Ivf:
+    """Quantificateur grossier : k-means sphérique sur un échantillon, puis affectation de tous les vecteurs."""
+    n = matrix.shape[0]
+    nlist = nlist or max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    sample = matrix[np.sort(rng.choice(n, size=min(n, _KMEANS_SAMPLE), replace=False))]
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(_KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    assign = np.concatenate([
+        np.argmax(matrix[i:i + 65536] @ centroids.T, axis=1) for i in range(0, n, 65536)
+    ])
+    order = np.argsort(assign, kind="stable")
+    offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+    return _Ivf(centroids.astype(np.float32), order, offsets)
+
+
+class MemmapVectorStore:
+    """Vecteurs float32 normalisés en mémoire projetée + recherche cosinus exacte (ou IVF)."""
+
+    def __init__(self, directory: str, embedding_function: Any = None, ann_min_docs: int = 10_000,
+                 nprobe: int = 8):
+        self.directory = directory
+        self.embeddings = embedding_function
+        self.ann_min_docs = ann_min_docs
+        self.nprobe = nprobe
+        self._lock = threading.Lock()  # écritures (les lectures utilisent un instantané de _state)
+        os.makedirs(directory, exist_ok=True)
+        self._state = self._load()
+
+    # --- Persistance ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self, attempts: int = 5) -> _State:
+        """Lit le manifeste puis les fichiers qu'il nomme ; relit si une écriture concurrente les a remplacés."""
+        for attempt in range(attempts):
+            try:
+                return self._read_state()
+            except (FileNotFoundError, ValueError):
+                # Fichiers d'une version déjà supprimée par un autre processus : le manifeste a changé
+                if attempt == attempts - 1:
+                    raise
+
+    def _read_state(self) -> _State:
+        if not os.path.exists(self._path(RECORDS_FILE)):
+            return _State(np.zeros((0, 0), dtype=np.float32), [], [], [], None, {})
+        with open(self._path(RECORDS_FILE), "r", encoding="utf-8") as f:
+            records = json.load(f)
+        count = len(records["ids"])
+        matrix = np.zeros((0, 0), np.float32)
+        if count:
+            matrix = np.load(self._path(records.get("vectors", VECTORS_FILE)), mmap_mode="r")
+            if matrix.shape[0] != count:
+                raise ValueError(f"{self.directory}: {matrix.shape[0]} vecteurs pour {count} documents")
+        ivf = None
+        ivf_file = records.get("ivf", IVF_FILE)
+        if ivf_file and count >= self.ann_min_docs and os.path.exists(self._path(ivf_file)):
+            data = np.load(self._path(ivf_file))
+            if int(data["count"]) == count:
+                ivf = _Ivf(data["centroids"], data["order"], data["offsets"])
+        return _State(matrix, records["ids"], records["documents"], records["metadatas"], ivf, {})
+
+    def _save(self, matrix: np.ndarray, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Réécriture complète dans des fichiers d'une nouvelle version, publiée par le renommage du manifeste."""
+        version = uuid.uuid4().hex[:12]
+        vectors_file = f"vectors.{version}.npy"
+        np.save(self._path(vectors_file), np.ascontiguousarray(matrix, dtype=np.float32))
+        ivf_file = None
+        if len(ids) >= self.ann_min_docs:
+            ivf = build_ivf(matrix)
+            ivf_file = f"ivf.{version}.npz"
+            np.savez(self._path(ivf_file), centroids=ivf.centroids, order=ivf.order, offsets=ivf.offsets,
+                     count=len(ids))
+        tmp = self._path("records.tmp.json")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"vectors": vectors_file, "ivf": ivf_file, "ids": ids, "documents": documents,
+                       "metadatas": metadatas}, f, ensure_ascii=False)
+        os.replace(tmp, self._path(RECORDS_FILE))
+        self._remove_versions(keep={vectors_file, ivf_file})
+        self._state = self._load()
+
+    def _remove_versions(self, keep: Iterable[Optional[str]] = ()) -> None:
+        """Supprime les fichiers des versions précédentes (un memmap déjà ouvert reste lisible sous POSIX)."""
+        for pattern in ("vectors*.npy", "ivf*.npz"):
+            for path in glob.glob(self._path(pattern)):
+                if os.path.basename(path) not in keep:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass  # encore projeté par un lecteur (Windows) : supprimé à la prochaine écriture
+
+    # --- Écriture (interface utilisée par sync_vector_store) ---
+
+    def add_embeddings(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]], documents: Sequence[str],
+                       metadatas: Optional[Sequence[Optional[Dict[str, Any]]]] = None) -> None:
+        """Ajoute (ou remplace, à identifiant égal) des vecteurs déjà calculés."""
+        if not ids:
+            return
+        metadatas = metadatas or [None] * len(ids)
+        new = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            state = self._state
+            replaced = set(ids)
+            keep = [i for i, doc_id in enumerate(state.ids) if doc_id not in replaced]
+            matrix = np.concatenate([np.asarray(state.matrix[keep]), new]) if keep else new
+            self._save(
+                matrix,
+                [state.ids[i] for i in keep] + list(ids),
+                [state.documents[i] for i in keep] + list(documents),
+                [state.metadatas[i] for i in keep] + [dict(m or {}) for m in metadatas],
+            )
+
+    def add_documents(self, documents: List[Document], ids: Optional[List[str]] = None) -> List[str]:
+        ids = ids or [str(i) for i in range(len(self._state.ids), len(self._state.ids) + len(documents))]
+        texts = [doc.page_content for doc in documents]
+        self.add_embeddings(ids, self.embeddings.embed_documents(texts), texts, [doc.metadata for doc in documents])
+        return ids
+
+    def delete(self, ids: Optional[Iterable[str]] = None) -> None:
+        removed = set(ids or [])
+        with self._lock:
+            state = self._state
+            keep = [i for i, doc_id in enumerate(state.ids) if doc_id not in removed]
+            if len(keep) == len(state.ids):
+                return
+            matrix = np.asarray(state.matrix[keep]) if keep else np.zeros((0, state.matrix.shape[1]), np.float32)
+            self._save(matrix, [state.ids[i] for i in keep], [state.documents[i] for i in keep],
+                       [state.metadatas[i] for i in keep])
+
+    def delete_collection(self) -> None:
+        with self._lock:
+            if os.path.exists(self._path(RECORDS_FILE)):
+                os.remove(self._path(RECORDS_FILE))
+            self._remove_versions()
+            self._state = self._load()
+
+    def get(self, ids: Optional[Iterable[str]] = None, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        state = self._state
+        include = ["documents", "metadatas"] if include is None else include
+        positions = range(len(state.ids))
+        if ids is not None:
+            wanted = set(ids)
+            positions = [i for i, doc_id in enumerate(state.ids) if doc_id in wanted]
+        result: Dict[str, Any] = {"ids": [state.ids[i] for i in positions]}
+        if "documents" in include:
+            result["documents"] = [state.documents[i] for i in positions]
+        if "metadatas" in include:
+            result["metadatas"] = [state.metadatas[i] for i in positions]
+        return result
+
+    def count(self) -> int:
+        return len(self._state.ids)
+
+    @property
+    def dimension(self) -> int:
+        return self._state.matrix.shape[1] if len(self._state.ids) else 0
+
+    # --- Recherche ---
+
+    def _candidates(self, state: _State, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Indices autorisés par le filtre (mis en cache dans l'instantané), None = tous."""
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+        mask = state.masks.get(key)
+        if mask is None:
+            mask = np.fromiter((_matches(m, where) for m in state.metadatas), dtype=bool, count=len(state.ids))
+            state.masks[key] = mask
+        return mask
+
+    def _top_k(self, state: _State, query: np.ndarray, k: int, mask: Optional[np.ndarray]) -> List[Tuple[int, float]]:
+        if mask is not None and (state.ivf is None or np.count_nonzero(mask) < self.ann_min_docs):
+            # Filtre sélectif : recherche exacte sur le sous-ensemble (l'IVF pourrait ne rien en visiter)
+            index = np.flatnonzero(mask)
+            scores = np.asarray(state.matrix[index] @ query)
+        elif state.ivf is not None:
+            ivf = state.ivf
+            probes = np.argsort(-(ivf.centroids @ query))[:self.nprobe]
+            # Indices triés : lecture séquentielle des lignes de la matrice projetée
+            index = np.sort(np.concatenate([ivf.order[ivf.offsets[c]:ivf.offsets[c + 1]] for c in probes]))
+            if mask is not None:
+                index = index[mask[index]]
+            scores = np.asarray(state.matrix[index] @ query)
+        else:
+            index = None
+            scores = np.asarray(state.matrix @ query)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        positions = best if index is None else index[best]
+        return [(int(p), float(scores[b])) for p, b in zip(positions, best)]
+
+    def search_by_vectors(self, embeddings: Sequence[Sequence[float]], k: int = 4,
+                          filter: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """Plusieurs requêtes en une passe : -> pour chacune [(document, similarité cosinus)], décroissant."""
+        state = self._state
+        if not state.ids:
+            return [[] for _ in embeddings]
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        mask = self._candidates(state, filter)
+        if state.ivf is None and mask is None and len(queries) > 1:
+            # Recherche exacte groupée : un seul produit matriciel pour toutes les requêtes
+            all_scores = np.asarray(state.matrix @ queries.T)
+            k = min(k, len(state.ids))
+            results = []
+            for column in all_scores.T:
+                best = np.argpartition(-column, k - 1)[:k]
+                best = best[np.argsort(-column[best], kind="stable")]
+                results.append([(self._document(state, int(i)), float(column[i])) for i in best])
+            return results
+        return [
+            [(self._document(state, i), score) for i, score in self._top_k(state, q, k, mask)]
+            for q in queries
+        ]
+
+    @staticmethod
+    def _document(state: _State, position: int) -> Document:
+        return Document(page_content=state.documents[position], metadata=dict(state.metadatas[position]))
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: Sequence[float], k: int = 4,
+                                                          filter: Optional[Dict[str, Any]] = None):
+        """Comme Chroma (espace cosinus) : renvoie des DISTANCES (1 - similarité), malgré le nom."""
+        return [(doc, 1.0 - score) for doc, score in self.search_by_vectors([embedding], k, filter)[0]]
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4,
+                                                filter: Optional[Dict[str, Any]] = None):
+        return self.search_by_vectors([self.embeddings.embed_query(query)], k, filter)[0]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_relevance_scores(query, k, filter)]
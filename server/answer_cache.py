@@ -0,0 +1,114 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    """Minuscules, sans accents ni ponctuation, espaces compactés : « Un devis ? » == « un devis »."""
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+class AnswerCache:
+    """Cache des réponses d'un client : clé = question normalisée, TTL et éviction LRU.
+
+    Niveau sémantique optionnel : si `similarity_threshold` > 0, une question
+    inédite dont l'embedding a une similarité cosinus supérieure au seuil avec
+    une question en cache réutilise sa réponse.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600.0, similarity_threshold: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.lookups = 0
+        self.hits = 0
+        self.semantic_hits = 0
+        # clé -> (réponse, vecteur normalisé ou None, expiration)
+        self._entries: "OrderedDict[str, Tuple[str, Optional[np.ndarray], float]]" = OrderedDict()
+        self._matrix: Optional[Tuple[List[str], np.ndarray]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def semantic(self) -> bool:
+        return self.similarity_threshold > 0
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [k for k, (_, _, exp) in self._entries.items() if exp <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def get(self, question: str) -> Optional[str]:
+        key = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= now:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_similar(self, vector: List[float]) -> Optional[str]:
+        if not self.semantic:
+            return None
+        query = np.asarray(vector, dtype=np.float32)
+        query /= (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            if self._matrix is None:
+                keys = [k for k, (_, vec, _) in self._entries.items() if vec is not None]
+                if not keys:
+                    return None
+                self._matrix = (keys, np.stack([self._entries[k][1] for k in keys]))
+            keys, matrix = self._matrix
+            if matrix.shape[1] != query.shape[0]:
+                return None
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            key = keys[best]
+            self._entries.move_to_end(key)
+            self.semantic_hits += 1
+            return self._entries[key][0]
+
+    def put(self, question: str, answer: str, vector: Optional[List[float]] = None) -> None:
+        if self.max_entries <= 0:
+            return
+        vec = None
+        if vector is not None and self.semantic:
+            vec = np.asarray(vector, dtype=np.float32)
+            vec = vec / (np.linalg.norm(vec) or 1.0)
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = (answer, vec, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total_hits = self.hits + self.semantic_hits
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "hit_ratio": round(total_hits / self.lookups, 4) if self.lookups else 0.0,
+            }
@@ -1,33 +1,64 @@
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import json
-import re
+import hashlib
+import importlib
+import inspect
 import logging
+import asyncio
+import contextvars
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from functools import lru_cache
-from typing import Dict, List, Any, Tuple
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Any, Optional, Tuple
 
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
 from langchain_community.vectorstores import Chroma
-from langchain_community.llms import Ollama as OllamaLLM
-from langchain_community.embeddings import OllamaEmbeddings, HuggingFaceEmbeddings
 from langchain.prompts import PromptTemplate
-from langchain.schema import BaseOutputParser
+from langchain.schema import BaseOutputParser, Document
 
-# Optional OpenAI provider
-try:
-    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-    HAS_OPENAI = True
-except Exception:
-    HAS_OPENAI = False
-
-# Optional local HF text generation
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+# Les backends des providers (transformers/torch, langchain_openai, Ollama) et les
+# modules d'indexation sont importés à la première utilisation : démarrage rapide.
 
 # Local modules
-import indexer as main_indexer
-import rag_alt.indexer as alt_indexer
+from rag_core import chunking
+from rag_core.chunking import LengthFn, approximate_token_length, token_length_function
+from rag_core.context import BuiltContext, ContextBuilder
+from rag_core.embedding_cache import (
+    CachedEmbeddings, EmbeddingCache, batches_queries, embed_queries, embedding_model_name,
+)
+from rag_core.lexical import BM25Index, reciprocal_rank_fusion
+from rag_core.postprocess import IncrementalCleaner, ResponsePostProcessor
+from rag_core.scenarios import ScenarioClassifier, ScenarioFastPath
+from rag_core.vector_index import MemmapVectorStore
+from server.answer_cache import AnswerCache
+from server.batching import MicroBatcher
+from server.concurrency import ConcurrencyLimiter, ServerOverloaded
+from server.metrics import (
+    PIPELINE_BUILD_SECONDS,
+    PROMPT_SIZE,
+    REGISTRY,
+    UNKNOWN_CLIENT,
+    RequestTrace,
+    enable_json_logs,
+    record_prefill,
+    record_stage,
+    record_tokens,
+    set_outcome,
+    span,
+)
+from server.prefix_cache import PrefixRegistry
+from server.registry import PipelineRegistry
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -40,192 +71,1054 @@ OLLAMA_LLM_MODEL = os.getenv("OLLAMA_LLM_MODEL", "tinyllama")
 OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
 HF_LLM_MODEL = os.getenv("HF_LLM_MODEL", "google/flan-t5-small")
 HF_EMBED_MODEL = os.getenv("HF_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Exécution des modèles HF : torch | onnx (ONNX Runtime, int8 dynamique, export mis en cache, sans torch)
+HF_BACKEND = os.getenv("HF_BACKEND", "torch").lower()
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "/tmp/onnx_models")
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "1") == "1"
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = défaut d'onnxruntime (un thread par cœur)
+# Durée pendant laquelle Ollama garde le modèle (et le KV cache du préfixe des prompts) chargé ; -1 = toujours
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Modèle HF décodeur seul : past-key-values du préfixe statique de chaque client calculés une fois
+PREFIX_CACHE = os.getenv("PREFIX_CACHE", "1") == "1"
 
 CHROMA_DIR_MAIN = os.getenv("CHROMA_DIR_MAIN", "/tmp/chroma_main")
 CHROMA_DIR_ALT = os.getenv("CHROMA_DIR_ALT", "/tmp/chroma_alt")
+# Backend vectoriel : chroma | memmap (matrice NumPy en mémoire projetée, recherche cosinus exacte,
+# IVF approximatif à partir de VECTOR_ANN_MIN_DOCS vecteurs, VECTOR_ANN_NPROBE listes visitées)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+VECTOR_ANN_MIN_DOCS = int(os.getenv("VECTOR_ANN_MIN_DOCS", "10000"))
+VECTOR_ANN_NPROBE = int(os.getenv("VECTOR_ANN_NPROBE", "8"))
+
+# Cache disque des embeddings (vide = désactivé)
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "/tmp/embeddings_cache.sqlite")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+
+# Concurrence: générations simultanées, file d'attente (429 au-delà), threads dédiés au modèle HF local
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "4"))
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", "16"))
+HF_MAX_WORKERS = int(os.getenv("HF_MAX_WORKERS", "1"))
+# Micro-batching du modèle HF local (HF_BATCH_MAX_SIZE=1 pour désactiver)
+HF_BATCH_MAX_SIZE = int(os.getenv("HF_BATCH_MAX_SIZE", "4"))
+HF_BATCH_MAX_WAIT_MS = float(os.getenv("HF_BATCH_MAX_WAIT_MS", "10"))
+# Coalescence des requêtes concurrentes : embeddings des questions groupés par modèle, recherches
+# vectorielles groupées en une passe (QUERY_BATCH_MAX_SIZE=1 pour désactiver). Attente 0 : un lot
+# regroupe les questions arrivées pendant le traitement du précédent, sans latence ajoutée à vide
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "16"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "0"))
+
+# Découpage des documents indexés : CHUNK_MAX_TOKENS tokens du modèle d'embeddings (HF : tokenizer de
+# HF_EMBED_MODEL, 256 tokens au plus pour MiniLM ; autres providers : ≈ 4 caractères/token)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "128"))
+# Recouvrement : tokens repris de la fin du chunk précédent (0 = aucun ; inférieur à CHUNK_MAX_TOKENS)
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "0"))
+
+# Recherche vectorielle
+SEARCH_K = int(os.getenv("SEARCH_K", "3"))
+SCORE_THRESHOLD = float(os.getenv("SCORE_THRESHOLD", "0.3"))
+# Recherche hybride : BM25 + vecteurs fusionnés par RRF (candidats par source: SEARCH_FETCH_K)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+SEARCH_FETCH_K = int(os.getenv("SEARCH_FETCH_K", "6"))
+# Budget du prompt (tokens du tokenizer du LLM) : le contexte est dédupliqué puis réduit aux phrases
+# les plus pertinentes pour tenir dedans. HF: fenêtre de 512 tokens de flan-t5 (marge pour les tokens
+# spéciaux) ; OLLAMA: prefill CPU de tinyllama
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", {"OPENAI": "2048", "OLLAMA": "1024"}.get(LLM_PROVIDER, "500")))
+CONTEXT_MAX_DOCS = int(os.getenv("CONTEXT_MAX_DOCS", "3"))
+# Lots de questions (/api/chat/batch, python -m server.batch)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_MAX_PARALLEL = int(os.getenv("BATCH_MAX_PARALLEL", str(MAX_CONCURRENT_GENERATIONS)))
+BATCH_RETRY_DELAY = float(os.getenv("BATCH_RETRY_DELAY", "0.5"))
+# Réponses préparées des scénarios critiques sans LLM (activation par client : clé `fast_path` de data.json)
+FAST_PATH = os.getenv("FAST_PATH", "1") == "1"
+
+# Cache des réponses par client (0 = désactivé) ; similarité > 0 active le niveau sémantique
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Pipelines résidentes en mémoire (LRU) ; budget mémoire estimé, 0 = illimité
+MAX_PIPELINES = int(os.getenv("MAX_PIPELINES", "32"))
+PIPELINES_MEMORY_BUDGET_MB = float(os.getenv("PIPELINES_MEMORY_BUDGET_MB", "0"))
+
+# Observabilité : GET /metrics (format Prometheus) ; une ligne JSON par requête (logger "server.requests")
+JSON_REQUEST_LOGS = os.getenv("JSON_REQUEST_LOGS", "0") == "1"
+if JSON_REQUEST_LOGS:
+    enable_json_logs()
+
+# Préchauffage au démarrage : modèles + clients listés ("mode:client_id", séparés par des virgules)
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+WARMUP_TENANTS = os.getenv("WARMUP_TENANTS", "main:bms_ventouse")
 
 # Ensure dirs exist
 os.makedirs(CHROMA_DIR_MAIN, exist_ok=True)
 os.makedirs(CHROMA_DIR_ALT, exist_ok=True)
 
+EMBED_CACHE = EmbeddingCache(EMBED_CACHE_PATH, max_entries=EMBED_CACHE_MAX_ENTRIES) if EMBED_CACHE_PATH else None
+
+GENERATION_LIMITER = ConcurrencyLimiter(MAX_CONCURRENT_GENERATIONS, MAX_QUEUE_DEPTH)
+# Le pipeline transformers est bloquant : exécuté sur un pool borné, hors du threadpool Starlette
+HF_EXECUTOR = ThreadPoolExecutor(max_workers=HF_MAX_WORKERS, thread_name_prefix="hf-generate")
+
+
+def _search_batch(items: List[Tuple["Pipeline", List[float]]]) -> List[Any]:
+    """Lot de recherches (pipeline, vecteur) : une requête groupée par pipeline, résultats dans l'ordre du lot.
+
+    L'échec de la recherche d'une pipeline (collection recréée, dimension incompatible...) n'est
+    renvoyé qu'à ses propres requêtes, pas à celles des autres clients du lot.
+    """
+    groups: Dict[int, Tuple["Pipeline", List[int]]] = {}
+    for i, (pipeline, _) in enumerate(items):
+        groups.setdefault(id(pipeline), (pipeline, []))[1].append(i)
+    results: List[Any] = [None] * len(items)
+    for pipeline, indexes in groups.values():
+        try:
+            hits_lists = pipeline.search_vectors([items[i][1] for i in indexes])
+        except Exception as e:
+            logger.error(f"Erreur recherche groupée ({pipeline.mode}:{pipeline.client_id}, {len(indexes)} requêtes): {e}")
+            hits_lists = [e] * len(indexes)
+        for i, hits in zip(indexes, hits_lists):
+            results[i] = hits
+    return results
+
+
+# Un seul thread pour toutes les pipelines : une pipeline évincée n'est retenue par aucun batcher
+SEARCH_BATCHER = MicroBatcher(
+    _search_batch, max_batch_size=QUERY_BATCH_MAX_SIZE, max_wait_ms=QUERY_BATCH_MAX_WAIT_MS, name="search-batcher",
+) if QUERY_BATCH_MAX_SIZE > 1 else None
+# Batchers d'embeddings des questions, un par modèle (partagé par tous les clients)
+QUERY_EMBEDDERS: Dict[str, MicroBatcher] = {}
+_QUERY_EMBEDDERS_LOCK = threading.Lock()
+
+
+def query_embedder(embeddings: Any) -> Optional[MicroBatcher]:
+    """Batcher des embeddings de questions du modèle ; None si coalescence désactivée ou modèle non groupable."""
+    if QUERY_BATCH_MAX_SIZE <= 1 or not batches_queries(embeddings):
+        return None
+    name = embedding_model_name(embeddings)
+    batcher = QUERY_EMBEDDERS.get(name)
+    if batcher is None:
+        with _QUERY_EMBEDDERS_LOCK:
+            batcher = QUERY_EMBEDDERS.get(name)
+            if batcher is None:
+                batcher = QUERY_EMBEDDERS[name] = MicroBatcher(
+                    lambda texts: embed_queries(embeddings, texts),
+                    max_batch_size=QUERY_BATCH_MAX_SIZE,
+                    max_wait_ms=QUERY_BATCH_MAX_WAIT_MS,
+                    name="embed-batcher",
+                )
+    return batcher
+
+
+# Motifs de nettoyage compilés une fois, partagés par toutes les pipelines
+POSTPROCESSOR = ResponsePostProcessor()
+
 
 class AdvancedOutputParser(BaseOutputParser):
+    # BaseOutputParser est un modèle pydantic : les attributs doivent être déclarés
+    brand_name: str
+
     def __init__(self, brand_name: str):
-        self.brand_name = brand_name
+        super().__init__(brand_name=brand_name)
 
     def parse(self, text: str) -> str:
-        t = re.sub(r"\[.*?\]", "", text)
-        t = re.sub(r"\*+\s?", "", t)
-        t = re.sub(r"\n+", "\n", t)
-
-        for marker in ["MISSION", "VOCABULAIRE", "# "]:
-            if marker in t:
-                parts = re.split(r"Réponse\s*:|\*\*Réponse\s*:?\*\*", t)
-                if len(parts) > 1:
-                    t = parts[-1].strip()
-
-        sentences = [s.strip() for s in t.split(". ") if s.strip()]
-        uniq = []
-        for s in sentences:
-            if s not in uniq:
-                uniq.append(s)
-        res = ". ".join(uniq).strip()
-
+        res = POSTPROCESSOR.clean(text)
         if len(res) < 25:
             return f"Merci pour votre message. L'équipe {self.brand_name} vous répond rapidement. Contact recommandé pour devis/précisions."
         return res
 
 
 class ContextEnhancer:
-    def __init__(self, client_data: Dict):
+    def __init__(self, client_data: Dict, count_tokens: LengthFn = approximate_token_length):
         self.client_data = client_data
+        self.builder = ContextBuilder(count_tokens, max_docs=CONTEXT_MAX_DOCS)
 
-    def enhance(self, docs: List[Any]) -> str:
+    def build(self, docs: List[Any], question: str = "", max_tokens: Optional[int] = None) -> BuiltContext:
         if not docs:
             ent = self.client_data.get("entreprise", {})
-            return f"{ent.get('nom','Votre entreprise')} — {ent.get('slogan','')}"
-        return "\n".join([d.page_content for d in docs[:3]])
+            text = f"{ent.get('nom','Votre entreprise')} — {ent.get('slogan','')}"
+            return BuiltContext(text, self.builder.count_tokens(text), 0, 0)
+        return self.builder.build(docs, question, max_tokens)
 
-
-def detect_scenario(q: str) -> str:
-    ql = q.lower()
-    if any(k in ql for k in ["urgent", "demain", "crise", "last minute"]):
-        return "Urgence"
-    if any(k in ql for k in ["prix", "devis", "budget", "tarif"]):
-        return "Devis"
-    if any(k in ql for k in ["référence", "reference", "portfolio"]):
-        return "Références"
-    return "Question générale"
+    def enhance(self, docs: List[Any], question: str = "", max_tokens: Optional[int] = None) -> str:
+        return self.build(docs, question, max_tokens).text
 
 
 class Pipeline:
-    def __init__(self, mode: str, client_id: str, client_data: Dict[str, Any], retriever, llm, prompt: PromptTemplate):
+    def __init__(self, mode: str, client_id: str, client_data: Dict[str, Any], vectorstore, embeddings, llm,
+                 prompt: PromptTemplate, data_signature: Optional[Tuple[int, int]] = None,
+                 lexical_index: Optional[BM25Index] = None, count_tokens: LengthFn = approximate_token_length,
+                 prompt_prefix: str = ""):
         self.mode = mode
         self.client_id = client_id
         self.client_data = client_data
-        self.retriever = retriever
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
         self.llm = llm
+        # Préfixe statique (en-tête + consignes du client) puis partie variable `prompt` : le préfixe, identique
+        # d'une requête à l'autre, est réutilisé par le LLM (KV cache d'Ollama, past-key-values HF)
+        self.prompt_prefix = prompt_prefix
         self.prompt = prompt
-        self.enhancer = ContextEnhancer(client_data)
+        self.data_signature = data_signature
+        self.lexical_index = lexical_index
+        self.count_tokens = count_tokens
+        self.enhancer = ContextEnhancer(client_data, count_tokens)
         self.parser = AdvancedOutputParser(client_data.get("entreprise", {}).get("nom", "Votre entreprise"))
+        # Déclencheurs du client compilés une fois (détection de scénario + fast-path)
+        self.classifier = ScenarioClassifier.from_client_data(client_data)
+        self.fast_path = ScenarioFastPath.from_client_data(client_data, self.classifier) if FAST_PATH else None
+        self.answer_cache = AnswerCache(
+            max_entries=ANSWER_CACHE_SIZE,
+            ttl_seconds=ANSWER_CACHE_TTL,
+            similarity_threshold=ANSWER_CACHE_SIMILARITY,
+        )
 
-    def process(self, question: str) -> str:
-        docs = self.retriever.get_relevant_documents(question)
-        context = self.enhancer.enhance(docs)
-        scen = detect_scenario(question)
-        prompt_text = self.prompt.format(
-            brand_name=self.client_data.get("entreprise", {}).get("nom", "Votre entreprise"),
-            context=context,
-            question=question,
-            scenario=scen,
+    @property
+    def fetch_k(self) -> int:
+        return SEARCH_FETCH_K if self.lexical_index is not None else SEARCH_K
+
+    def fuse(self, question: str, vector_hits: List[Any]) -> List[Any]:
+        if self.lexical_index is None:
+            return vector_hits
+        with span("lexical_search"):
+            lexical_hits = [doc for doc, _ in self.lexical_index.search(question, k=self.fetch_k)]
+            return reciprocal_rank_fusion([vector_hits, lexical_hits], k=SEARCH_K)
+
+    def retrieve(self, question: str, query_vector: List[float]) -> List[Any]:
+        # Distance cosinus Chroma -> pertinence = 1 - distance (comme le retriever "similarity_score_threshold")
+        with span("vector_search"):
+            results = self.vectorstore.similarity_search_by_vector_with_relevance_scores(query_vector, k=self.fetch_k)
+        return self.fuse(question, [doc for doc, distance in results if 1.0 - distance >= SCORE_THRESHOLD])
+
+    def search_vectors(self, query_vectors: List[List[float]]) -> List[List[Any]]:
+        """Documents au-dessus du seuil pour chaque vecteur : une seule requête (Chroma ou produit matriciel memmap)."""
+        if isinstance(self.vectorstore, MemmapVectorStore):
+            return [
+                [doc for doc, score in results if score >= SCORE_THRESHOLD]
+                for results in self.vectorstore.search_by_vectors(query_vectors, k=self.fetch_k)
+            ]
+        results = self.vectorstore._collection.query(
+            query_embeddings=query_vectors,
+            n_results=self.fetch_k,
+            include=["documents", "metadatas", "distances"],
         )
-        raw = self.llm.invoke(prompt_text)
+        return [
+            [
+                Document(page_content=text, metadata=metadata or {})
+                for text, metadata, distance in zip(texts, metadatas, distances)
+                if 1.0 - distance >= SCORE_THRESHOLD
+            ]
+            for texts, metadatas, distances in zip(results["documents"], results["metadatas"], results["distances"])
+        ]
+
+    def retrieve_many(self, questions: List[str], query_vectors: List[List[float]]) -> List[List[Any]]:
+        """Recherche groupée : une seule requête pour toutes les questions, puis fusion BM25 par question."""
+        with span("vector_search"):
+            hits = self.search_vectors(query_vectors)
+        return [self.fuse(question, vector_hits) for question, vector_hits in zip(questions, hits)]
+
+    async def aembed_query(self, question: str) -> List[float]:
+        """Embedding de la question, groupé avec ceux des requêtes concurrentes (tous clients du modèle)."""
+        embedder = query_embedder(self.embeddings)
+        if embedder is None:
+            return await self.embeddings.aembed_query(question)
+        return await asyncio.wrap_future(embedder.submit(question))
+
+    async def aretrieve(self, question: str, query_vector: List[float]) -> List[Any]:
+        """retrieve, recherche vectorielle groupée avec celles des requêtes concurrentes."""
+        if SEARCH_BATCHER is None:
+            return await asyncio.to_thread(self.retrieve, question, query_vector)
+        # Le lot s'exécute hors du contexte de la requête : l'étape est chronométrée côté appelant (attente comprise)
+        with span("vector_search"):
+            hits = await asyncio.wrap_future(SEARCH_BATCHER.submit((self, query_vector)))
+        if self.lexical_index is None:
+            return hits
+        return await asyncio.to_thread(self.fuse, question, hits)
+
+    def format_prompt(self, question: str, docs: List[Any]) -> str:
+        fields = {"question": question, "scenario": self.classifier.label(question)}
+        with span("context_build"):
+            # Le contexte dispose de ce qui reste du budget une fois le gabarit, la question et le scénario comptés
+            overhead = self.count_tokens(self.prompt_prefix + self.prompt.format(context="", **fields))
+            context = self.enhancer.build(docs, question, max_tokens=max(0, PROMPT_MAX_TOKENS - overhead))
+        with span("prompt_format"):
+            prompt_text = self.prompt_prefix + self.prompt.format(context=context.text, **fields)
+        prompt_tokens = overhead + context.tokens
+        PROMPT_SIZE.observe(prompt_tokens)
+        if prompt_tokens > PROMPT_MAX_TOKENS:
+            logger.warning(f"Prompt de {prompt_tokens} tokens (budget {PROMPT_MAX_TOKENS}) : question trop longue")
+        return prompt_text
+
+    def remember(self, question: str, query_vector: List[float], answer: str) -> str:
+        self.answer_cache.put(question, answer, query_vector)
+        return answer
+
+    def quick_answer(self, question: str) -> Optional[str]:
+        """Réponse sans génération : scénario critique (fast-path) ou question déjà posée."""
+        with span("quick_answer"):
+            if self.fast_path is not None:
+                answer = self.fast_path.answer(question)
+                if answer is not None:
+                    set_outcome("fast_path")
+                    return answer
+            answer = self.answer_cache.get(question)
+            if answer is not None:
+                set_outcome("cache")
+            return answer
+
+    def similar_answer(self, query_vector: List[float]) -> Optional[str]:
+        answer = self.answer_cache.get_similar(query_vector)
+        if answer is not None:
+            set_outcome("semantic_cache")
+        return answer
+
+    def prepare(self, question: str) -> Tuple[Optional[str], Optional[str], Optional[List[float]]]:
+        """-> (réponse immédiate, None, None) ou (None, prompt, embedding de la question)."""
+        cached = self.quick_answer(question)
+        if cached is not None:
+            return cached, None, None
+        with span("embed_query"):
+            query_vector = self.embeddings.embed_query(question)
+        cached = self.similar_answer(query_vector)
+        if cached is not None:
+            return cached, None, None
+        return None, self.format_prompt(question, self.retrieve(question, query_vector)), query_vector
+
+    async def aprepare(self, question: str) -> Tuple[Optional[str], Optional[str], Optional[List[float]]]:
+        # Fast-path (regex) et contexte (tokenizer) hors de la boucle d'événements, comme la recherche
+        cached = await asyncio.to_thread(self.quick_answer, question)
+        if cached is not None:
+            return cached, None, None
+        with span("embed_query"):
+            query_vector = await self.aembed_query(question)
+        cached = self.similar_answer(query_vector)
+        if cached is not None:
+            return cached, None, None
+        docs = await self.aretrieve(question, query_vector)
+        return None, await asyncio.to_thread(self.format_prompt, question, docs), query_vector
+
+    async def aprepare_many(self, questions: List[str]) -> List[Tuple[Optional[str], Optional[str], Optional[List[float]]]]:
+        """aprepare pour un lot : embeddings en un appel, recherche groupée."""
+        prepared: List[Any] = await asyncio.to_thread(lambda: [(self.quick_answer(q), None, None) for q in questions])
+        pending = [i for i, (cached, _, _) in enumerate(prepared) if cached is None]
+        if not pending:
+            return prepared
+        with span("embed_query"):
+            vectors = await asyncio.to_thread(embed_queries, self.embeddings, [questions[i] for i in pending])
+        to_retrieve = []
+        for i, vector in zip(pending, vectors):
+            cached = self.answer_cache.get_similar(vector)
+            if cached is not None:
+                prepared[i] = (cached, None, None)
+            else:
+                to_retrieve.append((i, vector))
+        if to_retrieve:
+            docs_lists = await asyncio.to_thread(
+                self.retrieve_many, [questions[i] for i, _ in to_retrieve], [v for _, v in to_retrieve]
+            )
+            prompts = await asyncio.to_thread(
+                lambda: [self.format_prompt(questions[i], docs) for (i, _), docs in zip(to_retrieve, docs_lists)]
+            )
+            for (i, vector), prompt_text in zip(to_retrieve, prompts):
+                prepared[i] = (None, prompt_text, vector)
+        return prepared
+
+    def process(self, question: str) -> str:
+        cached, prompt_text, query_vector = self.prepare(question)
+        if cached is not None:
+            return cached
+        with span("generation"):
+            raw = self.llm.invoke(prompt_text)
+        return self.finish(question, prompt_text, query_vector, raw)
+
+    async def agenerate(self, question: str, prompt_text: str, query_vector: List[float]) -> str:
+        with span("generation"):
+            raw = await self.llm.ainvoke(prompt_text)
+        return self.finish(question, prompt_text, query_vector, raw)
+
+    def finish(self, question: str, prompt_text: str, query_vector: List[float], raw: Any) -> str:
+        """Sortie brute du LLM -> réponse nettoyée (comptage des tokens, mise en cache)."""
         raw_text = getattr(raw, "content", raw)
-        return self.parser.parse(raw_text)
+        record_tokens(prompt_text, raw, raw_text, count=self.count_tokens)
+        with span("parse"):
+            answer = self.parser.parse(raw_text)
+        return self.remember(question, query_vector, answer)
 
+    async def aprocess(self, question: str) -> str:
+        cached, prompt_text, query_vector = await self.aprepare(question)
+        if cached is not None:
+            return cached
+        return await self.agenerate(question, prompt_text, query_vector)
 
-def build_embeddings_and_llm() -> Tuple[Any, Any]:
+    async def astream(self, prompt_text: str, handle: Optional["GenerationHandle"] = None) -> AsyncIterator[str]:
+        """Produit les tokens bruts du LLM au fil de la génération (HF/ONNX : arrêtable via `handle`)."""
+        if isinstance(self.llm, HFLLMWrapper):
+            stream = self.llm.astream(prompt_text, handle)
+        else:
+            stream = self.llm.astream(prompt_text)
+        async for chunk in stream:
+            yield getattr(chunk, "content", chunk)
+
+
+class GenerationHandle:
+    """Génération en flux d'un thread HF : arrêt demandé depuis la boucle d'événements, fin attendue.
+
+    Sert aussi de critère d'arrêt transformers (vrai une fois l'arrêt demandé) ; ONNX lit `cancelled`.
+    """
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.future: Optional["asyncio.Future[Any]"] = None
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancelled.is_set()
+
+    async def stop(self) -> None:
+        """Arrête la génération au token suivant et attend que le thread soit libéré."""
+        self.cancelled.set()
+        if self.future is not None:
+            await asyncio.wait([self.future])
+
+
+class HFLLMWrapper:
+    generation_kwargs = {"max_new_tokens": 200, "do_sample": True, "temperature": 0.7, "top_p": 0.9}
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        # Les prompts concurrents sont regroupés en un lot (paddé) par appel au modèle
+        self.batcher = None
+        if HF_BATCH_MAX_SIZE > 1:
+            self.batcher = MicroBatcher(
+                self.generate_batch,
+                max_batch_size=HF_BATCH_MAX_SIZE,
+                max_wait_ms=HF_BATCH_MAX_WAIT_MS,
+                name="hf-batcher",
+            )
+
+    def generate_batch(self, prompts: List[str]) -> List[str]:
+        outputs = self.pipe(prompts, batch_size=len(prompts), **self.generation_kwargs)
+        # Selon la version de transformers: [{"generated_text"}] ou [[{"generated_text"}]]
+        return [(out[0] if isinstance(out, list) else out)["generated_text"] for out in outputs]
+
+    def invoke(self, prompt: str) -> str:
+        if self.batcher is None:
+            return self.generate_batch([prompt])[0]
+        return self.batcher.submit(prompt).result()
+
+    async def ainvoke(self, prompt: str) -> str:
+        if self.batcher is None:
+            loop = asyncio.get_running_loop()
+            # Contexte copié : la trace de la requête suit la génération dans le thread HF
+            return await loop.run_in_executor(HF_EXECUTOR, contextvars.copy_context().run, self.invoke, prompt)
+        return await asyncio.wrap_future(self.batcher.submit(prompt))
+
+    def generate_streaming(self, prompt: str, streamer: Any, handle: Optional[GenerationHandle] = None) -> None:
+        stopping = {"stopping_criteria": [handle]} if handle is not None else {}
+        self.pipe(prompt, streamer=streamer, **stopping, **self.generation_kwargs)
+
+    async def astream(self, prompt: str, handle: Optional[GenerationHandle] = None) -> AsyncIterator[str]:
+        # Le streamer ne gère qu'une séquence : génération hors micro-batching
+        from transformers import TextIteratorStreamer
+
+        handle = handle or GenerationHandle()
+        streamer = TextIteratorStreamer(self.pipe.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        loop = asyncio.get_running_loop()
+        handle.future = loop.run_in_executor(
+            HF_EXECUTOR, contextvars.copy_context().run, self.generate_streaming, prompt, streamer, handle
+        )
+        tokens = iter(streamer)
+        try:
+            while True:
+                token = await asyncio.to_thread(next, tokens, None)
+                if token is None:
+                    break
+                yield token
+        finally:
+            # Flux abandonné (client parti) : arrêt au token suivant plutôt qu'à max_new_tokens
+            handle.cancelled.set()
+        await handle.future
+
+
+class _FirstTokenTimer:
+    """Critère d'arrêt (jamais vrai) qui note le temps jusqu'au premier token généré : le prefill."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.elapsed: Optional[float] = None
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if self.elapsed is None:
+            self.elapsed = time.perf_counter() - self.started
+        return False
+
+
+class HFCausalLLMWrapper(HFLLMWrapper):
+    """Modèle HF décodeur seul : past-key-values du préfixe statique de chaque client calculés une fois.
+
+    Générations une par une (un lot paddé ne partagerait pas le cache du préfixe) ; le prefill
+    (jusqu'au premier token) et les tokens repris du cache sont mesurés à chaque génération.
+    """
+
+    def __init__(self, pipe):
+        super().__init__(pipe)
+        self.batcher = None
+        self.prefixes = PrefixRegistry(max_entries=2 * MAX_PIPELINES)
+
+    def register_prefix(self, prefix: str) -> None:
+        self.prefixes.register(prefix)
+
+    def _encode_prefix(self, prefix: str) -> Tuple[Any, Any]:
+        import torch
+
+        ids = self.pipe.tokenizer(prefix, return_tensors="pt").input_ids.to(self.pipe.model.device)
+        with torch.no_grad():
+            cache = self.pipe.model(ids, use_cache=True).past_key_values
+        logger.info(f"Préfixe de prompt mis en cache ({ids.shape[1]} tokens)")
+        return ids, cache
+
+    def generate(self, prompt: str, streamer: Any = None, handle: Optional[GenerationHandle] = None) -> str:
+        import torch
+
+        tokenizer, model = self.pipe.tokenizer, self.pipe.model
+        input_ids = tokenizer(prompt, return_tensors="pt").input_ids.to(model.device)
+        kwargs = dict(self.generation_kwargs)
+        reused = 0
+        prefix, _ = self.prefixes.split(prompt)
+        if prefix is not None:
+            prefix_ids, cache = self.prefixes.state(prefix, self._encode_prefix)
+            n = prefix_ids.shape[1]
+            # Le préfixe doit se tokeniser à l'identique en tête du prompt complet
+            if n < input_ids.shape[1] and torch.equal(input_ids[0, :n], prefix_ids[0]):
+                kwargs["past_key_values"] = copy.deepcopy(cache)  # generate() étend le cache sur place
+                reused = n
+        timer = _FirstTokenTimer()
+        with torch.no_grad():
+            output = model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                stopping_criteria=[timer] if handle is None else [timer, handle],
+                streamer=streamer,
+                pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+                **kwargs,
+            )
+        if timer.elapsed is not None:
+            record_prefill(timer.elapsed, input_ids.shape[1] - reused, reused)
+        return tokenizer.decode(output[0, input_ids.shape[1]:], skip_special_tokens=True)
+
+    def generate_batch(self, prompts: List[str]) -> List[str]:
+        return [self.generate(prompt) for prompt in prompts]
+
+    def generate_streaming(self, prompt: str, streamer: Any, handle: Optional[GenerationHandle] = None) -> None:
+        self.generate(prompt, streamer=streamer, handle=handle)
+
+
+class OnnxLLMWrapper(HFLLMWrapper):
+    """FLAN-T5 exporté en ONNX (server.onnx_backend) : même micro-batching que HFLLMWrapper, sans torch.
+
+    `pipe` est un OnnxSeq2SeqLM ; son `tokenizer` (tokenizers) sert aussi au comptage des tokens.
+    """
+
+    def generate_batch(self, prompts: List[str]) -> List[str]:
+        return self.pipe.generate(prompts, **self.generation_kwargs)
+
+    def generate_streaming(self, prompt: str, on_text: Any, handle: Optional[GenerationHandle] = None) -> None:
+        should_stop = handle.cancelled.is_set if handle is not None else None
+        self.pipe.generate([prompt], on_text=on_text, should_stop=should_stop, **self.generation_kwargs)
+
+    async def astream(self, prompt: str, handle: Optional[GenerationHandle] = None) -> AsyncIterator[str]:
+        handle = handle or GenerationHandle()
+        loop = asyncio.get_running_loop()
+        texts: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        handle.future = loop.run_in_executor(
+            HF_EXECUTOR, contextvars.copy_context().run, self.generate_streaming, prompt,
+            lambda text: loop.call_soon_threadsafe(texts.put_nowait, text), handle,
+        )
+        handle.future.add_done_callback(lambda _: texts.put_nowait(None))
+        emitted = ""
+        try:
+            while True:
+                text = await texts.get()
+                if text is None:
+                    break
+                # Texte décodé complet à chaque token : seul le nouveau suffixe est émis
+                if len(text) > len(emitted) and text.startswith(emitted):
+                    yield text[len(emitted):]
+                    emitted = text
+        finally:
+            handle.cancelled.set()  # flux abandonné : fin du décodage au pas suivant
+        await handle.future
+
+
+class OllamaLLMWrapper:
+    """LLM Ollama : prefill lu dans les compteurs renvoyés par le serveur (prompt_eval_*).
+
+    Le runner d'Ollama réutilise le KV cache du plus long préfixe commun avec la séquence
+    précédente de son slot : le préfixe statique du client, en tête de chaque prompt, n'est
+    évalué qu'une fois tant que le modèle reste chargé (OLLAMA_KEEP_ALIVE).
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    @staticmethod
+    def _record(info: Optional[Dict[str, Any]]) -> None:
+        if info and info.get("prompt_eval_duration"):
+            record_prefill(info["prompt_eval_duration"] / 1e9, info.get("prompt_eval_count", 0))
+
+    def invoke(self, prompt: str) -> str:
+        generation = self.llm.generate([prompt]).generations[0][0]
+        self._record(generation.generation_info)
+        return generation.text
+
+    async def ainvoke(self, prompt: str) -> str:
+        generation = (await self.llm.agenerate([prompt])).generations[0][0]
+        self._record(generation.generation_info)
+        return generation.text
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        # Morceaux bruts : le dernier porte les compteurs de la génération
+        async for chunk in self.llm._astream(prompt):
+            if chunk.generation_info:
+                self._record(chunk.generation_info)
+            yield chunk.text
+
+
+def _build_embeddings() -> Any:
     if LLM_PROVIDER == "OPENAI":
-        if not HAS_OPENAI:
+        try:
+            from langchain_openai import OpenAIEmbeddings
+        except ImportError:
             raise RuntimeError("langchain-openai non disponible. Ajoutez-le à requirements.txt")
-        emb = OpenAIEmbeddings(model=EMBED_MODEL_OPENAI)
-        llm = ChatOpenAI(model=LLM_MODEL, temperature=0.6)
-        return emb, llm
+        return OpenAIEmbeddings(model=EMBED_MODEL_OPENAI)
 
     if LLM_PROVIDER == "OLLAMA":
-        emb = OllamaEmbeddings(model=OLLAMA_EMBED_MODEL)
-        llm = OllamaLLM(model=OLLAMA_LLM_MODEL, temperature=0.7, num_predict=300, top_k=20, top_p=0.9)
-        return emb, llm
+        from langchain_community.embeddings import OllamaEmbeddings
+
+        return OllamaEmbeddings(model=OLLAMA_EMBED_MODEL)
 
     # HF local (gratuit)
-    emb = HuggingFaceEmbeddings(model_name=HF_EMBED_MODEL)
-    # Pipeline text2text (FLAN-T5)
-    text2text = pipeline(
-        "text2text-generation",
-        model=HF_LLM_MODEL,
-        tokenizer=HF_LLM_MODEL,
-    )
+    if HF_BACKEND == "onnx":
+        from server.onnx_backend import TASK_EMBEDDINGS, OnnxEmbeddings, onnx_model_dir
+
+        directory = onnx_model_dir(HF_EMBED_MODEL, TASK_EMBEDDINGS, ONNX_CACHE_DIR, ONNX_QUANTIZE)
+        return OnnxEmbeddings(HF_EMBED_MODEL, directory, threads=ONNX_THREADS)
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=HF_EMBED_MODEL)
+
+
+def _build_llm() -> Any:
+    if LLM_PROVIDER == "OPENAI":
+        try:
+            from langchain_openai import ChatOpenAI
+        except ImportError:
+            raise RuntimeError("langchain-openai non disponible. Ajoutez-le à requirements.txt")
+        return ChatOpenAI(model=LLM_MODEL, temperature=0.6)
+
+    if LLM_PROVIDER == "OLLAMA":
+        from langchain_community.llms import Ollama as OllamaLLM
+
+        keep_alive = int(OLLAMA_KEEP_ALIVE) if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit() else OLLAMA_KEEP_ALIVE
+        return OllamaLLMWrapper(OllamaLLM(
+            model=OLLAMA_LLM_MODEL, temperature=0.7, num_predict=300, top_k=20, top_p=0.9, keep_alive=keep_alive,
+        ))
 
-    class HFLLMWrapper:
-        def __init__(self, pipe):
-            self.pipe = pipe
+    if HF_BACKEND == "onnx":
+        from server.onnx_backend import TASK_TEXT2TEXT, OnnxSeq2SeqLM, onnx_model_dir
 
-        def invoke(self, prompt: str) -> str:
-            out = self.pipe(prompt, max_new_tokens=200, do_sample=True, temperature=0.7, top_p=0.9)
-            return out[0]["generated_text"]
+        directory = onnx_model_dir(HF_LLM_MODEL, TASK_TEXT2TEXT, ONNX_CACHE_DIR, ONNX_QUANTIZE)
+        return OnnxLLMWrapper(OnnxSeq2SeqLM(directory, threads=ONNX_THREADS))
+
+    from transformers import AutoConfig, pipeline
+
+    if AutoConfig.from_pretrained(HF_LLM_MODEL).is_encoder_decoder:
+        # Pipeline text2text (FLAN-T5) ; encodeur bidirectionnel : l'état du préfixe dépend de la suite du
+        # prompt, rien à réutiliser d'une requête à l'autre
+        text2text = pipeline(
+            "text2text-generation",
+            model=HF_LLM_MODEL,
+            tokenizer=HF_LLM_MODEL,
+        )
+        return HFLLMWrapper(text2text)
+    return HFCausalLLMWrapper(pipeline("text-generation", model=HF_LLM_MODEL, tokenizer=HF_LLM_MODEL))
+
+
+def build_token_counter(llm: Any) -> LengthFn:
+    """Compteur de tokens du LLM actif : tokenizer HF du modèle, tiktoken (OpenAI), sinon ≈ 4 caractères/token."""
+    tokenizer = getattr(getattr(llm, "pipe", None), "tokenizer", None)
+    if tokenizer is not None:
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    if LLM_PROVIDER == "OPENAI":
+        try:
+            import tiktoken
+
+            encoding = tiktoken.encoding_for_model(LLM_MODEL)
+            return lambda text: len(encoding.encode(text))
+        except Exception:
+            pass
+    return approximate_token_length
+
+
+def _build_embeddings_and_llm() -> Tuple[Any, Any]:
+    return _build_embeddings(), _build_llm()
+
+
+def build_embeddings() -> Any:
+    """Embeddings seuls, avec le cache disque (indexation en masse : le LLM n'est pas chargé)."""
+    emb = _build_embeddings()
+    return CachedEmbeddings(emb, EMBED_CACHE) if EMBED_CACHE is not None else emb
+
+
+def models_key() -> Tuple[str, ...]:
+    if LLM_PROVIDER == "OPENAI":
+        return (LLM_PROVIDER, EMBED_MODEL_OPENAI, LLM_MODEL)
+    if LLM_PROVIDER == "OLLAMA":
+        return (LLM_PROVIDER, OLLAMA_EMBED_MODEL, OLLAMA_LLM_MODEL)
+    if HF_BACKEND != "torch":
+        return ("HF", HF_EMBED_MODEL, HF_LLM_MODEL, HF_BACKEND)
+    return ("HF", HF_EMBED_MODEL, HF_LLM_MODEL)
 
-    llm = HFLLMWrapper(text2text)
+
+_MODELS_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _shared_embeddings_and_llm(key: Tuple[str, ...]) -> Tuple[Any, Any]:
+    logger.info(f"Chargement des modèles {key}")
+    emb, llm = _build_embeddings_and_llm()
+    if EMBED_CACHE is not None:
+        emb = CachedEmbeddings(emb, EMBED_CACHE)
     return emb, llm
 
 
-def load_client_data(mode: str, client_id: str) -> Dict[str, Any]:
+def build_embeddings_and_llm() -> Tuple[Any, Any]:
+    """Embeddings + LLM chargés une seule fois par processus et partagés par toutes les pipelines."""
+    with _MODELS_LOCK:
+        return _shared_embeddings_and_llm(models_key())
+
+
+def client_data_path(mode: str, client_id: str) -> str:
     if mode == "alt":
-        path = f"./rag_alt/clients/{client_id}/data.json"
-    else:
-        path = f"./clients/{client_id}/data.json"
-    with open(path, "r", encoding="utf-8") as f:
+        return f"./rag_alt/clients/{client_id}/data.json"
+    return f"./clients/{client_id}/data.json"
+
+
+def load_client_data(mode: str, client_id: str) -> Dict[str, Any]:
+    with open(client_data_path(mode, client_id), "r", encoding="utf-8") as f:
         return json.load(f)
 
 
+def indexer_module(mode: str):
+    return importlib.import_module("rag_alt.indexer" if mode == "alt" else "indexer")
+
+
+@lru_cache(maxsize=None)
+def chunk_length_function() -> Tuple[str, LengthFn]:
+    """-> (nom, compteur de tokens) utilisé pour découper les documents : tokenizer du modèle d'embeddings HF."""
+    if LLM_PROVIDER == "HF":
+        count = token_length_function(HF_EMBED_MODEL)
+        if count is not approximate_token_length:
+            return HF_EMBED_MODEL, count
+    return "approx", approximate_token_length
+
+
+def chunking_settings() -> str:
+    """Réglages du découpage pour l'empreinte (sans recouvrement : même valeur qu'avant CHUNK_OVERLAP)."""
+    settings = f"{chunk_length_function()[0]}:{CHUNK_MAX_TOKENS}"
+    return f"{settings}+{CHUNK_OVERLAP}" if CHUNK_OVERLAP else settings
+
+
 def build_documents(mode: str, client_data_path: str):
-    if mode == "alt":
-        return alt_indexer.load_and_prepare_documents(client_data_path)
-    return main_indexer.load_and_prepare_documents(client_data_path)
+    _, length_fn = chunk_length_function()
+    return indexer_module(mode).load_and_prepare_documents(
+        client_data_path, length_fn=length_fn, max_length=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP
+    )
 
 
-def build_pipeline(mode: str, client_id: str) -> Pipeline:
-    client_data = load_client_data(mode, client_id)
-    emb, llm = build_embeddings_and_llm()
+def _sha256_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-    if mode == "alt":
-        persist_dir = os.path.join(CHROMA_DIR_ALT, client_id)
-        collection = f"api_alt_{client_id}"
-        docs = alt_indexer.load_and_prepare_documents(f"./rag_alt/clients/{client_id}/data.json")
-    else:
-        persist_dir = os.path.join(CHROMA_DIR_MAIN, client_id)
-        collection = f"api_main_{client_id}"
-        docs = main_indexer.load_and_prepare_documents(f"./clients/{client_id}/data.json")
 
+def index_fingerprint(mode: str, client_id: str, emb) -> Dict[str, str]:
+    # Données client + code de préparation des documents (indexeur, découpage et ses réglages)
+    # + modèle d'embeddings (+ backend s'il n'est pas Chroma)
+    fingerprint = {
+        "data_sha256": _sha256_file(client_data_path(mode, client_id)),
+        "indexer_sha256": _sha256_file(inspect.getsourcefile(indexer_module(mode))),
+        "chunking_sha256": _sha256_file(inspect.getsourcefile(chunking)),
+        "chunking": chunking_settings(),
+        "embed_model": embedding_model_name(emb),
+    }
+    if VECTOR_BACKEND != "chroma":
+        fingerprint["vector_backend"] = VECTOR_BACKEND
+    return fingerprint
+
+
+def collection_location(mode: str, client_id: str) -> Tuple[str, str]:
+    """-> (répertoire de persistance, nom de la collection) d'un client."""
+    base_dir = CHROMA_DIR_ALT if mode == "alt" else CHROMA_DIR_MAIN
+    return os.path.join(base_dir, client_id), f"api_{mode}_{client_id}"
+
+
+def read_fingerprint(mode: str, client_id: str) -> Optional[Dict[str, str]]:
+    path = os.path.join(collection_location(mode, client_id)[0], "fingerprint.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_fingerprint(mode: str, client_id: str, fingerprint: Dict[str, str]) -> None:
+    with open(os.path.join(collection_location(mode, client_id)[0], "fingerprint.json"), "w", encoding="utf-8") as f:
+        json.dump(fingerprint, f)
+
+
+def open_collection(mode: str, client_id: str, emb, stored: Optional[Dict[str, str]],
+                    fingerprint: Dict[str, str]):
+    """Ouvre la collection (Chroma ou memmap selon VECTOR_BACKEND) ; la recrée si le modèle d'embeddings a changé."""
+    persist_dir, collection = collection_location(mode, client_id)
     os.makedirs(persist_dir, exist_ok=True)
-    vectorstore = Chroma.from_documents(
-        documents=docs,
-        embedding=emb,
-        collection_name=collection,
-        persist_directory=persist_dir,
-        collection_metadata={"hnsw:space": "cosine"},
-    )
 
-    retriever = vectorstore.as_retriever(
-        search_type="similarity_score_threshold",
-        search_kwargs={"k": 3, "score_threshold": 0.3},
-    )
+    def _open():
+        if VECTOR_BACKEND == "memmap":
+            return MemmapVectorStore(
+                os.path.join(persist_dir, "memmap"),
+                embedding_function=emb,
+                ann_min_docs=VECTOR_ANN_MIN_DOCS,
+                nprobe=VECTOR_ANN_NPROBE,
+            )
+        return Chroma(
+            collection_name=collection,
+            embedding_function=emb,
+            persist_directory=persist_dir,
+            collection_metadata={"hnsw:space": "cosine"},
+        )
+
+    vectorstore = _open()
+    if stored and stored != fingerprint and stored.get("embed_model") != fingerprint["embed_model"]:
+        # Dimensions potentiellement différentes : la collection doit être recréée
+        logger.info(f"Modèle d'embeddings changé pour '{collection}', reconstruction complète")
+        vectorstore.delete_collection()
+        vectorstore = _open()
+    return vectorstore
+
+
+def open_vectorstore(mode: str, client_id: str, emb):
+    """Ouvre la collection persistée ; ne ré-indexe (sur place) que si les données ont changé."""
+    fingerprint = index_fingerprint(mode, client_id, emb)
+    stored = read_fingerprint(mode, client_id)
+    vectorstore = open_collection(mode, client_id, emb, stored, fingerprint)
+    if stored == fingerprint:
+        logger.info(f"Collection '{collection_location(mode, client_id)[1]}' à jour, chargée sans ré-indexation")
+        return vectorstore
+
+    docs = build_documents(mode, client_data_path(mode, client_id))
+    indexer_module(mode).sync_vector_store(vectorstore, docs)
+    write_fingerprint(mode, client_id, fingerprint)
+    if EMBED_CACHE is not None:
+        logger.info(f"Cache embeddings: {EMBED_CACHE.stats()}")
+    return vectorstore
+
+
+def data_signature(mode: str, client_id: str) -> Tuple[int, int]:
+    st = os.stat(client_data_path(mode, client_id))
+    return st.st_mtime_ns, st.st_size
+
+
+def build_pipeline(mode: str, client_id: str) -> Pipeline:
+    started = time.perf_counter()
+    signature = data_signature(mode, client_id)
+    client_data = load_client_data(mode, client_id)
+    with span("build_models"):
+        emb, llm = build_embeddings_and_llm()
+    with span("build_vectorstore"):
+        vectorstore = open_vectorstore(mode, client_id, emb)
+    # Index BM25 construit une fois par client, sur les mêmes Documents que la collection
+    with span("build_lexical_index"):
+        lexical_index = BM25Index(build_documents(mode, client_data_path(mode, client_id))) if HYBRID_SEARCH else None
+
+    # Partie statique en tête (identique pour toutes les requêtes du client : réutilisable par le LLM),
+    # partie variable ensuite
+    prefix_template = """Tu es l'assistant de {brand_name}.
 
-    template = """Tu es l'assistant de {brand_name}.
+Mission: Réponds en 2-3 phrases claires, professionnelles et orientées solution. Termine par un appel à l'action (contact, devis, etc.).
 
-CONTEXTE:
+"""
+    template = """CONTEXTE:
 {context}
 
 CLIENT DIT: "{question}"
 
 SITUATION: {scenario}
 
-Mission: Réponds en 2-3 phrases claires, professionnelles et orientées solution. Termine par un appel à l'action (contact, devis, etc.).
 Réponse:"""
 
-    prompt = PromptTemplate(template=template, input_variables=["brand_name", "context", "question", "scenario"])
+    prompt_prefix = prefix_template.format(brand_name=client_data.get("entreprise", {}).get("nom", "Votre entreprise"))
+    prompt = PromptTemplate(template=template, input_variables=["context", "question", "scenario"])
+    register_prefix = getattr(llm, "register_prefix", None)
+    if PREFIX_CACHE and register_prefix is not None:
+        register_prefix(prompt_prefix)
+
+    pipeline = Pipeline(
+        mode=mode,
+        client_id=client_id,
+        client_data=client_data,
+        vectorstore=vectorstore,
+        embeddings=emb,
+        llm=llm,
+        prompt=prompt,
+        data_signature=signature,
+        lexical_index=lexical_index,
+        count_tokens=build_token_counter(llm),
+        prompt_prefix=prompt_prefix,
+    )
+    PIPELINE_BUILD_SECONDS.observe(time.perf_counter() - started, mode=mode)
+    return pipeline
+
+
+def stored_vector_dimension(vectorstore) -> int:
+    """Dimension des vecteurs déjà indexés (0 si l'index est vide), sans appel au modèle d'embeddings."""
+    if isinstance(vectorstore, MemmapVectorStore):
+        return vectorstore.dimension
+    sample = vectorstore._collection.get(limit=1, include=["embeddings"])["embeddings"]
+    return len(sample[0]) if sample is not None and len(sample) else 0
 
-    return Pipeline(mode=mode, client_id=client_id, client_data=client_data, retriever=retriever, llm=llm, prompt=prompt)
 
+def estimate_pipeline_bytes(pipeline: Pipeline) -> int:
+    """Estimation de l'empreinte propre d'une pipeline : vecteurs (+ index HNSW), textes, données client.
 
-# Cache mémoire des pipelines construits
-PIPELINES: Dict[Tuple[str, str], Pipeline] = {}
+    Les vecteurs memmap sont dans le cache de pages (partagé, récupérable par le noyau) : non comptés deux fois.
+    """
+    stored = pipeline.vectorstore.get(include=["documents"])
+    count = len(stored["ids"])
+    dim = stored_vector_dimension(pipeline.vectorstore) if count else 0
+    text_bytes = sum(len((d or "").encode("utf-8")) for d in stored["documents"])
+    data_bytes = len(json.dumps(pipeline.client_data, ensure_ascii=False).encode("utf-8"))
+    vector_copies = 1 if isinstance(pipeline.vectorstore, MemmapVectorStore) else 2
+    return count * dim * 4 * vector_copies + text_bytes + data_bytes
+
+
+# Cache mémoire des pipelines construits (construction unique par clé, éviction LRU)
+PIPELINES = PipelineRegistry(
+    builder=lambda key: build_pipeline(*key),
+    max_entries=MAX_PIPELINES,
+    max_bytes=int(PIPELINES_MEMORY_BUDGET_MB * 1024 * 1024),
+    # Estimation (lecture de tous les textes) seulement quand un budget doit être respecté
+    size_fn=estimate_pipeline_bytes if PIPELINES_MEMORY_BUDGET_MB > 0 else None,
+)
+
+
+def collect_metrics():
+    """Valeurs lues à chaque appel de /metrics : caches, pipelines résidentes, file de génération."""
+    answer_caches = [({"mode": mode, "client_id": client_id}, pipeline.answer_cache.stats())
+                     for (mode, client_id), pipeline in PIPELINES.items()]
+    yield ("rag_answer_cache_lookups_total", "counter", "Consultations du cache de réponses",
+           [(labels, stats["lookups"]) for labels, stats in answer_caches])
+    yield ("rag_answer_cache_hits_total", "counter", "Hits du cache de réponses (exact / sémantique)",
+           [({**labels, "level": "exact"}, stats["hits"]) for labels, stats in answer_caches]
+           + [({**labels, "level": "semantic"}, stats["semantic_hits"]) for labels, stats in answer_caches])
+    yield ("rag_answer_cache_hit_ratio", "gauge", "Taux de hit du cache de réponses",
+           [(labels, stats["hit_ratio"]) for labels, stats in answer_caches])
+    if EMBED_CACHE is not None:
+        stats = EMBED_CACHE.stats()
+        yield ("rag_embedding_cache_hits_total", "counter", "Hits du cache d'embeddings", [({}, stats["hits"])])
+        yield ("rag_embedding_cache_misses_total", "counter", "Misses du cache d'embeddings", [({}, stats["misses"])])
+        yield ("rag_embedding_cache_hit_ratio", "gauge", "Taux de hit du cache d'embeddings", [({}, stats["hit_ratio"])])
+        yield ("rag_embedding_cache_entries", "gauge", "Vecteurs dans le cache d'embeddings", [({}, stats["entries"])])
+    stats = PIPELINES.stats()
+    yield ("rag_pipelines_resident", "gauge", "Pipelines en mémoire", [({}, stats["resident"])])
+    yield ("rag_pipelines_resident_bytes", "gauge", "Taille estimée des pipelines en mémoire",
+           [({}, stats["resident_bytes"])])
+    yield ("rag_pipeline_registry_hits_total", "counter", "Pipelines trouvées en mémoire", [({}, stats["hits"])])
+    yield ("rag_pipeline_registry_misses_total", "counter", "Pipelines à construire", [({}, stats["misses"])])
+    yield ("rag_pipeline_evictions_total", "counter", "Pipelines évincées (LRU)", [({}, stats["evictions"])])
+    yield ("rag_pipeline_build_failures_total", "counter", "Constructions de pipeline en échec",
+           [({}, stats["build_failures"])])
+    prefixes = next((p.llm.prefixes for _, p in PIPELINES.items() if hasattr(p.llm, "prefixes")), None)
+    if prefixes is not None:
+        yield ("rag_prefix_cache_entries", "gauge", "Préfixes de prompt enregistrés (HF décodeur seul)",
+               [({}, len(prefixes))])
+        yield ("rag_prefix_cache_hits_total", "counter", "Prompts commençant par un préfixe enregistré",
+               [({}, prefixes.hits)])
+        yield ("rag_prefix_cache_misses_total", "counter", "Prompts sans préfixe enregistré", [({}, prefixes.misses)])
+    batchers = [({"stage": "embed", "model": name}, b.stats()) for name, b in QUERY_EMBEDDERS.items()]
+    if SEARCH_BATCHER is not None:
+        batchers.append(({"stage": "search"}, SEARCH_BATCHER.stats()))
+    if batchers:
+        yield ("rag_query_batches_total", "counter", "Lots d'embeddings / de recherches (requêtes coalescées)",
+               [(labels, stats["batches"]) for labels, stats in batchers])
+        yield ("rag_query_batch_items_total", "counter", "Questions traitées par les lots",
+               [(labels, stats["items"]) for labels, stats in batchers])
+    stats = GENERATION_LIMITER.stats()
+    yield ("rag_generations_active", "gauge", "Générations en cours", [({}, stats["active"])])
+    yield ("rag_generations_waiting", "gauge", "Requêtes en attente d'un créneau", [({}, stats["waiting"])])
+    yield ("rag_generations_rejected_total", "counter", "Requêtes rejetées (429)", [({}, stats["rejected"])])
+
+
+REGISTRY.add_collector(collect_metrics)
 
 
 def get_pipeline(mode: str, client_id: str) -> Pipeline:
-    key = (mode, client_id)
-    if key not in PIPELINES:
-        PIPELINES[key] = build_pipeline(mode, client_id)
-    return PIPELINES[key]
+    # data.json modifié depuis la construction : nouvelle pipeline (index synchronisé, cache de réponses vidé)
+    return PIPELINES.get(
+        (mode, client_id),
+        is_stale=lambda pipeline: pipeline.data_signature != data_signature(mode, client_id),
+    )
+
+
+READINESS: Dict[str, Any] = {
+    "ready": not WARMUP_ON_STARTUP,
+    "models": False,
+    "tenants": [],
+    "error": None,
+    "seconds_to_ready": None,
+}
+
+
+def parse_warmup_tenants(value: str) -> List[Tuple[str, str]]:
+    tenants = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            mode, _, client_id = item.partition(":")
+            tenants.append((mode, client_id) if client_id else ("main", mode))
+    return tenants
+
+
+def warm_up(tenants: bool = True) -> None:
+    """Charge les modèles, lance une génération à blanc puis construit les pipelines des clients listés.
+
+    `tenants=False` : modèles seuls (parent de server.serve quand les index ne peuvent pas être forkés).
+    """
+    try:
+        if not READINESS["models"]:
+            emb, llm = build_embeddings_and_llm()
+            if LLM_PROVIDER != "OPENAI":  # génération payante : pas de préchauffage
+                llm.invoke("Bonjour")
+            READINESS["models"] = True
+        if not tenants:
+            return
+        for mode, client_id in parse_warmup_tenants(WARMUP_TENANTS):
+            get_pipeline(mode, client_id)
+            READINESS["tenants"].append(f"{mode}:{client_id}")
+        READINESS["seconds_to_ready"] = round(time.perf_counter() - _IMPORT_STARTED, 2)
+        READINESS["ready"] = True
+        logger.info(f"Prêt en {READINESS['seconds_to_ready']}s (modèles + {READINESS['tenants']})")
+    except Exception as e:
+        READINESS["error"] = str(e)
+        logger.error(f"Erreur préchauffage: {e}")
+
+
+def reinit_after_fork() -> None:
+    """À appeler dans un worker forké (server.serve) : ressources propres à un processus recréées.
+
+    Les threads ne survivent pas à fork() (pool HF, micro-batchers : relancés à leur premier appel)
+    et une connexion SQLite ne doit pas être partagée entre processus.
+    """
+    global HF_EXECUTOR
+    HF_EXECUTOR = ThreadPoolExecutor(max_workers=HF_MAX_WORKERS, thread_name_prefix="hf-generate")
+    if EMBED_CACHE is not None:
+        EMBED_CACHE.reopen()
 
 
 # FastAPI app
@@ -239,6 +1132,25 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def start_warm_up():
+    # Déjà prêt si le parent de server.serve a tout préchargé avant le fork
+    if WARMUP_ON_STARTUP and not READINESS["ready"]:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+@app.get("/metrics")
+def metrics():
+    """Métriques au format texte Prometheus (latences par étape, tokens, caches, pipelines, file d'attente)."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/ready")
+def ready():
+    # 503 tant que le préchauffage n'est pas terminé (sonde de disponibilité)
+    return JSONResponse(status_code=200 if READINESS["ready"] else 503, content=READINESS)
+
+
 class ChatRequest(BaseModel):
     question: str
     client_id: str = "bms_ventouse"
@@ -247,26 +1159,257 @@ class ChatRequest(BaseModel):
 
 
 @app.post("/api/chat")
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     if req.mode not in {"main", "alt"}:
         return {"error": "mode invalide. Utilisez 'main' ou 'alt'."}
 
     if req.refresh:
-        key = (req.mode, req.client_id)
-        if key in PIPELINES:
-            del PIPELINES[key]
+        PIPELINES.invalidate((req.mode, req.client_id))
+
+    with RequestTrace("chat", UNKNOWN_CLIENT, req.mode, JSON_REQUEST_LOGS) as trace:
+        try:
+            # Construction éventuelle (chargement modèles/index) hors de la boucle d'événements
+            pipeline = await run_in_threadpool(get_pipeline, req.mode, req.client_id)
+            trace.client_id = req.client_id
+            # Les réponses en cache ne consomment pas de créneau de génération
+            response, prompt_text, query_vector = await pipeline.aprepare(req.question)
+            if response is None:
+                async with GENERATION_LIMITER.slot():
+                    response = await pipeline.agenerate(req.question, prompt_text, query_vector)
+            return {
+                "client_id": req.client_id,
+                "mode": req.mode,
+                "provider": LLM_PROVIDER,
+                "response": response,
+            }
+        except ServerOverloaded:
+            trace.outcome = "overloaded"
+            return JSONResponse(
+                status_code=429,
+                content={"error": "Serveur saturé, réessayez dans quelques instants."},
+                headers={"Retry-After": "1"},
+            )
+        except FileNotFoundError:
+            trace.outcome = "not_found"
+            return {"error": f"Fichier client introuvable pour {req.client_id} en mode {req.mode}."}
+        except Exception as e:
+            trace.outcome = "error"
+            logger.error(f"Erreur /api/chat: {e}")
+            return {"error": "Erreur serveur"}
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse dont `on_close` s'exécute toujours, une fois la réponse terminée ou abandonnée.
+
+    Le `finally` d'un générateur ne suffit pas : si le client se déconnecte avant le début
+    du corps, Starlette abandonne la réponse sans jamais démarrer le générateur ; après une
+    déconnexion en cours de flux, il l'abandonne sans le fermer. Il est donc fermé ici, hors de
+    la portée annulée par Starlette, avant `on_close` (coroutine).
+    """
+
+    def __init__(self, content: Any, on_close: Callable[[], Awaitable[None]], **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
 
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                await self.on_close()
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """Variante SSE de /api/chat : événements `token` au fil de la génération, puis `final` (réponse nettoyée)."""
+    if req.mode not in {"main", "alt"}:
+        return JSONResponse(status_code=400, content={"error": "mode invalide. Utilisez 'main' ou 'alt'."})
+
+    if req.refresh:
+        PIPELINES.invalidate((req.mode, req.client_id))
+
+    # Publiée à la fin du flux (ou dès l'erreur si le flux n'est pas ouvert)
+    trace = RequestTrace("stream", UNKNOWN_CLIENT, req.mode, JSON_REQUEST_LOGS)
     try:
-        pipeline = get_pipeline(req.mode, req.client_id)
-        response = pipeline.process(req.question)
-        return {
-            "client_id": req.client_id,
-            "mode": req.mode,
-            "provider": LLM_PROVIDER,
-            "response": response,
-        }
+        with trace.activate():
+            pipeline = await run_in_threadpool(get_pipeline, req.mode, req.client_id)
+            trace.client_id = req.client_id
+            cached, prompt_text, query_vector = await pipeline.aprepare(req.question)
+            if cached is None:
+                # Le créneau est réservé avant d'ouvrir le flux pour pouvoir répondre 429
+                await GENERATION_LIMITER.acquire()
+    except ServerOverloaded:
+        trace.outcome = "overloaded"
+        trace.finish()
+        return JSONResponse(
+            status_code=429,
+            content={"error": "Serveur saturé, réessayez dans quelques instants."},
+            headers={"Retry-After": "1"},
+        )
     except FileNotFoundError:
-        return {"error": f"Fichier client introuvable pour {req.client_id} en mode {req.mode}."}
+        trace.outcome = "not_found"
+        trace.finish()
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"Fichier client introuvable pour {req.client_id} en mode {req.mode}."},
+        )
+    except Exception as e:
+        trace.outcome = "error"
+        trace.finish()
+        logger.error(f"Erreur /api/chat/stream: {e}")
+        return JSONResponse(status_code=500, content={"error": "Erreur serveur"})
+
+    handle = GenerationHandle()
+
+    async def events():
+        response = cached
+        cleaner = IncrementalCleaner()
+        try:
+            if response is None:
+                started = time.perf_counter()
+                async for chunk in pipeline.astream(prompt_text, handle):
+                    delta = cleaner.feed(chunk)
+                    if delta:
+                        yield _sse("token", {"text": delta})
+                delta = cleaner.flush()
+                if delta:
+                    yield _sse("token", {"text": delta})
+                # Pas de trace courante autour des `yield` : le générateur peut être fermé depuis un autre contexte
+                with trace.activate():
+                    record_stage("generation", time.perf_counter() - started)
+                    response = pipeline.finish(req.question, prompt_text, query_vector, cleaner.raw)
+            yield _sse("final", {
+                "client_id": req.client_id,
+                "mode": req.mode,
+                "provider": LLM_PROVIDER,
+                "response": response,
+            })
+        except Exception as e:
+            trace.outcome = "error"
+            logger.error(f"Erreur /api/chat/stream: {e}")
+            yield _sse("error", {"error": "Erreur serveur"})
+
+    async def close() -> None:
+        # Créneau et trace libérés même si le flux n'a jamais démarré (client parti avant le premier octet) ;
+        # le créneau seulement une fois la génération HF/ONNX arrêtée (client parti en cours de flux)
+        try:
+            if cached is None:
+                try:
+                    await handle.stop()
+                finally:
+                    GENERATION_LIMITER.release()
+        finally:
+            trace.finish()
+
+    return ClosingStreamingResponse(events(), on_close=close, media_type="text/event-stream",
+                                    headers={"Cache-Control": "no-cache"})
+
+
+async def answer_batch(pipeline: Pipeline, questions: List[str], max_parallel: int = BATCH_MAX_PARALLEL,
+                       trace: Optional[RequestTrace] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Réponses d'un lot dans l'ordre d'achèvement : {"index", "question", "response"} (ou "error").
+
+    Les questions identiques ne sont traitées qu'une fois. Les générations passent
+    par le limiteur global (au plus `max_parallel` à la fois pour ce lot) ; quand
+    la file est pleine, le lot patiente au lieu d'échouer.
+    """
+    positions: Dict[str, List[int]] = {}
+    for index, question in enumerate(questions):
+        positions.setdefault(question, []).append(index)
+    unique = list(positions)
+    # Spans et tokens du lot rattachés à `trace` (sans `yield` pendant que la trace est active)
+    active = (lambda: trace.activate()) if trace is not None else nullcontext
+    with active():
+        prepared = await pipeline.aprepare_many(unique)
+    parallel = asyncio.Semaphore(max(1, max_parallel))
+
+    async def run(question: str, prep) -> Tuple[str, Optional[str], Optional[str]]:
+        cached, prompt_text, query_vector = prep
+        if cached is not None:
+            return question, cached, None
+        try:
+            with active():
+                async with parallel:
+                    while True:
+                        try:
+                            async with GENERATION_LIMITER.slot():
+                                return question, await pipeline.agenerate(question, prompt_text, query_vector), None
+                        except ServerOverloaded:
+                            await asyncio.sleep(BATCH_RETRY_DELAY)
+        except Exception as e:
+            logger.error(f"Erreur lot ({pipeline.client_id}): {e}")
+            return question, None, "Erreur serveur"
+
+    tasks = [asyncio.create_task(run(q, prep)) for q, prep in zip(unique, prepared)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            question, response, error = await finished
+            for index in positions[question]:
+                item: Dict[str, Any] = {"index": index, "question": question}
+                if error is None:
+                    item["response"] = response
+                else:
+                    item["error"] = error
+                yield item
+    finally:
+        # Client déconnecté ou erreur : ne pas laisser de générations orphelines
+        for task in tasks:
+            task.cancel()
+
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+    client_id: str = "bms_ventouse"
+    mode: str = "main"  # "main" | "alt"
+    refresh: bool = False
+
+
+@app.post("/api/chat/batch")
+async def chat_batch(req: BatchRequest):
+    """Lot de questions -> NDJSON, une ligne par réponse dès qu'elle est prête (champ `index`)."""
+    if req.mode not in {"main", "alt"}:
+        return JSONResponse(status_code=400, content={"error": "mode invalide. Utilisez 'main' ou 'alt'."})
+    if len(req.questions) > BATCH_MAX_QUESTIONS:
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"Lot trop volumineux ({len(req.questions)} > {BATCH_MAX_QUESTIONS} questions)."},
+        )
+
+    if req.refresh:
+        PIPELINES.invalidate((req.mode, req.client_id))
+
+    try:
+        pipeline = await run_in_threadpool(get_pipeline, req.mode, req.client_id)
+    except FileNotFoundError:
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"Fichier client introuvable pour {req.client_id} en mode {req.mode}."},
+        )
     except Exception as e:
-        logger.error(f"Erreur /api/chat: {e}")
-        return {"error": "Erreur serveur"}
\ No newline at end of file
+        logger.error(f"Erreur /api/chat/batch: {e}")
+        return JSONResponse(status_code=500, content={"error": "Erreur serveur"})
+
+    async def lines():
+        # Une trace pour le lot (spans cumulés sur toutes les questions), portée par les tâches de answer_batch
+        trace = RequestTrace("batch", req.client_id, req.mode, JSON_REQUEST_LOGS)
+        try:
+            async for item in answer_batch(pipeline, req.questions, trace=trace):
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+            trace.outcome = "completed"
+        except Exception as e:
+            trace.outcome = "error"
+            logger.error(f"Erreur /api/chat/batch: {e}")
+            yield json.dumps({"error": "Erreur serveur"}) + "\n"
+        finally:
+            trace.finish()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+logger.info(f"server.app importé en {time.perf_counter() - _IMPORT_STARTED:.2f}s (provider {LLM_PROVIDER})")
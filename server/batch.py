@@ -0,0 +1,87 @@
+"""Réponses en lot depuis la ligne de commande (pré-génération des FAQ d'un client).
+
+Usage (depuis la racine du dépôt):
+    python -m server.batch questions.jsonl -o reponses.jsonl --client-id bms_ventouse --mode main
+    python -m server.batch clients/_template_questions_base.md -o reponses.jsonl
+
+Entrée : une question par ligne, en JSONL (`{"question": "...", ...}` — les autres champs
+sont recopiés dans la sortie — ou une simple chaîne JSON), ou un fichier Markdown dont les
+lignes « - ... » terminées par « ? » sont des questions (format des templates de `clients/`).
+Sortie : une ligne JSON par question, écrite dès que sa réponse est prête (ordre
+d'achèvement, champ `index` = position dans l'entrée). Même provider, modèles et
+variables d'environnement que le serveur (voir server/README.md).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List
+
+from server.app import BATCH_MAX_PARALLEL, answer_batch, get_pipeline
+
+logger = logging.getLogger("server.batch")
+
+
+def read_questions(path: str) -> List[Dict[str, Any]]:
+    items: List[Dict[str, Any]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".md"):
+            for line in f:
+                line = line.strip()
+                if line.startswith("- ") and line.endswith("?"):
+                    items.append({"question": line[2:].strip()})
+            return items
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            if not isinstance(item, dict) or not isinstance(item.get("question"), str):
+                raise ValueError(f"{path}:{number}: champ \"question\" manquant")
+            items.append(item)
+    return items
+
+
+async def run(items: List[Dict[str, Any]], out, client_id: str, mode: str, max_parallel: int) -> int:
+    pipeline = await asyncio.to_thread(get_pipeline, mode, client_id)
+    started = time.perf_counter()
+    done = errors = 0
+    async for result in answer_batch(pipeline, [item["question"] for item in items], max_parallel):
+        record = {**items[result["index"]], **result}
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        done += 1
+        errors += "error" in result
+        if done % 50 == 0:
+            logger.info(f"{done}/{len(items)} réponses ({done / (time.perf_counter() - started):.1f}/s)")
+    elapsed = time.perf_counter() - started
+    logger.info(f"✅ {done} réponses en {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f}/s), {errors} erreur(s)")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="questions (JSONL, ou Markdown « - question ? »)")
+    parser.add_argument("-o", "--output", default="-", help="fichier JSONL de sortie (défaut: stdout)")
+    parser.add_argument("--client-id", default="bms_ventouse")
+    parser.add_argument("--mode", choices=["main", "alt"], default="main")
+    parser.add_argument("--max-parallel", type=int, default=BATCH_MAX_PARALLEL,
+                        help="générations simultanées (défaut: BATCH_MAX_PARALLEL)")
+    args = parser.parse_args()
+
+    items = read_questions(args.input)
+    logger.info(f"{len(items)} questions lues depuis {args.input}")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        errors = asyncio.run(run(items, out, args.client_id, args.mode, args.max_parallel))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Regroupe les appels concurrents en lots traités par un thread unique.
+
+    Le premier élément arrivé ouvre une fenêtre de `max_wait_ms` pendant laquelle
+    les suivants sont ajoutés au lot (jusqu'à `max_batch_size`) ; les éléments déjà
+    en file à la fin de la fenêtre y sont ajoutés aussi (avec `max_wait_ms=0`, un lot
+    regroupe ce qui est arrivé pendant le traitement du précédent, sans attente
+    ajoutée). `fn` reçoit la liste des éléments et doit renvoyer la liste des
+    résultats dans le même ordre ; un résultat qui est une exception n'échoue que
+    l'appelant concerné (une exception levée par `fn` échoue tout le lot).
+    Chaque appelant récupère son résultat via un concurrent.futures.Future.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 4,
+                 max_wait_ms: float = 5.0, name: str = "micro-batcher"):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.items = 0
+        self.name = name
+        self._start()
+
+    def _start(self) -> None:
+        self._pid = os.getpid()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        if self._pid != os.getpid():
+            # Processus forké (server.serve) : le thread du parent n'existe pas ici
+            self._start()
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self) -> List[Any]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = [(item, fut) for item, fut in self._collect() if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                logger.error(f"Erreur traitement du lot ({len(batch)} éléments): {e}")
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, fut), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    fut.set_exception(result)
+                else:
+                    fut.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
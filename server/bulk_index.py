@@ -0,0 +1,205 @@
+"""Indexation en masse de tous les clients (main : `clients/`, alt : `rag_alt/clients/`).
+
+Usage (depuis la racine du dépôt):
+    python -m server.bulk_index                          # tous les clients, main + alt
+    python -m server.bulk_index --mode main --clients bms_ventouse bms_logistique
+    python -m server.bulk_index --force --workers 8 --batch-size 512
+
+Les collections sont écrites exactement comme le serveur les ouvre (`CHROMA_DIR_MAIN` /
+`CHROMA_DIR_ALT`, `VECTOR_BACKEND`, `fingerprint.json`, même provider d'embeddings et même cache disque) :
+après ce passage, le serveur charge chaque client sans aucun calcul d'embedding.
+
+1. Préparation des documents (parsing, découpage, identifiants stables) en parallèle,
+   un processus par cœur ;
+2. embeddings de tous les nouveaux textes, tous clients confondus, par grands lots via un
+   seul modèle partagé (textes identiques entre clients embeddés une fois) ;
+3. écriture de chaque collection (ajouts + suppressions) et de son empreinte.
+
+Un client dont l'empreinte est à jour est ignoré (sauf `--force`). Les dossiers commençant
+par `_` (templates) sont ignorés.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+from rag_core.vector_index import MemmapVectorStore
+from server.app import (
+    LLM_PROVIDER,
+    EMBED_CACHE,
+    build_documents,
+    build_embeddings,
+    client_data_path,
+    index_fingerprint,
+    indexer_module,
+    logger,
+    open_collection,
+    read_fingerprint,
+    write_fingerprint,
+)
+
+# Chroma limite la taille d'un ajout (~5000 selon la version)
+_WRITE_BATCH = 1000
+
+Tenant = Tuple[str, str]  # (mode, client_id)
+
+
+def write_vectors(store, docs_by_id: Dict[str, Any], new_ids: List[str], stale_ids: List[str],
+                  vectors: Dict[str, List[float]]) -> None:
+    """Suppressions puis ajouts avec les vecteurs déjà calculés (Chroma par lots, memmap en une réécriture)."""
+    if isinstance(store, MemmapVectorStore):
+        store.delete(ids=stale_ids)
+        docs = [docs_by_id[d] for d in new_ids]
+        store.add_embeddings(new_ids, [vectors[d.page_content] for d in docs], [d.page_content for d in docs],
+                             [d.metadata for d in docs])
+        return
+    collection = store._collection
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+    for i in range(0, len(new_ids), _WRITE_BATCH):
+        ids = new_ids[i:i + _WRITE_BATCH]
+        docs = [docs_by_id[d] for d in ids]
+        collection.upsert(
+            ids=ids,
+            embeddings=[vectors[d.page_content] for d in docs],
+            documents=[d.page_content for d in docs],
+            metadatas=[d.metadata or None for d in docs],
+        )
+
+
+def discover_tenants(modes: List[str], only: Optional[List[str]] = None) -> List[Tenant]:
+    tenants = []
+    for mode in modes:
+        pattern = os.path.dirname(client_data_path(mode, "*")) + "/data.json"
+        for path in sorted(glob.glob(pattern)):
+            client_id = os.path.basename(os.path.dirname(path))
+            if client_id.startswith("_") or (only and client_id not in only):
+                continue
+            tenants.append((mode, client_id))
+    return tenants
+
+
+def prepare_tenant(tenant: Tenant) -> Tuple[Tenant, Dict[str, Any], float]:
+    """Exécuté dans un processus de travail : documents du client indexés par identifiant stable."""
+    started = time.perf_counter()
+    mode, client_id = tenant
+    module = indexer_module(mode)
+    docs_by_id: Dict[str, Any] = {}
+    for doc in build_documents(mode, client_data_path(mode, client_id)):
+        docs_by_id.setdefault(module.compute_document_id(doc), doc)
+    return tenant, docs_by_id, time.perf_counter() - started
+
+
+def embed_all(emb, texts: List[str], batch_size: int, workers: int) -> Dict[str, List[float]]:
+    """Texte -> vecteur, par lots de `batch_size` (lots envoyés en parallèle si `workers` > 1)."""
+    unique = list(dict.fromkeys(texts))
+    batches = [unique[i:i + batch_size] for i in range(0, len(unique), batch_size)]
+    vectors: Dict[str, List[float]] = {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(emb.embed_documents, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            vectors.update(zip(futures[future], future.result()))
+            elapsed = time.perf_counter() - started
+            logger.info(f"Embeddings: {len(vectors)}/{len(unique)} textes ({len(vectors) / max(elapsed, 1e-9):.0f}/s)")
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["main", "alt", "all"], default="all")
+    parser.add_argument("--clients", nargs="*", help="client_id à indexer (défaut: tous)")
+    parser.add_argument("--force", action="store_true", help="ré-indexe même si l'empreinte est à jour")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processus de préparation des documents (défaut: nombre de cœurs)")
+    parser.add_argument("--batch-size", type=int, default=256, help="textes par appel d'embeddings")
+    parser.add_argument("--embed-workers", type=int, default=1 if LLM_PROVIDER == "HF" else 4,
+                        help="lots d'embeddings simultanés (HF: 1, le modèle utilise déjà tous les cœurs)")
+    args = parser.parse_args()
+
+    total_started = time.perf_counter()
+    modes = ["main", "alt"] if args.mode == "all" else [args.mode]
+    tenants = discover_tenants(modes, args.clients)
+    if not tenants:
+        logger.error("Aucun client trouvé")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    emb = build_embeddings()
+    load_seconds = time.perf_counter() - started
+    logger.info(f"Modèle d'embeddings chargé en {load_seconds:.1f}s")
+
+    fingerprints = {t: index_fingerprint(*t, emb) for t in tenants}
+    stored = {t: read_fingerprint(*t) for t in tenants}
+    todo = [t for t in tenants if args.force or stored[t] != fingerprints[t]]
+    logger.info(f"{len(tenants)} clients trouvés, {len(todo)} à indexer")
+
+    # 1. Préparation en parallèle (processus)
+    started = time.perf_counter()
+    workers = max(1, min(args.workers, len(todo)))
+    prepared: Dict[Tenant, Dict[str, Any]] = {}
+    prep_seconds: Dict[Tenant, float] = {}
+    failed: Dict[Tenant, str] = {}
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(prepare_tenant, t): t for t in todo}
+            for future in as_completed(futures):
+                tenant = futures[future]
+                try:
+                    _, prepared[tenant], prep_seconds[tenant] = future.result()
+                except Exception as e:
+                    failed[tenant] = str(e)
+                    logger.error(f"❌ Préparation {tenant[0]}:{tenant[1]}: {e}")
+                    continue
+                logger.info(f"[{len(prepared) + len(failed)}/{len(todo)}] {tenant[0]}:{tenant[1]} — "
+                            f"{len(prepared[tenant])} documents ({prep_seconds[tenant]:.2f}s)")
+    prep_wall = time.perf_counter() - started
+
+    # 2. Ouverture des collections, calcul des ajouts/suppressions, embeddings groupés
+    started = time.perf_counter()
+    stores, plans = {}, {}
+    for tenant, docs_by_id in prepared.items():
+        stores[tenant] = open_collection(*tenant, emb, stored[tenant], fingerprints[tenant])
+        existing = set(stores[tenant].get(include=[])["ids"])
+        # --force : tout est réécrit (vecteurs issus du cache disque si le texte est déjà connu)
+        new_ids = list(docs_by_id) if args.force else [i for i in docs_by_id if i not in existing]
+        plans[tenant] = (new_ids, sorted(existing - docs_by_id.keys()))
+    open_wall = time.perf_counter() - started
+    started = time.perf_counter()
+    texts = [prepared[t][i].page_content for t, (new_ids, _) in plans.items() for i in new_ids]
+    vectors = embed_all(emb, texts, args.batch_size, args.embed_workers)
+    embed_wall = time.perf_counter() - started
+
+    # 3. Écriture des collections et des empreintes
+    started = time.perf_counter()
+    summary = []
+    for tenant, (new_ids, stale_ids) in plans.items():
+        try:
+            write_vectors(stores[tenant], prepared[tenant], new_ids, stale_ids, vectors)
+            write_fingerprint(*tenant, fingerprints[tenant])
+        except Exception as e:
+            failed[tenant] = str(e)
+            logger.error(f"❌ Écriture {tenant[0]}:{tenant[1]}: {e}")
+            continue
+        summary.append((tenant, len(prepared[tenant]), len(new_ids), len(stale_ids), prep_seconds[tenant]))
+    write_wall = time.perf_counter() - started
+
+    print(f"\n{'client':<36} {'documents':>9} {'écrits':>7} {'supprimés':>9} {'prépa (s)':>9}")
+    for (mode, client_id), count, added, deleted, seconds in sorted(summary):
+        print(f"{mode + ':' + client_id:<36} {count:>9} {added:>7} {deleted:>9} {seconds:>9.2f}")
+    for mode, client_id in sorted(failed):
+        print(f"{mode + ':' + client_id:<36} ÉCHEC: {failed[(mode, client_id)]}")
+    print(f"\n{len(summary)} indexés, {len(tenants) - len(todo)} à jour, {len(failed)} en échec")
+    print(f"Modèle {load_seconds:.1f}s | préparation {prep_wall:.1f}s ({workers} processus) | "
+          f"ouverture {open_wall:.1f}s | embeddings {embed_wall:.1f}s ({len(vectors)} textes) | écriture {write_wall:.1f}s | "
+          f"total {time.perf_counter() - total_started:.1f}s")
+    if EMBED_CACHE is not None:
+        print(f"Cache embeddings: {EMBED_CACHE.stats()}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class ServerOverloaded(Exception):
+    """Levée quand la file d'attente des générations est pleine (-> HTTP 429)."""
+
+
+class ConcurrencyLimiter:
+    """Limite le nombre de générations simultanées et la profondeur de la file d'attente.
+
+    Au plus `max_concurrent` requêtes s'exécutent en même temps, `max_queue`
+    autres peuvent attendre un créneau ; au-delà, `slot()` lève ServerOverloaded
+    immédiatement au lieu de laisser la latence exploser.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def acquire(self) -> None:
+        if self.active >= self.max_concurrent and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise ServerOverloaded()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self) -> None:
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+        }
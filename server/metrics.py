@@ -0,0 +1,303 @@
+"""Instrumentation du chemin des requêtes : spans par étape, compteurs, export Prometheus.
+
+Une requête ouvre une `RequestTrace` (portée par un ContextVar, donc propagée aux
+threads lancés par `asyncio.to_thread` / `run_in_threadpool`) ; chaque étape du
+pipeline s'exécute dans `span("nom")`, qui alimente l'histogramme
+`rag_stage_seconds{stage}` et la trace de la requête. Sans trace active (CLI,
+préchauffage), seuls les histogrammes sont alimentés.
+
+Pas de dépendance : `MetricsRegistry.render()` produit le format texte
+d'exposition Prometheus (0.0.4). Les valeurs calculées à la demande (taux de hit
+des caches, créneaux de génération...) sont fournies par des collecteurs appelés
+à chaque lecture.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Secondes : de la milliseconde (cache, recherche) à la minute (génération CPU)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation du nombre de tokens (mots + ponctuation) quand le provider ne le fournit pas."""
+    return len(_TOKEN.findall(text)) if text else 0
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_format_labels(k)} {v:g}" for k, v in sorted(self._values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [compteurs par bucket (non cumulés), somme, nombre]
+        self._series: Dict[Labels, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def _get_series(self, key: Labels) -> List[Any]:
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            return series
+
+    def observe(self, value: float, **labels: str) -> None:
+        self._observe(self._get_series(_labels(labels)), value)
+
+    def _observe(self, series: List[Any], value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def labels(self, **labels: str) -> Callable[[float], None]:
+        """-> observe(valeur) pour une série fixée (évite de résoudre les labels à chaque mesure)."""
+        series = self._get_series(_labels(labels))
+        return lambda value: self._observe(series, value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', f'{bound:g}')])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+# Collecteur : -> [(nom, type, aide, [(labels, valeur)])], appelé à chaque lecture de /metrics
+Collector = Callable[[], Iterable[Tuple[str, str, str, Iterable[Tuple[Dict[str, str], float]]]]]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_format_labels(_labels(labels))} {value:g}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("rag_stage_seconds", "Durée de chaque étape du pipeline RAG")
+REQUEST_SECONDS = REGISTRY.histogram("rag_request_seconds", "Durée totale des requêtes par endpoint et issue")
+REQUESTS = REGISTRY.counter("rag_requests_total", "Requêtes par client, endpoint et issue")
+PROMPT_TOKENS = REGISTRY.counter("rag_prompt_tokens_total", "Tokens des prompts envoyés au LLM")
+COMPLETION_TOKENS = REGISTRY.counter("rag_completion_tokens_total", "Tokens générés par le LLM")
+PROMPT_SIZE = REGISTRY.histogram(
+    "rag_prompt_size_tokens", "Taille des prompts construits (tokenizer du LLM actif)",
+    buckets=(64, 128, 256, 384, 512, 768, 1024, 1536, 2048, 4096),
+)
+PREFILL_TOKENS = REGISTRY.counter(
+    "rag_prefill_tokens_total", "Tokens de prompt évalués (kind=evaluated) ou repris du cache du préfixe (kind=reused)"
+)
+PREFILL_SAVED_SECONDS = REGISTRY.counter(
+    "rag_prefill_saved_seconds_total", "Prefill évité par la réutilisation du préfixe (estimation au coût par token mesuré)"
+)
+PIPELINE_BUILD_SECONDS = REGISTRY.histogram(
+    "rag_pipeline_build_seconds", "Temps de construction des pipelines (index, BM25, classifieur)"
+)
+
+# Étiquette client tant que le pipeline n'est pas résolu : un client_id inconnu ne crée pas de série
+UNKNOWN_CLIENT = "_inconnu"
+
+_CURRENT: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar("rag_trace", default=None)
+_request_logger = logging.getLogger("server.requests")
+
+
+class RequestTrace:
+    """Spans, tokens et issue d'une requête ; `finish()` publie les métriques et le log JSON."""
+
+    def __init__(self, endpoint: str, client_id: str = "", mode: str = "", json_log: bool = False):
+        self.endpoint = endpoint
+        self.client_id = client_id
+        self.mode = mode
+        self.json_log = json_log
+        self.outcome = "generated"
+        self.spans: Dict[str, float] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.started = time.perf_counter()
+        self._token: Optional[contextvars.Token] = None
+
+    @contextmanager
+    def activate(self) -> Iterator["RequestTrace"]:
+        """Trace courante le temps du bloc, sans la publier (réponses en flux : publication à la fin du flux)."""
+        token = _CURRENT.set(self)
+        try:
+            yield self
+        finally:
+            _CURRENT.reset(token)
+
+    def __enter__(self) -> "RequestTrace":
+        self._token = _CURRENT.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _CURRENT.reset(self._token)
+        if exc_type is not None:
+            self.outcome = "error"
+        self.finish()
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def add_tokens(self, prompt: int, completion: int) -> None:
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+
+    def finish(self) -> None:
+        total = time.perf_counter() - self.started
+        REQUEST_SECONDS.observe(total, endpoint=self.endpoint, outcome=self.outcome)
+        REQUESTS.inc(client_id=self.client_id, mode=self.mode, endpoint=self.endpoint, outcome=self.outcome)
+        if self.json_log:
+            _request_logger.info(json.dumps({
+                "ts": round(time.time(), 3),
+                "endpoint": self.endpoint,
+                "client_id": self.client_id,
+                "mode": self.mode,
+                "outcome": self.outcome,
+                "total_ms": round(total * 1000, 2),
+                "spans_ms": {k: round(v * 1000, 2) for k, v in self.spans.items()},
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }, ensure_ascii=False))
+
+
+def enable_json_logs(stream=None) -> None:
+    """Lignes JSON brutes (sans préfixe de log) sur la sortie d'erreur, pour l'agrégateur de logs."""
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _request_logger.addHandler(handler)
+    _request_logger.setLevel(logging.INFO)
+    _request_logger.propagate = False
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _CURRENT.get()
+
+
+def set_outcome(outcome: str) -> None:
+    trace = _CURRENT.get()
+    if trace is not None:
+        trace.outcome = outcome
+
+
+_STAGE_OBSERVERS: Dict[str, Callable[[float], None]] = {}
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    observe = _STAGE_OBSERVERS.get(stage)
+    if observe is None:
+        observe = _STAGE_OBSERVERS.setdefault(stage, STAGE_SECONDS.labels(stage=stage))
+    observe(seconds)
+    trace = _CURRENT.get()
+    if trace is not None:
+        trace.record(stage, seconds)
+
+
+class span:
+    """Chronomètre une étape (`with span("vector_search"):`) : histogramme global + trace en cours."""
+
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> "span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        record_stage(self.stage, time.perf_counter() - self.started)
+
+
+def record_tokens(prompt_text: str, raw: Any, completion_text: str,
+                  count: Callable[[str], int] = estimate_tokens) -> None:
+    """Tokens du prompt et de la réponse : usage renvoyé par le provider, sinon `count` (tokenizer du modèle)."""
+    usage = getattr(raw, "usage_metadata", None) or {}
+    prompt = usage.get("input_tokens") or count(prompt_text)
+    completion = usage.get("output_tokens") or count(completion_text)
+    PROMPT_TOKENS.inc(prompt)
+    COMPLETION_TOKENS.inc(completion)
+    trace = _CURRENT.get()
+    if trace is not None:
+        trace.add_tokens(prompt, completion)
+
+
+def record_prefill(seconds: float, evaluated_tokens: int, reused_tokens: int = 0) -> None:
+    """Prefill d'une génération (span `prefill`) ; le temps économisé est estimé au coût par token évalué."""
+    record_stage("prefill", seconds)
+    PREFILL_TOKENS.inc(evaluated_tokens, kind="evaluated")
+    if reused_tokens:
+        PREFILL_TOKENS.inc(reused_tokens, kind="reused")
+        if evaluated_tokens:
+            PREFILL_SAVED_SECONDS.inc(seconds / evaluated_tokens * reused_tokens)
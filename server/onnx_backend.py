@@ -0,0 +1,289 @@
+"""Backend ONNX Runtime (int8) des modèles HF locaux : FLAN-T5 (génération) et MiniLM (embeddings).
+
+Usage (export anticipé, par exemple dans la commande de build):
+    HF_BACKEND=onnx python -m server.onnx_backend
+
+Avec HF_BACKEND=onnx, chaque modèle est exporté en ONNX au premier chargement (optimum et torch
+ne sont nécessaires que pour cet export), quantifié en int8 dynamique (poids int8, activations
+quantifiées à la volée : `onnxruntime.quantization.quantize_dynamic`) puis mis en cache dans
+ONNX_CACHE_DIR. Ensuite seuls onnxruntime, tokenizers et NumPy sont utilisés : ni torch ni
+transformers ne sont importés par le serveur.
+
+- Génération (encodeur-décodeur) : encodeur une fois, décodeur avec cache clés/valeurs
+  (`decoder_with_past_model.onnx`), glouton ou échantillonnage top-p, par lots paddés.
+- Embeddings : mean pooling + normalisation L2 (comme sentence-transformers pour all-MiniLM-L6-v2).
+Les sessions sont ouvertes à la première utilisation dans chaque processus : le pool de
+threads d'onnxruntime ne survit pas à fork() (server.serve).
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+from server.metrics import record_prefill
+
+logger = logging.getLogger(__name__)
+
+TASK_TEXT2TEXT = "text2text-generation-with-past"
+TASK_EMBEDDINGS = "feature-extraction"
+# Fichiers produits par l'export optimum (décodeurs non fusionnés : no_post_process)
+_ONNX_FILES = {
+    TASK_TEXT2TEXT: ("encoder_model.onnx", "decoder_model.onnx", "decoder_with_past_model.onnx"),
+    TASK_EMBEDDINGS: ("model.onnx",),
+}
+_COPIED_FILES = ("config.json", "generation_config.json", "tokenizer.json")
+_MARKER = "export.json"
+
+
+def onnx_model_dir(model_id: str, task: str, cache_dir: str, quantize: bool = True) -> str:
+    """Répertoire du modèle exporté (et quantifié) ; export au premier appel."""
+    target = os.path.join(cache_dir, model_id.replace("/", "--"), "int8" if quantize else "fp32")
+    if not os.path.exists(os.path.join(target, _MARKER)):
+        export_model(model_id, task, target, quantize)
+    return target
+
+
+def export_model(model_id: str, task: str, target: str, quantize: bool = True) -> None:
+    try:
+        from optimum.exporters.onnx import main_export
+    except ImportError:
+        raise RuntimeError(
+            f"HF_BACKEND=onnx : export de {model_id} impossible sans optimum (pip install optimum[exporters]) ; "
+            f"exportez-le une fois avec `python -m server.onnx_backend` ou copiez l'export dans {target}"
+        )
+    started = time.perf_counter()
+    logger.info(f"Export ONNX de {model_id} ({task}{', int8' if quantize else ''})...")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Export dans un répertoire temporaire voisin puis renommage : jamais de modèle à moitié écrit
+    work = tempfile.mkdtemp(prefix=".export-", dir=os.path.dirname(target))
+    try:
+        raw, output = os.path.join(work, "raw"), os.path.join(work, "model")
+        main_export(model_id, output=raw, task=task, no_post_process=True)
+        os.makedirs(output)
+        for name in _ONNX_FILES[task]:
+            if quantize:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+
+                quantize_dynamic(os.path.join(raw, name), os.path.join(output, name), weight_type=QuantType.QInt8)
+            else:
+                shutil.copy(os.path.join(raw, name), os.path.join(output, name))
+        for name in _COPIED_FILES:
+            if os.path.exists(os.path.join(raw, name)):
+                shutil.copy(os.path.join(raw, name), os.path.join(output, name))
+        with open(os.path.join(output, _MARKER), "w", encoding="utf-8") as f:
+            json.dump({"model": model_id, "task": task, "quantize": quantize}, f)
+        try:
+            os.replace(output, target)
+        except OSError:
+            # Export concurrent (autre processus) déjà en place
+            if not os.path.exists(os.path.join(target, _MARKER)):
+                raise
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    size = sum(os.path.getsize(os.path.join(target, name)) for name in _ONNX_FILES[task])
+    logger.info(f"Export ONNX de {model_id} : {size / 1e6:.0f} Mo en {time.perf_counter() - started:.0f}s")
+
+
+def _read_json(directory: str, name: str) -> Dict[str, Any]:
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_tokenizer(directory: str):
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+    tokenizer.no_padding()
+    tokenizer.no_truncation()
+    return tokenizer
+
+
+def _pad(sequences: List[List[int]], pad_id: int):
+    """-> (ids, masque d'attention) int64, paddés à droite."""
+    width = max(1, max(len(s) for s in sequences))
+    ids = np.full((len(sequences), width), pad_id, dtype=np.int64)
+    mask = np.zeros((len(sequences), width), dtype=np.int64)
+    for row, sequence in enumerate(sequences):
+        ids[row, :len(sequence)] = sequence
+        mask[row, :len(sequence)] = 1
+    return ids, mask
+
+
+class _Sessions:
+    """Sessions ONNX Runtime d'un répertoire, ouvertes à la première utilisation dans chaque processus."""
+
+    def __init__(self, directory: str, threads: int = 0):
+        self.directory = directory
+        self.threads = threads
+        self._pid: Optional[int] = None
+        self._sessions: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        if self._pid != os.getpid():
+            self._pid, self._sessions, self._lock = os.getpid(), {}, threading.Lock()
+        session = self._sessions.get(name)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(name)
+                if session is None:
+                    import onnxruntime as ort
+
+                    options = ort.SessionOptions()
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    if self.threads:
+                        options.intra_op_num_threads = self.threads
+                    session = ort.InferenceSession(os.path.join(self.directory, name), options,
+                                                   providers=["CPUExecutionProvider"])
+                    self._sessions[name] = session
+        return session
+
+
+class OnnxEmbeddings(Embeddings):
+    """Embeddings de phrases (modèle exporté en `feature-extraction`) : mean pooling puis normalisation L2."""
+
+    def __init__(self, model_id: str, directory: str, threads: int = 0, max_length: int = 256,
+                 batch_size: int = 32, normalize: bool = True):
+        # Le nom du modèle entre dans l'empreinte des index et dans la clé du cache d'embeddings
+        self.model = f"{model_id}:onnx-{os.path.basename(directory)}"
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.tokenizer = _load_tokenizer(directory)
+        self.tokenizer.enable_truncation(max_length)
+        self.pad_id = _read_json(directory, "config.json").get("pad_token_id") or 0
+        self.sessions = _Sessions(directory, threads)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        session = self.sessions.get("model.onnx")
+        inputs = {i.name for i in session.get_inputs()}
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            # Comme HuggingFaceEmbeddings : retours à la ligne remplacés par des espaces
+            encodings = self.tokenizer.encode_batch([t.replace("\n", " ") for t in texts[start:start + self.batch_size]])
+            ids, mask = _pad([e.ids for e in encodings], self.pad_id)
+            feeds = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in inputs:
+                feeds["token_type_ids"] = np.zeros_like(ids)
+            hidden = session.run(None, feeds)[0]
+            weights = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+            if self.normalize:
+                pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class OnnxSeq2SeqLM:
+    """Modèle encodeur-décodeur (FLAN-T5) exporté en `text2text-generation-with-past`."""
+
+    def __init__(self, directory: str, threads: int = 0, max_input_tokens: int = 512, seed: Optional[int] = None):
+        config = {**_read_json(directory, "config.json"), **_read_json(directory, "generation_config.json")}
+        if not config.get("is_encoder_decoder", True):
+            raise RuntimeError("HF_BACKEND=onnx : seuls les modèles encodeur-décodeur (flan-t5) sont pris en charge")
+        self.pad_token_id = config.get("pad_token_id") or 0
+        self.eos_token_id = config.get("eos_token_id", 1)
+        self.decoder_start_token_id = config.get("decoder_start_token_id", self.pad_token_id)
+        self.max_input_tokens = max_input_tokens
+        self.tokenizer = _load_tokenizer(directory)
+        self.sessions = _Sessions(directory, threads)
+        self._rng = np.random.default_rng(seed)
+
+    def _encode(self, prompts: List[str]):
+        sequences = []
+        for encoding in self.tokenizer.encode_batch(prompts):
+            ids = encoding.ids
+            if len(ids) > self.max_input_tokens:
+                # Même troncature que la pipeline transformers (fin de séquence conservée)
+                ids = ids[:self.max_input_tokens - 1] + [self.eos_token_id]
+            sequences.append(ids)
+        return _pad(sequences, self.pad_token_id)
+
+    def _next_tokens(self, logits: np.ndarray, do_sample: bool, temperature: float, top_p: float) -> np.ndarray:
+        if not do_sample:
+            return logits.argmax(axis=-1)
+        logits = logits / max(temperature, 1e-5)
+        probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        probs /= probs.sum(axis=-1, keepdims=True)
+        order = np.argsort(-probs, axis=-1)
+        sorted_probs = np.take_along_axis(probs, order, axis=-1)
+        # Noyau top-p : plus petit ensemble de tokens dont la probabilité cumulée atteint top_p
+        keep = np.cumsum(sorted_probs, axis=-1) - sorted_probs < top_p
+        sorted_probs = sorted_probs * keep
+        cumulative = np.cumsum(sorted_probs, axis=-1) / sorted_probs.sum(axis=-1, keepdims=True)
+        draws = self._rng.random((len(logits), 1))
+        index = np.minimum((cumulative < draws).sum(axis=-1), keep.sum(axis=-1) - 1)
+        return order[np.arange(len(logits)), index]
+
+    def _run_decoder(self, session, values: Dict[str, np.ndarray], past: Dict[str, np.ndarray]):
+        feeds = {}
+        for node in session.get_inputs():
+            if node.name in values:
+                feeds[node.name] = values[node.name]
+            else:  # past_key_values.<i>.<decoder|encoder>.<key|value> <- present.<i>...
+                feeds[node.name] = past["present" + node.name[len("past_key_values"):]]
+        outputs = session.run(None, feeds)
+        names = [node.name for node in session.get_outputs()]
+        return outputs[0][:, -1, :], dict(zip(names[1:], outputs[1:]))
+
+    def generate(self, prompts: List[str], max_new_tokens: int = 200, do_sample: bool = False,
+                 temperature: float = 1.0, top_p: float = 1.0,
+                 on_text: Optional[Callable[[str], None]] = None,
+                 should_stop: Optional[Callable[[], bool]] = None) -> List[str]:
+        """Textes générés ; `on_text` reçoit le texte du premier prompt à chaque token (streaming).
+
+        `should_stop` : consulté avant chaque pas de décodage, vrai = arrêt (client parti)."""
+        started = time.perf_counter()
+        ids, mask = self._encode(prompts)
+        hidden = self.sessions.get("encoder_model.onnx").run(None, {"input_ids": ids, "attention_mask": mask})[0]
+        values = {"encoder_attention_mask": mask, "encoder_hidden_states": hidden}
+        tokens = np.full((len(prompts), 1), self.decoder_start_token_id, dtype=np.int64)
+        generated: List[List[int]] = [[] for _ in prompts]
+        done = np.zeros(len(prompts), dtype=bool)
+        past: Dict[str, np.ndarray] = {}
+        for step in range(max_new_tokens):
+            if should_stop is not None and should_stop():
+                break
+            # 1er pas : décodeur complet (clés/valeurs croisées calculées) ; ensuite avec cache
+            session = self.sessions.get("decoder_with_past_model.onnx" if past else "decoder_model.onnx")
+            logits, presents = self._run_decoder(session, {**values, "input_ids": tokens}, past)
+            past.update(presents)
+            next_tokens = np.where(done, self.pad_token_id, self._next_tokens(logits, do_sample, temperature, top_p))
+            if step == 0:
+                record_prefill(time.perf_counter() - started, int(mask.sum()))
+            for row in np.flatnonzero(~done):
+                if next_tokens[row] != self.eos_token_id:
+                    generated[row].append(int(next_tokens[row]))
+            done |= next_tokens == self.eos_token_id
+            if on_text is not None:
+                on_text(self.tokenizer.decode(generated[0], skip_special_tokens=True))
+            if done.all():
+                break
+            tokens = next_tokens[:, None].astype(np.int64)
+        return self.tokenizer.decode_batch(generated, skip_special_tokens=True)
+
+
+def main() -> None:
+    """Export (et quantification) des modèles HF configurés, sans démarrer le serveur."""
+    from server.app import HF_EMBED_MODEL, HF_LLM_MODEL, ONNX_CACHE_DIR, ONNX_QUANTIZE
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    for model_id, task in ((HF_LLM_MODEL, TASK_TEXT2TEXT), (HF_EMBED_MODEL, TASK_EMBEDDINGS)):
+        print(onnx_model_dir(model_id, task, ONNX_CACHE_DIR, ONNX_QUANTIZE))
+
+
+if __name__ == "__main__":
+    main()
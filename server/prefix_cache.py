@@ -0,0 +1,53 @@
+"""Préfixes statiques des prompts (un par client) et état précalculé associé.
+
+Le prompt d'une pipeline commence par un préfixe identique d'une requête à l'autre
+(`Pipeline.prompt_prefix` : en-tête + consignes du client), suivi de la partie variable
+(contexte, question, scénario). Un backend capable de réutiliser le calcul de ce préfixe
+(past-key-values d'un modèle décodeur seul) l'enregistre ici ; à chaque génération,
+`split` retrouve le préfixe en tête du prompt et `state` fournit son état, calculé une
+seule fois. Éviction LRU au-delà de `max_entries` préfixes (pipelines évincées).
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+
+class PrefixRegistry:
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()  # préfixe -> état (None = pas encore calculé)
+        self._lock = threading.Lock()
+
+    def register(self, prefix: str) -> None:
+        with self._lock:
+            self._entries.setdefault(prefix, None)
+            self._entries.move_to_end(prefix)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def split(self, prompt: str) -> Tuple[Optional[str], str]:
+        """-> (préfixe enregistré en tête du prompt, reste), ou (None, prompt)."""
+        with self._lock:
+            for prefix in reversed(self._entries):
+                if prompt.startswith(prefix):
+                    self._entries.move_to_end(prefix)
+                    self.hits += 1
+                    return prefix, prompt[len(prefix):]
+            self.misses += 1
+        return None, prompt
+
+    def state(self, prefix: str, compute: Callable[[str], Any]) -> Any:
+        """État du préfixe, calculé au premier appel (appelé depuis le thread de génération)."""
+        with self._lock:
+            state = self._entries.get(prefix)
+        if state is None:
+            state = compute(prefix)
+            with self._lock:
+                if prefix in self._entries:
+                    self._entries[prefix] = state
+        return state
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineRegistry:
+    """Registre borné des pipelines construites, partagé entre threads.
+
+    - single-flight : des requêtes concurrentes sur une même clé attendent la
+      construction en cours au lieu de la relancer ;
+    - éviction LRU au-delà de `max_entries` ou du budget mémoire `max_bytes`
+      (taille estimée par `size_fn`, 0 = pas de budget) ;
+    - compteurs : constructions, échecs, temps de construction, évictions, hits/misses.
+    """
+
+    def __init__(self, builder: Callable[[Hashable], Any], max_entries: int = 32, max_bytes: int = 0,
+                 size_fn: Optional[Callable[[Any], int]] = None):
+        self.builder = builder
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn or (lambda value: 0)
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.build_failures = 0
+        self.build_seconds_total = 0.0
+        self.last_build_seconds = 0.0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._building: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, is_stale: Optional[Callable[[Any], bool]] = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not (is_stale and is_stale(entry[0])):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            future = self._building.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = Future()
+                self._building[key] = future
+        if not owner:
+            return future.result()
+
+        started = time.perf_counter()
+        try:
+            value = self.builder(key)
+            size = self.size_fn(value)
+        except BaseException as e:
+            with self._lock:
+                self.build_failures += 1
+                del self._building[key]
+            future.set_exception(e)
+            raise
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._entries[key] = (value, size)
+            self._entries.move_to_end(key)
+            del self._building[key]
+            self.builds += 1
+            self.build_seconds_total += elapsed
+            self.last_build_seconds = elapsed
+            self._evict(protect=key)
+        logger.info(f"Pipeline {key} construite en {elapsed:.2f}s (~{size / 1e6:.1f} Mo)")
+        future.set_result(value)
+        return value
+
+    def _total_bytes(self) -> int:
+        return sum(size for _, size in self._entries.values())
+
+    def _evict(self, protect: Hashable) -> None:
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes and self._total_bytes() > self.max_bytes)
+        ):
+            oldest = next(iter(self._entries))
+            if oldest == protect:
+                break
+            del self._entries[oldest]
+            self.evictions += 1
+            logger.info(f"Pipeline {oldest} évincée (LRU)")
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Instantané des pipelines résidentes (clé, valeur), de la moins à la plus récemment utilisée."""
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "resident": len(self._entries),
+                "resident_bytes": self._total_bytes(),
+                "building": len(self._building),
+                "hits": self.hits,
+                "misses": self.misses,
+                "builds": self.builds,
+                "build_failures": self.build_failures,
+                "build_seconds_total": round(self.build_seconds_total, 3),
+                "last_build_seconds": round(self.last_build_seconds, 3),
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,190 @@
+"""Service multi-processus : modèles (et index) chargés une fois dans le parent, workers forkés.
+
+Usage (depuis la racine du dépôt):
+    python -m server.serve --workers 4 --port 8000
+    SERVE_WORKERS=4 PORT=8000 python -m server.serve
+
+`uvicorn server.app:app --workers N` importe server.app dans N processus indépendants :
+torch, FLAN-T5, MiniLM et les collections sont chargés N fois. Ici le parent importe
+server.app, charge les modèles (génération à blanc comprise), construit les pipelines des
+clients de WARMUP_TENANTS, gèle le ramasse-miettes (`gc.freeze()` : les objets préchargés ne
+sont plus parcourus, leurs pages ne sont pas recopiées) et ouvre le socket d'écoute ; chaque
+worker est un fork qui sert ce socket avec uvicorn. Poids des modèles, index BM25 et vecteurs
+memmap restent partagés en copy-on-write ; seuls les objets modifiés (compteurs, caches de
+réponses) sont recopiés page par page. Un worker qui meurt est reforké depuis le parent, déjà
+chargé : redémarrage immédiat. SIGTERM / SIGINT : arrêt des workers puis du parent.
+
+- Chroma (1.x, cœur Rust) ne survit pas à fork() : avec VECTOR_BACKEND=chroma, le parent ne
+  charge que les modèles ; les collections de WARMUP_TENANTS sont synchronisées dans un
+  processus jetable, puis chaque worker les ouvre au démarrage.
+  VECTOR_BACKEND=memmap permet de tout précharger.
+- torch est limité à 1 thread dans le parent (aucun pool OpenMP à hériter), puis à
+  SERVE_TORCH_THREADS threads par worker (défaut : cœurs / workers).
+- Caches de réponses, pipelines construites après le fork et /metrics sont propres à chaque worker.
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("server.serve")
+
+# Un worker mort moins de _RESPAWN_MIN_UPTIME s après son lancement est relancé après une pause
+_RESPAWN_MIN_UPTIME = 5.0
+_RESPAWN_DELAY = 1.0
+
+
+def set_torch_threads(count: int) -> None:
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(count)
+
+
+def preload(server_app, tenants: bool) -> None:
+    """Modèles (+ pipelines des clients listés si `tenants`) chargés avant le fork."""
+    started = time.perf_counter()
+    server_app.warm_up(tenants=tenants)
+    if server_app.READINESS["error"]:
+        raise RuntimeError(f"Préchargement impossible: {server_app.READINESS['error']}")
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Préchargé en {time.perf_counter() - started:.1f}s "
+                f"(modèles{' + ' + ', '.join(server_app.READINESS['tenants']) if tenants else ''})")
+
+
+def sync_indexes(server_app) -> None:
+    """Chroma : collections des clients listés créées / synchronisées dans un processus jetable.
+
+    Le parent ne doit pas ouvrir Chroma (non forkable) et des workers qui créent la même base
+    en même temps se gênent (migrations SQLite concurrentes) : ils n'ont plus qu'à l'ouvrir.
+    """
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            server_app.reinit_after_fork()
+            emb, _ = server_app.build_embeddings_and_llm()
+            for mode, client_id in server_app.parse_warmup_tenants(server_app.WARMUP_TENANTS):
+                server_app.open_vectorstore(mode, client_id, emb)
+        except BaseException as e:
+            logger.error(f"Synchronisation des index impossible: {e}")
+            status = 1
+        finally:
+            os._exit(status)
+    os.waitpid(pid, 0)
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(server_app, sock: socket.socket, slot: int, args) -> None:
+    """Corps d'un worker forké : ne retourne jamais."""
+    import uvicorn
+
+    status = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        set_torch_threads(args.torch_threads)
+        server_app.reinit_after_fork()
+        logger.info(f"Worker {slot} démarré (pid {os.getpid()})")
+        config = uvicorn.Config(server_app.app, log_level=args.log_level, access_log=False, lifespan="on")
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException as e:
+        logger.error(f"Worker {slot} arrêté sur erreur: {e}")
+        status = 1
+    finally:
+        # Pas de handlers atexit du parent dans l'enfant
+        os._exit(status)
+
+
+def supervise(server_app, sock: socket.socket, args) -> None:
+    children: Dict[int, int] = {}  # pid -> numéro du worker
+    started: Dict[int, float] = {}
+    stopping = {"signals": 0}
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            run_worker(server_app, sock, slot, args)
+        children[pid] = slot
+        started[slot] = time.monotonic()
+
+    def stop(signum, frame) -> None:
+        stopping["signals"] += 1
+        # Premier signal : arrêt propre (uvicorn termine les requêtes en cours) ; second : immédiat
+        sig = signal.SIGTERM if stopping["signals"] == 1 else signal.SIGKILL
+        for pid in list(children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(args.workers):
+        spawn(slot)
+    logger.info(f"{args.workers} workers sur http://{args.host}:{args.port} (parent pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is None or stopping["signals"]:
+            continue
+        logger.warning(f"Worker {slot} (pid {pid}) terminé (statut {status}), relance")
+        if time.monotonic() - started[slot] < _RESPAWN_MIN_UPTIME:
+            time.sleep(_RESPAWN_DELAY)
+        spawn(slot)
+    sock.close()
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--torch-threads", type=int, default=int(os.getenv("SERVE_TORCH_THREADS", "0")),
+                        help="threads torch par worker (0 : cœurs / workers)")
+    parser.add_argument("--no-preload", action="store_true",
+                        help="rien n'est chargé avant le fork (comparaison : équivaut à uvicorn --workers)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+    args.torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    # Tokenizers Rust : parallélisme désactivé avant tout chargement (sinon interblocage possible après fork)
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    try:
+        import torch  # noqa: F401  (chargé avant les modèles pour fixer ses threads)
+
+        set_torch_threads(1)
+    except ImportError:
+        pass
+
+    import server.app as server_app
+
+    if not args.no_preload:
+        forkable = server_app.VECTOR_BACKEND == "memmap"
+        preload(server_app, tenants=forkable)
+        if not forkable:
+            sync_indexes(server_app)
+    sock = bind_socket(args.host, args.port)
+    supervise(server_app, sock, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+from langchain.schema import Document
+
+from rag_core.context import ContextBuilder
+
+
+def test_short_sentences_contained_in_earlier_ones_are_kept():
+    docs = [Document(page_content="Intervention à Lyon et Paris. Disponible 24/7 pour les tournages."),
+            Document(page_content="Lyon. Disponible.")]
+    built = ContextBuilder(max_docs=3).build(docs)
+    assert built.text.splitlines()[1] == "Lyon. Disponible."
+    assert built.dropped == 0
+
+
+def test_sentences_repeated_by_overlapping_chunks_are_dropped():
+    docs = [Document(page_content="Ventousage à Paris. Devis sous 24h."),
+            Document(page_content="Devis sous 24h. Équipe disponible la nuit.")]
+    built = ContextBuilder(max_docs=3).build(docs)
+    assert built.text == "Ventousage à Paris. Devis sous 24h.\nÉquipe disponible la nuit."
+    assert built.dropped == 1
@@ -0,0 +1,20 @@
+from rag_core.scenarios import ScenarioClassifier, TriggerMatcher
+
+
+def test_hyphenated_trigger_matches_hyphen_and_space():
+    matcher = TriggerMatcher({"planning": ["week-end"]})
+    assert matcher.match("Disponible ce week-end ?") == {"planning": ["week end"]}
+    assert matcher.match("Disponible ce Week End ?") == {"planning": ["week end"]}
+
+
+def test_apostrophe_trigger_matches_straight_and_curly_quotes():
+    matcher = TriggerMatcher({"saison": ["l’été"], "demande": ["aujourd'hui"]})
+    assert matcher.match("Tournage pendant l'été") == {"saison": ["l'ete"]}
+    assert matcher.match("Tournage pendant L’ÉTÉ") == {"saison": ["l'ete"]}
+    assert matcher.match("Possible aujourd’hui ?") == {"demande": ["aujourd'hui"]}
+
+
+def test_classifier_label_with_punctuated_triggers():
+    classifier = ScenarioClassifier({"urgence": {"label": "Urgence", "declencheur": ["last-minute", "d’urgence"]}})
+    assert classifier.label("Besoin d'urgence, c'est du last minute") == "Urgence"
+    assert classifier.label("Quels sont vos horaires ?") == "Question générale"
@@ -0,0 +1,24 @@
+import numpy as np
+
+from rag_core.vector_index import MemmapVectorStore
+
+
+def test_filter_masks_stay_with_their_snapshot(tmp_path):
+    store = MemmapVectorStore(str(tmp_path))
+    store.add_embeddings(["a", "b"], np.eye(2), ["A", "B"], [{"type": "x"}, {"type": "y"}])
+    old = store._state
+    store.add_embeddings(["c"], [[1.0, 1.0]], ["C"], [{"type": "x"}])
+    # Une recherche commencée sur l'ancien instantané ne pollue pas le cache du nouveau
+    assert len(store._candidates(old, {"type": "x"})) == 2
+    hits = store.search_by_vectors([[1.0, 0.0]], k=3, filter={"type": "x"})[0]
+    assert [doc.page_content for doc, _ in hits] == ["A", "C"]
+
+
+def test_manifest_names_the_vectors_of_its_version(tmp_path):
+    store = MemmapVectorStore(str(tmp_path))
+    store.add_embeddings(["a", "b"], np.eye(2), ["A", "B"])
+    store.delete(["b"])
+    vectors = [p.name for p in tmp_path.glob("vectors*.npy")]
+    assert len(vectors) == 1
+    reopened = MemmapVectorStore(str(tmp_path))
+    assert reopened.count() == 1 and reopened._state.matrix.shape[0] == 1